@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Масштабирование export-report по числу процессов.
+
+Пример: python benchmarks/bench_export.py --users 50000 --workers 1,2,4,8
+Данные (шардированные портфели, users.json, rates.json) генерируются во временном каталоге.
+"""
+import argparse
+import filecmp
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def prepare(users: int) -> None:
+    from valutatrade_hub.infra.portfolio_store import PortfolioStore
+    from valutatrade_hub.infra.serializers import write_data
+    now = datetime.now(timezone.utc).isoformat()
+    rates = {'BTC_USD': 96000.0, 'ETH_USD': 3200.0, 'SOL_USD': 140.0, 'EUR_USD': 1.08, 'RUB_USD': 0.0123}
+    write_data('data/rates', {'pairs': {pair: {'rate': rate, 'updated_at': now, 'source': 'bench'}
+                                        for pair, rate in rates.items()}, 'last_refresh': now})
+    write_data('data/users', [{'user_id': i, 'username': f"user{i}", 'hashed_password': 'f' * 64,
+                               'salt': 'c8967ad0', 'registration_date': now} for i in range(1, users + 1)])
+    store = PortfolioStore('data')
+    codes = ('USD', 'BTC', 'ETH', 'SOL', 'EUR', 'RUB')
+    for user_id in range(1, users + 1):
+        wallets = {code: {'currency_code': code, 'balance': (user_id * 7 % 1000) / (i + 1)}
+                   for i, code in enumerate(codes[:1 + user_id % len(codes)])}
+        with store.locked([user_id]) as records:
+            records[user_id] = {'user_id': user_id, 'wallets': wallets}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--workers', default='1,2,4')
+    parser.add_argument('--bases', default='USD,EUR,RUB')
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp(prefix='valutatrade-export-')
+    os.chdir(workdir)
+    start = time.perf_counter()
+    prepare(args.users)
+    print(f"Сгенерировано {args.users} портфелей за {time.perf_counter() - start:.1f} с")
+
+    from valutatrade_hub.core.reports import export_report
+    bases = args.bases.split(',')
+    print(f"{'процессов':>9} {'время, с':>9} {'строк/с':>10} {'ускорение':>10}")
+    try:
+        run(export_report, bases, args.workers)
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def run(export_report, bases, workers_list: str) -> None:
+    reference = baseline = None
+    for workers in (int(w) for w in workers_list.split(',')):
+        out = f"report-{workers}.csv"
+        start = time.perf_counter()
+        result = export_report(out, bases, workers)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        if reference is None:
+            reference = out
+        elif not filecmp.cmp(reference, out, shallow=False):
+            raise SystemExit(f"{out} отличается от {reference}: слияние недетерминировано")
+        print(f"{workers:>9} {elapsed:>9.2f} {result['rows'] / elapsed:>10.0f} {baseline / elapsed:>9.2f}x")
+
+if __name__ == '__main__':
+    main()
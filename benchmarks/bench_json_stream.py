@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Сравнение json.load и потокового чтения на больших файлах данных.
+
+Пример: python benchmarks/bench_json_stream.py --size-mb 1024
+Каждый замер выполняется в отдельном процессе, чтобы пиковый RSS не смешивался.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from valutatrade_hub.infra.json_stream import find_first, iter_json_array  # noqa: E402
+
+def generate(path: str, size_mb: int) -> int:
+    target = size_mb * 1024 * 1024
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[\n')
+        written = 2
+        while written < target:
+            record = {
+                'user_id': count + 1,
+                'username': f"user{count + 1}",
+                'hashed_password': 'f' * 64,
+                'salt': 'abcd1234',
+                'registration_date': '2025-11-14T22:52:59.477186',
+            }
+            text = ('' if count == 0 else ',\n') + json.dumps(record, indent=2)
+            f.write(text)
+            written += len(text)
+            count += 1
+        f.write('\n]')
+    return count
+
+def worker(mode: str, path: str, target_id: int) -> None:
+    start = time.perf_counter()
+    first = None
+    if mode == 'json.load':
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        first = next((u for u in data if u['user_id'] == target_id), None)
+    elif mode == 'stream':
+        first = find_first(path, lambda u: u['user_id'] == target_id)
+    elif mode == 'stream-scan':
+        first = sum(1 for _ in iter_json_array(path))
+    elapsed = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'elapsed': elapsed, 'peak_kb': peak_kb, 'found': first is not None}))
+
+def run(mode: str, path: str, target_id: int) -> dict:
+    out = subprocess.check_output([sys.executable, __file__, '--worker', mode, '--path', path,
+                                   '--target', str(target_id)])
+    return json.loads(out)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size-mb', type=int, default=64)
+    parser.add_argument('--path', help='Готовый файл с массивом пользователей')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--target', type=int, default=1, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker, args.path, args.target)
+        return
+
+    tmp = None
+    path = args.path
+    if not path:
+        tmp = tempfile.NamedTemporaryFile(suffix='.json', delete=False)
+        tmp.close()
+        path = tmp.name
+        print(f"Генерация {args.size_mb} MB в {path}...")
+        total = generate(path, args.size_mb)
+    else:
+        total = sum(1 for _ in iter_json_array(path))
+    size_mb = os.path.getsize(path) / 1024 / 1024
+    print(f"Файл: {size_mb:.1f} MB, записей: {total}")
+    cases = [
+        ('json.load', 1, 'первый пользователь'),
+        ('stream', 1, 'первый пользователь'),
+        ('json.load', total // 2, 'середина'),
+        ('stream', total // 2, 'середина'),
+        ('stream-scan', 0, 'полный проход'),
+    ]
+    try:
+        print(f"{'режим':<12} {'цель':<20} {'время, с':>10} {'пик RSS, MB':>12}")
+        for mode, target_id, label in cases:
+            result = run(mode, path, target_id)
+            print(f"{mode:<12} {label:<20} {result['elapsed']:>10.3f} {result['peak_kb'] / 1024:>12.1f}")
+    finally:
+        if tmp:
+            os.unlink(path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""Задержка одной сделки в зависимости от числа пользователей: portfolios.json против шардов.
+
+Пример: python benchmarks/bench_portfolios.py --users 100,1000,10000,50000 --trades 200 --threads 8
+Сделка — чтение, изменение и запись портфеля под блокировкой, как в buy/sell.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from valutatrade_hub.infra.portfolio_store import PortfolioStore, migrate  # noqa: E402
+from valutatrade_hub.infra.serializers import write_data  # noqa: E402
+
+def portfolios(count: int) -> list:
+    return [{
+        'user_id': user_id,
+        'wallets': {
+            'USD': {'currency_code': 'USD', 'balance': 10000.0},
+            'BTC': {'currency_code': 'BTC', 'balance': 0.5},
+            'EUR': {'currency_code': 'EUR', 'balance': 250.0},
+        },
+    } for user_id in range(1, count + 1)]
+
+def trade(store: PortfolioStore, user_id: int) -> float:
+    start = time.perf_counter()
+    with store.locked([user_id]) as records:
+        wallets = records[user_id]['wallets']
+        wallets['BTC']['balance'] += 0.001
+        wallets['USD']['balance'] -= 96.0
+    return time.perf_counter() - start
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def run(store: PortfolioStore, users: int, trades: int, threads: int):
+    rng = random.Random(users)
+    user_ids = [rng.randint(1, users) for _ in range(trades)]
+    latencies = [trade(store, user_id) for user_id in user_ids]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(lambda user_id: trade(store, user_id), user_ids))
+    throughput = trades / (time.perf_counter() - start)
+    return percentile(latencies, 0.5), percentile(latencies, 0.99), throughput
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', default='100,1000,10000')
+    parser.add_argument('--trades', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+    print(f"{'пользователей':>13} {'раскладка':>10} {'p50, мс':>9} {'p99, мс':>9} {'сделок/с':>10}")
+    for users in (int(n) for n in args.users.split(',')):
+        data_dir = Path(tempfile.mkdtemp(prefix='valutatrade-portfolios-'))
+        try:
+            write_data(data_dir / 'portfolios', portfolios(users))
+            for layout in ('single', 'sharded'):
+                if layout == 'sharded':
+                    migrate(data_dir)
+                p50, p99, throughput = run(PortfolioStore(data_dir), users, args.trades, args.threads)
+                print(f"{users:>13} {layout:>10} {p50 * 1000:>9.2f} {p99 * 1000:>9.2f} {throughput:>10.0f}")
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Размер и скорость кодирования/декодирования: JSON (indent=2) против VTB1.
+
+Пример: python benchmarks/bench_serializers.py --records 200000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from valutatrade_hub.infra.serializers import BinarySerializer  # noqa: E402
+
+def history(count: int) -> list:
+    start = datetime(2025, 11, 15, 18, 0, 0)
+    pairs = ('BTC_USD', 'ETH_USD', 'SOL_USD', 'EUR_USD', 'GBP_USD', 'RUB_USD')
+    records = []
+    for i in range(count):
+        pair = pairs[i % len(pairs)]
+        timestamp = (start + timedelta(seconds=i * 10)).isoformat(timespec='microseconds') + 'Z'
+        records.append({
+            'id': f"{pair}_{timestamp}",
+            'from_currency': pair[:3],
+            'to_currency': 'USD',
+            'rate': 95951.0 + i * 0.01,
+            'timestamp': timestamp,
+            'source': 'CoinGecko',
+            'meta': {'request_ms': 0, 'status_code': 200},
+        })
+    return records
+
+def users(count: int) -> list:
+    start = datetime(2025, 11, 14, 22, 52, 59, 477186)
+    return [{
+        'user_id': i + 1,
+        'username': f"user{i + 1}",
+        'hashed_password': 'f' * 64,
+        'salt': 'c8967ad0',
+        'registration_date': start + timedelta(minutes=i),
+    } for i in range(count)]
+
+def measure(label: str, data: list, rounds: int) -> None:
+    binary = BinarySerializer()
+    as_json = [dict(item, registration_date=item['registration_date'].isoformat())
+               if 'registration_date' in item else item for item in data]
+
+    def timed(fn):
+        best = float('inf')
+        for _ in range(rounds):
+            start = time.perf_counter()
+            result = fn()
+            best = min(best, time.perf_counter() - start)
+        return best, result
+
+    json_enc, json_text = timed(lambda: json.dumps(as_json, indent=2, ensure_ascii=False))
+    json_dec, _ = timed(lambda: [
+        dict(item, registration_date=datetime.fromisoformat(item['registration_date']))
+        if 'registration_date' in item else item for item in json.loads(json_text)])
+    bin_enc, blob = timed(lambda: binary.encode(data))
+    bin_dec, decoded = timed(lambda: binary.decode(blob))
+    assert decoded == data, 'VTB1 round-trip mismatch'
+    json_size = len(json_text.encode('utf-8'))
+    print(f"\n{label}: {len(data)} записей")
+    print(f"{'формат':<14} {'размер, KB':>12} {'encode, мс':>12} {'decode, мс':>12}")
+    print(f"{'json indent=2':<14} {json_size / 1024:>12.1f} {json_enc * 1000:>12.1f} {json_dec * 1000:>12.1f}")
+    print(f"{'vtb1':<14} {len(blob) / 1024:>12.1f} {bin_enc * 1000:>12.1f} {bin_dec * 1000:>12.1f}")
+    print(f"размер: {len(blob) / json_size:.0%} от JSON")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--records', type=int, default=50000)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+    measure('exchange_rates (история)', history(args.records), args.rounds)
+    measure('users', users(args.records), args.rounds)
+
+if __name__ == '__main__':
+    main()
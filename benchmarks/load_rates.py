@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Нагрузочный прогон parser_service против локальной заглушки API.
+
+Пример: python benchmarks/load_rates.py --requests 500 --concurrency 16 --latency-ms 40 --error-rate 0.05
+Заглушка поднимается в этом же процессе (или используется внешняя через --url),
+все файлы данных пишутся во временный каталог.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from valutatrade_hub.core.exceptions import ApiRequestError  # noqa: E402
+from valutatrade_hub.parser_service.stub_server import COINGECKO_PATH, StubConfig, start_stub_server  # noqa: E402
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+def classify(error: Exception) -> str:
+    text = str(error)
+    if '429' in text or 'лимит' in text:
+        return 'rate-limited'
+    if 'timed out' in text.lower() or 'timeout' in text.lower():
+        return 'timeout'
+    if '500' in text or 'Server Error' in text:
+        return 'server-error'
+    return 'other'
+
+def report(title: str, latencies, failures, elapsed: float) -> None:
+    total = len(latencies) + sum(failures.values())
+    print(f"\n{title}")
+    print(f"  запросов: {total}, успешно: {len(latencies)}, за {elapsed:.2f} с → {total / elapsed:.1f} req/s")
+    if latencies:
+        print("  латентность, мс: "
+              f"p50={percentile(latencies, 0.5) * 1000:.1f} "
+              f"p95={percentile(latencies, 0.95) * 1000:.1f} "
+              f"p99={percentile(latencies, 0.99) * 1000:.1f} "
+              f"max={max(latencies) * 1000:.1f}")
+    if failures:
+        print(f"  ошибки: {dict(failures)}")
+
+def run_clients(config, requests_total: int, concurrency: int, bases) -> None:
+    from valutatrade_hub.parser_service.api_clients import CoinGeckoClient, ExchangeRateApiClient
+    clients = [CoinGeckoClient(config), ExchangeRateApiClient(config)]
+    latencies, failures = [], {}
+
+    def one(i: int):
+        client = clients[i % len(clients)]
+        base = bases[i % len(bases)]
+        start = time.perf_counter()
+        try:
+            client.fetch_rates(base)
+            return time.perf_counter() - start, None
+        except ApiRequestError as e:
+            return time.perf_counter() - start, classify(e)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for latency, failure in pool.map(one, range(requests_total)):
+            if failure:
+                failures[failure] = failures.get(failure, 0) + 1
+            else:
+                latencies.append(latency)
+    report(f"API-клиенты: {requests_total} вызовов, {concurrency} потоков", latencies, failures,
+           time.perf_counter() - start)
+    stats = clients[0].governor.stats
+    print(f"  governor: {stats}")
+
+def run_updates(config, rounds: int) -> None:
+    from valutatrade_hub.parser_service.scheduler import RateScheduler
+    from valutatrade_hub.parser_service.updater import RatesUpdater
+    updater = RatesUpdater(config)
+    latencies, failures = [], {}
+    start = time.perf_counter()
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        result = updater.run_update()
+        latencies.append(time.perf_counter() - t0)
+        if result['errors']:
+            failures['partial-update'] = failures.get('partial-update', 0) + 1
+    report(f"RatesUpdater.run_update: {rounds} прогонов", latencies, failures, time.perf_counter() - start)
+
+    scheduler = RateScheduler(config, updater.run_update)
+    t0 = time.perf_counter()
+    scheduler.run_once()
+    print(f"  RateScheduler.run_once: {(time.perf_counter() - t0) * 1000:.1f} мс")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='Базовый URL внешней заглушки, например http://127.0.0.1:8765')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--updates', type=int, default=20)
+    parser.add_argument('--bases', default='USD,EUR,GBP,RUB', help='Базовые валюты для запросов клиентов')
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--jitter-ms', type=float, default=20.0)
+    parser.add_argument('--error-rate', type=float, default=0.02)
+    parser.add_argument('--rate-429', type=float, default=0.01)
+    parser.add_argument('--payload-currencies', type=int, default=160)
+    parser.add_argument('--respect-limits', action='store_true',
+                        help='Оставить лимиты и кеш governor как в боевой конфигурации')
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.url
+    if not base_url:
+        server = start_stub_server(StubConfig(port=0, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                                              error_rate=args.error_rate, rate_429=args.rate_429,
+                                              payload_currencies=args.payload_currencies))
+        base_url = server.base_url
+    os.environ['COINGECKO_URL'] = base_url + COINGECKO_PATH
+    os.environ['EXCHANGERATE_API_URL'] = base_url + '/v6'
+    # заглушка ключ не проверяет, но без него клиент ExchangeRate-API не отправит запрос
+    os.environ.setdefault('EXCHANGERATE_API_KEY', 'stub')
+
+    workdir = tempfile.mkdtemp(prefix='valutatrade-load-')
+    os.chdir(workdir)
+    os.makedirs('data', exist_ok=True)
+    print(f"Заглушка: {base_url}, рабочий каталог: {workdir}")
+
+    from valutatrade_hub.parser_service.config import ParserConfig
+    config = ParserConfig()
+    config.GOVERNOR_STATE_DIR = os.path.join(workdir, 'data', '.governor')
+    if not args.respect_limits:
+        config.RATE_LIMITS_PER_MIN = {}
+        config.RESPONSE_CACHE_TTL = 0
+
+    run_clients(config, args.requests, args.concurrency, [b.strip().upper() for b in args.bases.split(',')])
+    run_updates(config, args.updates)
+    if server:
+        print(f"\nЗаглушка обработала {server.stats.requests} запросов, статусы: {server.stats.by_status}")
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,57 @@
 import argparse
+import cProfile
+import os
+import pstats
+import shlex
 import sys
-from typing import Optional
+import time
+
 from prettytable import PrettyTable
-from valutatrade_hub.core.usecases import (create_user, verify_user_login, get_portfolio, save_portfolio, get_user_by_id, buy, sell, get_rate)
-from valutatrade_hub.core.models import Portfolio, User
-from valutatrade_hub.core.utils import load_json, get_exchange_rate, load_session, save_session, clear_session
-from valutatrade_hub.core.exceptions import InsufficientFundsError, CurrencyNotFoundError, ApiRequestError
 
-current_user: Optional[User] = None
+from valutatrade_hub import tracing
+from valutatrade_hub.core import currencies
+from valutatrade_hub.core.exceptions import (
+    ApiRequestError,
+    CurrencyNotFoundError,
+    InsufficientFundsError,
+)
+from valutatrade_hub.core.ledger import get_pnl, get_trade_history
+from valutatrade_hub.core.models import User
+from valutatrade_hub.core.orders import cancel_order, list_orders, place_order
+from valutatrade_hub.core.usecases import (
+    buy,
+    create_user,
+    get_display_quote,
+    get_portfolio,
+    get_rate_quote,
+    get_user_by_id,
+    sell,
+    verify_user_login,
+)
+from valutatrade_hub.core.utils import (
+    clear_session,
+    get_exchange_rate,
+    load_rates_snapshot,
+    load_session,
+    normalize_rates_cache,
+    save_session,
+)
+
+try:
+    import readline
+except ImportError:  # Windows без pyreadline: shell работает без автодополнения
+    readline = None
+
+current_user: User | None = None
+REBALANCE_ROWS = 50
+STALE_NOTE = ("* курс устарел или взят из встроенного справочника — "
+              "выполните update-rates")
 
 def register(args):
     try:
         user = create_user(args.username, args.password)
-        print(f"Пользователь '{user.username}' зарегистрирован (id={user.user_id}). Войдите: login --username {user.username} --password ****")
+        print(f"Пользователь '{user.username}' зарегистрирован (id={user.user_id}). "
+              f"Войдите: login --username {user.username} --password ****")
     except ValueError as e:
         print(str(e))
 
@@ -42,16 +81,18 @@ def show_portfolio(args):
             return
         table = PrettyTable(['Currency', 'Balance', f'Value in {base}'])
         total = portfolio.get_total_value(base)
+        stale = False
         for code, wallet in portfolio.wallets.items():
-            if code == base:
-                value = wallet.balance
-            else:
-                rate = get_exchange_rate(code, base)
-                value = wallet.balance * (rate or 1.0)
-            table.add_row([code, f"{wallet.balance:.4f}", f"{value:.2f}"])
+            quote = None if code == base else get_display_quote(code, base)
+            value = wallet.balance * (quote.rate if quote else 1.0)
+            mark = ' *' if quote and quote.stale else ''
+            stale = stale or bool(mark)
+            table.add_row([code, f"{wallet.balance:.4f}", f"{value:.2f}{mark}"])
         print(f"Портфель пользователя '{current_user.username}' (база: {base}):")
         print(table)
         print(f"---------------------------------\nИТОГО: {total:.2f} {base}")
+        if stale:
+            print(STALE_NOTE)
     except ValueError as e:
         print(str(e) or f"Неизвестная базовая валюта '{args.base}'")
 
@@ -69,35 +110,42 @@ def update_rates(args):
     if args.source == 'coingecko':
         crypto_rates = updater.coingecko.fetch_rates(config.BASE_CURRENCY)
         updater.storage.save_rates_cache(crypto_rates, 'CoinGecko')
+        updater.process_orders(crypto_rates)
         print(f"Обновлено CoinGecko: {len(crypto_rates)} курсов")
     elif args.source == 'exchangerate':
         fiat_rates = updater.exrate.fetch_rates(config.BASE_CURRENCY)
         updater.storage.save_rates_cache(fiat_rates, 'ExchangeRate-API')
+        updater.process_orders(fiat_rates)
         print(f"Обновлено ExchangeRate-API: {len(fiat_rates)} курсов")
     else:
         result = updater.run_update()
-        print(f"Обновление успешно. Всего обновлено курсов: {result['updated']}. Ошибок: {result['errors']}")
+        print(f"Обновление успешно. Всего обновлено курсов: {result['updated']}. "
+              f"Ошибок: {result['errors']}")
+        if result['saved']:
+            print(f"Запросов к API сэкономлено (кеш/объединение): {result['saved']}")
         if result['errors']:
             print("Проверьте логи для деталей.")
 
 def show_rates(args):
-    data = load_json('rates.json')
-    if not data:
+    pairs = normalize_rates_cache(load_rates_snapshot())['pairs']
+    if not pairs:
         print("Локальный кеш курсов пуст. Выполните 'update-rates'.")
         return
-    pairs = data if 'pairs' not in data else data['pairs']
     base = (args.base or 'USD').upper()
     if args.currency:
         key = f"{args.currency.upper()}_{base}"
         if key in pairs:
             pair = pairs[key]
-            print(f"Курс {args.currency.upper()}→{base}: {pair['rate']} (обновлено: {pair['updated_at']}, {pair['source']})")
+            print(f"Курс {args.currency.upper()}→{base}: {pair['rate']} "
+                  f"(обновлено: {pair['updated_at']}, {pair['source']})")
         else:
             print(f"Курс для '{args.currency}' не найден в кеше.")
         return
     if args.top:
-        crypto_pairs = {k: v for k, v in pairs.items() if k.endswith('_USD') and k.startswith(('BTC', 'ETH', 'SOL'))}
-        sorted_crypto = sorted(crypto_pairs.items(), key=lambda x: (x[1]['rate'], x[0]), reverse=True)[:args.top]  
+        crypto_pairs = {k: v for k, v in pairs.items()
+                        if k.endswith('_USD') and k.startswith(('BTC', 'ETH', 'SOL'))}
+        sorted_crypto = sorted(crypto_pairs.items(), key=lambda x: (x[1]['rate'], x[0]),
+                               reverse=True)[:args.top]
         print(f"Top {args.top} крипто (база USD):")
         for pair_key, pair in sorted_crypto:
             print(f"- {pair_key}: {pair['rate']} ({pair['source']})")
@@ -105,25 +153,172 @@ def show_rates(args):
         print(f"Все курсы (база {base}):")
         for pair_key, pair in pairs.items():
             if pair_key.endswith(f"_{base}"):
-                print(f"- {pair_key}: {pair['rate']} ({pair['source']}, {pair['updated_at']})")
+                print(f"- {pair_key}: {pair['rate']} "
+                      f"({pair['source']}, {pair['updated_at']})")
 
 
 def get_rate(args):
     try:
         from_curr = args.from_.upper()
         to_curr = args.to.upper()
-        rate = get_rate(from_curr, to_curr) 
-        data = load_json('rates.json')
-        key = f"{from_curr}_{to_curr}"
-        updated = data.get(key, {}).get('updated_at', 'unknown')
-        print(f"Курс {from_curr}→{to_curr}: {rate:.8f} (обновлено: {updated})")
+        quote = get_rate_quote(from_curr, to_curr)
+        updated = quote.updated_at.isoformat() if quote.updated_at else 'unknown'
+        print(f"Курс {from_curr}→{to_curr}: {quote.rate:.8f} (обновлено: {updated})")
+        if quote.mock:
+            print("Курса нет в кеше — показано встроенное справочное значение. "
+                  "Выполните update-rates.")
+        elif quote.stale:
+            print("Курс устарел — показано последнее значение, "
+                  "обновление запущено в фоне.")
         rev_rate = get_exchange_rate(to_curr, from_curr)
         if rev_rate:
             print(f"Обратный курс {to_curr}→{from_curr}: {rev_rate:.2f}")
     except ValueError as e:
         print(str(e))
 
-def main():
+def place_order_cmd(args):
+    if not current_user:
+        print("Сначала выполните login")
+        return
+    order = place_order(current_user.user_id, args.side, args.type,
+                        args.currency.upper(), args.amount, args.price)
+    print(f"Ордер размещён: {order.describe()}")
+    print("Ордер будет исполнен при обновлении курсов, когда цена достигнет порога.")
+
+def show_orders(args):
+    if not current_user:
+        print("Сначала выполните login")
+        return
+    orders = list_orders(current_user.user_id)
+    if not orders:
+        print("Открытых ордеров нет.")
+        return
+    table = PrettyTable(['ID', 'Side', 'Type', 'Currency', 'Amount', 'Price (USD)',
+                         'Created'])
+    for order in orders:
+        table.add_row([order.order_id, order.side, order.order_type,
+                       order.currency_code, f"{order.amount:.4f}", f"{order.price:.2f}",
+                       order.created_at])
+    print(table)
+
+def cancel_order_cmd(args):
+    if not current_user:
+        print("Сначала выполните login")
+        return
+    order = cancel_order(current_user.user_id, args.id)
+    print(f"Ордер #{order.order_id} отменён")
+
+def show_history(args):
+    if not current_user:
+        print("Сначала выполните login")
+        return
+    trades, next_cursor = get_trade_history(current_user.user_id, args.limit,
+                                            args.before)
+    if not trades:
+        print("Сделок нет.")
+        return
+    table = PrettyTable(['ID', 'Time', 'Side', 'Currency', 'Amount', 'Rate (USD)',
+                         'Value (USD)', 'Source'])
+    for trade in trades:
+        table.add_row([trade.trade_id, trade.timestamp, trade.side, trade.currency_code,
+                       f"{trade.amount:.4f}", f"{trade.rate:.2f}",
+                       f"{trade.usd_value:.2f}", trade.source])
+    print(table)
+    if next_cursor:
+        print(f"Следующая страница: history --limit {args.limit} "
+              f"--before {next_cursor}")
+
+def show_pnl(args):
+    if not current_user:
+        print("Сначала выполните login")
+        return
+    report = get_pnl(current_user.user_id)
+    if not report:
+        print("В журнале сделок нет позиций.")
+        return
+    table = PrettyTable(['Currency', 'Quantity', 'Avg cost', 'Cost basis',
+                         'Market value', 'Unrealized', 'Realized'])
+    realized = unrealized = 0.0
+    for row in report:
+        market_value, open_value = row['market_value'], row['unrealized_pnl']
+        market = f"{market_value:.2f}" if market_value is not None else 'N/A'
+        if row['market_stale']:
+            market += ' *'
+        open_pnl = f"{open_value:+.2f}" if open_value is not None else 'N/A'
+        table.add_row([row['currency_code'], f"{row['quantity']:.4f}",
+                       f"{row['average_cost']:.2f}", f"{row['cost_basis']:.2f}",
+                       market, open_pnl, f"{row['realized_pnl']:+.2f}"])
+        realized += row['realized_pnl']
+        unrealized += row['unrealized_pnl'] or 0.0
+    print(f"P&L пользователя '{current_user.username}' (USD, метод средней цены):")
+    print(table)
+    print(f"Реализованный: {realized:+.2f} USD, нереализованный: {unrealized:+.2f} USD")
+    if any(row['market_stale'] for row in report):
+        print(STALE_NOTE)
+
+def compact_data_cmd(args):
+    from valutatrade_hub.parser_service.compaction import compact_data
+    from valutatrade_hub.parser_service.config import ParserConfig
+    config = ParserConfig()
+    if args.full_hours is not None:
+        config.HISTORY_FULL_RESOLUTION_HOURS = args.full_hours
+    if args.hourly_days is not None:
+        config.HISTORY_HOURLY_DAYS = args.hourly_days
+    if args.retention_days is not None:
+        config.HISTORY_RETENTION_DAYS = args.retention_days
+    reports = compact_data(config)
+    table = PrettyTable(['File', 'Records', 'Bytes', 'Duplicates', 'Downsampled',
+                         'Dropped', 'Repaired'])
+    for report in reports:
+        table.add_row([report.name, f"{report.records_before} → {report.records_after}",
+                       f"{report.bytes_before} → {report.bytes_after}",
+                       report.duplicates, report.downsampled, report.dropped,
+                       report.repaired])
+    print(table)
+    print(f"Освобождено: {sum(r.reclaimed for r in reports)} байт")
+
+def export_report_cmd(args):
+    from valutatrade_hub.core.reports import export_report
+    bases = [code.strip().upper() for code in args.bases.split(',') if code.strip()]
+    started = time.perf_counter()
+    result = export_report(args.out, bases, args.workers)
+    elapsed = time.perf_counter() - started
+    print(f"Отчёт записан в {args.out}: {result['rows']} строк, "
+          f"{result['users']} пользователей ({result['workers']} процессов, "
+          f"{result['chunks']} частей, {elapsed:.2f} с)")
+    print(f"Снимок курсов: {result['snapshot_time'] or 'кеш пуст'}")
+
+def rebalance_cmd(args):
+    from valutatrade_hub.core.rebalance import parse_targets, rebalance
+    if not args.all and not current_user:
+        print("Сначала выполните login (или укажите --all)")
+        return
+    targets = parse_targets(args.targets)
+    user_ids = None if args.all else [current_user.user_id]
+    result = rebalance(targets, user_ids, args.tolerance, args.dry_run)
+    trades = result['trades']
+    if trades:
+        table = PrettyTable(['User', 'Side', 'Currency', 'Amount', 'Rate (USD)',
+                             'Value (USD)'])
+        for trade in trades[:REBALANCE_ROWS]:
+            value = trade['amount'] * trade['rate']
+            table.add_row([trade['user_id'], trade['side'], trade['currency_code'],
+                           f"{trade['amount']:.8f}", f"{trade['rate']:.4f}",
+                           f"{value:.2f}"])
+        print(table)
+        if len(trades) > REBALANCE_ROWS:
+            print(f"... и ещё {len(trades) - REBALANCE_ROWS} сделок")
+    for user_id, reason in result['skipped']:
+        print(f"Пользователь {user_id} пропущен: {reason}")
+    turnover = sum(trade['amount'] * trade['rate'] for trade in trades)
+    users = len({trade['user_id'] for trade in trades})
+    verb = 'Будет выполнено' if result['dry_run'] else 'Выполнено'
+    print(f"{verb} сделок: {len(trades)} у {users} из {result['users']} пользователей, "
+          f"оборот {turnover:.2f} USD (курсы на {result['snapshot_time'] or 'N/A'})")
+    if not trades:
+        print(f"Портфели в пределах допуска ±{args.tolerance:g} п.п.")
+
+def restore_session() -> None:
     global current_user
     session_id = load_session()
     if session_id:
@@ -132,7 +327,16 @@ def main():
             current_user = user
         else:
             clear_session()
+
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description='ValutaTrade Hub CLI')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='Записать трассу команды: *.json — Chrome trace, '
+                             'иначе collapsed stacks для flamegraph')
+    parser.add_argument('--trace-format', choices=['collapsed', 'chrome'],
+                        help='Формат трассы (по умолчанию — по расширению)')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='Сохранить профиль cProfile (pstats) в файл')
     subparsers = parser.add_subparsers(dest='command', help='Доступные команды')
     reg = subparsers.add_parser('register', help='Регистрация нового пользователя')
     reg.add_argument('--username', required=True, help='Имя пользователя (уникальное)')
@@ -141,60 +345,288 @@ def main():
     log.add_argument('--username', required=True)
     log.add_argument('--password', required=True)
     pf = subparsers.add_parser('show-portfolio', help='Показать портфель')
-    pf.add_argument('--base', default='USD', help='Базовая валюта для конвертации (по умолчанию USD)')
+    pf.add_argument('--base', default='USD',
+                    help='Базовая валюта для конвертации (по умолчанию USD)')
     buy_p = subparsers.add_parser('buy', help='Купить валюту')
     buy_p.add_argument('--currency', required=True, help='Код валюты (e.g., BTC, EUR)')
-    buy_p.add_argument('--amount', type=float, required=True, help='Количество для покупки')
+    buy_p.add_argument('--amount', type=float, required=True,
+                       help='Количество для покупки')
     sell_p = subparsers.add_parser('sell', help='Продать валюту')
     sell_p.add_argument('--currency', required=True, help='Код валюты')
-    sell_p.add_argument('--amount', type=float, required=True, help='Количество для продажи')
+    sell_p.add_argument('--amount', type=float, required=True,
+                        help='Количество для продажи')
     rate_p = subparsers.add_parser('get-rate', help='Получить курс валют')
-    rate_p.add_argument('--from', dest='from_', required=True, help='Исходная валюта (e.g., USD)')
+    rate_p.add_argument('--from', dest='from_', required=True,
+                        help='Исходная валюта (e.g., USD)')
     rate_p.add_argument('--to', required=True, help='Целевая валюта (e.g., BTC)')
-    logout_p = subparsers.add_parser('logout', help='Выход из системы')
+    subparsers.add_parser('logout', help='Выход из системы')
     update_p = subparsers.add_parser('update-rates', help='Обновить курсы')
-    update_p.add_argument('--source', choices=['coingecko', 'exchangerate', 'all'], default='all', help='Источник (default: all)')
+    update_p.add_argument('--source', choices=['coingecko', 'exchangerate', 'all'],
+                          default='all', help='Источник (default: all)')
     show_rates_p = subparsers.add_parser('show-rates', help='Показать курсы')
     show_rates_p.add_argument('--currency', help='Курс для валюты')
     show_rates_p.add_argument('--top', type=int, help='Top N крипты')
     show_rates_p.add_argument('--base', default='USD', help='База')
+    order_p = subparsers.add_parser('place-order',
+                                    help='Разместить лимитный или стоп-ордер')
+    order_p.add_argument('--side', choices=['buy', 'sell'], required=True,
+                         help='Покупка или продажа')
+    order_p.add_argument('--type', choices=['limit', 'stop'], required=True,
+                         help='Тип ордера')
+    order_p.add_argument('--currency', required=True, help='Код валюты')
+    order_p.add_argument('--amount', type=float, required=True, help='Количество')
+    order_p.add_argument('--price', type=float, required=True,
+                         help='Пороговый курс в USD')
+    subparsers.add_parser('orders', help='Показать открытые ордера')
+    cancel_p = subparsers.add_parser('cancel-order', help='Отменить ордер')
+    cancel_p.add_argument('--id', type=int, required=True, help='Номер ордера')
+    history_p = subparsers.add_parser('history', help='История сделок (новые сверху)')
+    history_p.add_argument('--limit', type=int, default=50,
+                           help='Размер страницы (по умолчанию 50)')
+    history_p.add_argument('--before', type=int,
+                           help='Показать сделки с номером меньше указанного')
+    subparsers.add_parser('pnl', help='Себестоимость позиций и P&L по журналу сделок')
+    compact_p = subparsers.add_parser('compact-data',
+                                      help='Починить кеш курсов и проредить историю')
+    compact_p.add_argument('--full-hours', type=int,
+                           help='Сколько часов хранить историю без прореживания')
+    compact_p.add_argument('--hourly-days', type=int,
+                           help='Сколько дней хранить почасовые точки '
+                                '(дальше — дневные)')
+    compact_p.add_argument('--retention-days', type=int,
+                           help='Удалять историю старше N дней (0 — не удалять)')
+    export_p = subparsers.add_parser('export-report',
+                                     help='CSV со всеми кошельками всех пользователей')
+    export_p.add_argument('--bases', default='USD',
+                          help='Базовые валюты через запятую (e.g., USD,EUR,RUB)')
+    export_p.add_argument('--out', default='report.csv', help='Файл отчёта')
+    export_p.add_argument('--workers', type=int,
+                          help='Число процессов (по умолчанию — число ядер)')
+    rebalance_p = subparsers.add_parser(
+        'rebalance', help='Привести портфель к целевым долям '
+                          '(покупки оплачиваются из USD, в отличие от buy)')
+    rebalance_p.add_argument('--targets', required=True,
+                             help='Целевые доли в процентах '
+                                  '(e.g., USD=50,BTC=30,EUR=20)')
+    rebalance_p.add_argument('--all', action='store_true',
+                             help='Ребалансировать всех пользователей')
+    rebalance_p.add_argument('--tolerance', type=float, default=1.0,
+                             help='Допустимое отклонение доли в процентных пунктах '
+                                  '(по умолчанию 1.0)')
+    rebalance_p.add_argument('--dry-run', action='store_true',
+                             help='Только показать план сделок')
+    subparsers.add_parser('shell', help='Интерактивный режим: сессия и кеши '
+                                        'сохраняются между командами')
+    return parser
+
+def dispatch(args) -> None:
+    with tracing.span(f"command.{args.command}"):
+        try:
+            if args.command == 'register':
+                register(args)
+            elif args.command == 'login':
+                login(args)
+            elif args.command == 'show-portfolio':
+                show_portfolio(args)
+            elif args.command in ('buy', 'sell') and not current_user:
+                print("Сначала выполните login")
+            elif args.command == 'buy':
+                buy(current_user.user_id, args.currency.upper(), float(args.amount))
+            elif args.command == 'sell':
+                sell(current_user.user_id, args.currency.upper(), float(args.amount))
+            elif args.command == 'get-rate':
+                get_rate(args)
+            elif args.command == 'logout':
+                logout(args)
+            elif args.command == 'update-rates':
+                update_rates(args)
+            elif args.command == 'show-rates':
+                show_rates(args)
+            elif args.command == 'place-order':
+                place_order_cmd(args)
+            elif args.command == 'orders':
+                show_orders(args)
+            elif args.command == 'cancel-order':
+                cancel_order_cmd(args)
+            elif args.command == 'history':
+                show_history(args)
+            elif args.command == 'pnl':
+                show_pnl(args)
+            elif args.command == 'compact-data':
+                compact_data_cmd(args)
+            elif args.command == 'export-report':
+                export_report_cmd(args)
+            elif args.command == 'rebalance':
+                rebalance_cmd(args)
+        except InsufficientFundsError as e:
+            print(str(e))
+        except CurrencyNotFoundError as e:
+            print(str(e))
+            print(f"Поддерживаемые коды: {currencies.describe_supported()}. "
+                  "Используйте help get-rate.")
+        except ApiRequestError as e:
+            print(str(e))
+            print("Повторите попытку позже или проверьте сеть.")
+        except ValueError as e:
+            print(f"Ошибка валидации: {e}")
+        except Exception as e:
+            print(f"Неожиданная ошибка: {e}")
+
+SHELL_COMMANDS = ['help', 'timing', 'exit', 'quit']
+CURRENCY_OPTIONS = ('--currency', '--from', '--to', '--base')
+HISTORY_FILE = os.path.expanduser('~/.valutatrade_history')
+
+def _command_options(parser: argparse.ArgumentParser) -> dict[str, list[str]]:
+    options = {}
+    for action in parser._actions:
+        if isinstance(action, argparse._SubParsersAction):
+            for name, sub in action.choices.items():
+                options[name] = [opt for a in sub._actions for opt in a.option_strings
+                                 if opt.startswith('--') and opt != '--help']
+    return options
+
+def _make_completer(parser: argparse.ArgumentParser):
+    commands = _command_options(parser)
+    commands.pop('shell', None)
+    codes = sorted(currencies.SUPPORTED_CODES)
+
+    def complete(text: str, state: int) -> str | None:
+        buffer = readline.get_line_buffer()
+        tokens = buffer.split()
+        if buffer.endswith(' '):
+            tokens.append('')
+        if len(tokens) <= 1:
+            matches = [c + ' ' for c in list(commands) + SHELL_COMMANDS
+                       if c.startswith(text)]
+        elif tokens[-2] in CURRENCY_OPTIONS:
+            matches = [c + ' ' for c in codes if c.startswith(text.upper())]
+        elif tokens[0] == 'timing':
+            matches = [m + ' ' for m in ('on', 'off') if m.startswith(text)]
+        else:
+            matches = [o + ' ' for o in commands.get(tokens[0], [])
+                       if o.startswith(text) and o not in tokens]
+        return matches[state] if state < len(matches) else None
+    return complete
+
+def _setup_readline(parser: argparse.ArgumentParser) -> None:
+    if readline is None:
+        return
+    readline.set_completer(_make_completer(parser))
+    readline.set_completer_delims(' \t\n')
+    if 'libedit' in (readline.__doc__ or ''):
+        readline.parse_and_bind('bind ^I rl_complete')
+    else:
+        readline.parse_and_bind('tab: complete')
+    try:
+        readline.read_history_file(HISTORY_FILE)
+    except OSError:
+        pass
+
+def run_shell(parser: argparse.ArgumentParser) -> None:
+    # один процесс на всю сессию: настройки, реестр валют, DatabaseManager, снимок
+    # курсов и вошедший пользователь остаются в памяти, файлы перечитываются только
+    # после изменения
+    _setup_readline(parser)
+    timing = False
+    print("ValutaTrade Hub shell. help — список команд, Tab — автодополнение, "
+          "exit — выход.")
+    while True:
+        if current_user:
+            prompt = f"valutatrade({current_user.username})> "
+        else:
+            prompt = 'valutatrade> '
+        try:
+            line = input(prompt).strip()
+        except EOFError:
+            print()
+            break
+        except KeyboardInterrupt:
+            print()
+            continue
+        if not line:
+            continue
+        try:
+            tokens = shlex.split(line)
+        except ValueError as e:
+            print(f"Ошибка разбора команды: {e}")
+            continue
+        command = tokens[0]
+        if command in ('exit', 'quit'):
+            break
+        if command == 'help':
+            parser.print_help()
+            print("\nКоманды shell: timing on|off — время выполнения команд, "
+                  "exit — выход")
+            continue
+        if command == 'timing':
+            if len(tokens) != 2 or tokens[1] not in ('on', 'off'):
+                print("Использование: timing on|off")
+                continue
+            timing = tokens[1] == 'on'
+            print(f"Замер времени {'включён' if timing else 'выключен'}")
+            continue
+        if command == 'shell':
+            print("Вы уже в режиме shell")
+            continue
+        try:
+            args = parser.parse_args(tokens)
+        except SystemExit:
+            # argparse уже вывел ошибку или справку — shell продолжает работу
+            continue
+        start = time.perf_counter()
+        dispatch(args)
+        if timing:
+            print(f"[{command}: {(time.perf_counter() - start) * 1000:.1f} мс]")
+    if readline is not None:
+        try:
+            readline.write_history_file(HISTORY_FILE)
+        except OSError:
+            pass
+
+def _run(args, parser: argparse.ArgumentParser) -> None:
+    with tracing.span('session.restore'):
+        restore_session()
+    if args.command == 'shell':
+        run_shell(parser)
+    else:
+        dispatch(args)
+
+def _report_trace(tracer: tracing.Tracer, path: str, fmt: str | None) -> None:
+    fmt = tracer.write(path, fmt)
+    print(f"\nТрасса ({fmt}, спанов: {len(tracer.spans)}) записана в {path}",
+          file=sys.stderr)
+    print(f"{'спан':<32} {'вызовов':>6} {'время':>13} {'данные':>14}", file=sys.stderr)
+    for line in tracer.summary():
+        print(line, file=sys.stderr)
 
-    args = parser.parse_args()
+def main(argv: list[str] | None = None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
     if not args.command:
         parser.print_help()
         sys.exit(1)
-
+    if not args.trace and not args.profile:
+        _run(args, parser)
+        return
+    # трассировка и профилирование включаются только по флагу — без него код идёт
+    # по обычному пути
+    tracer = tracing.enable() if args.trace else None
+    profiler = cProfile.Profile() if args.profile else None
     try:
-        if args.command == 'register':
-            register(args)
-        elif args.command == 'login':
-            login(args)
-        elif args.command == 'show-portfolio':
-            show_portfolio(args)
-        elif args.command == 'buy':
-            buy(current_user.user_id, args.currency.upper(), float(args.amount))
-        elif args.command == 'sell':
-            sell(current_user.user_id, args.currency.upper(), float(args.amount))
-        elif args.command == 'get-rate':
-            get_rate(args)
-        elif args.command == 'logout':
-            logout(args)
-        elif args.command == 'update-rates':
-            update_rates(args)
-        elif args.command == 'show-rates':
-            show_rates(args)
-    except InsufficientFundsError as e:
-        print(str(e))
-    except CurrencyNotFoundError as e:
-        print(str(e))
-        print("Поддерживаемые коды: USD, EUR, RUB, BTC, ETH. Используйте help get-rate.")
-    except ApiRequestError as e:
-        print(str(e))
-        print("Повторите попытку позже или проверьте сеть.")
-    except ValueError as e:
-        print(f"Ошибка валидации: {e}")
-    except Exception as e:
-        print(f"Неожиданная ошибка: {e}")
+        if profiler:
+            profiler.runcall(_run, args, parser)
+        else:
+            _run(args, parser)
+    finally:
+        if tracer:
+            tracing.disable()
+            _report_trace(tracer, args.trace, args.trace_format)
+        if profiler:
+            profiler.dump_stats(args.profile)
+            print(f"\nПрофиль cProfile записан в {args.profile} "
+                  f"(python -m pstats {args.profile})", file=sys.stderr)
+            stats = pstats.Stats(profiler, stream=sys.stderr)
+            stats.sort_stats('cumulative').print_stats(15)
 
 if __name__ == '__main__':
     main()
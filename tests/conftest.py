@@ -0,0 +1,29 @@
+import json
+
+import pytest
+
+from valutatrade_hub.core import currencies
+from valutatrade_hub.infra import serializers
+from valutatrade_hub.infra.settings import SingletonMeta
+
+TEST_SETTINGS = {
+    'data_dir': 'data',
+    'rates_ttl_seconds': 300,
+    'rates_stale_grace_seconds': 3600,
+    'rates_trade_max_age_seconds': 600,
+    'rates_background_refresh': False,
+}
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # все пути в приложении относительные (data/, config.json): каждый тест — в своём каталоге
+    # со сброшенными синглтонами, кешем чтения и встроенным реестром валют
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data').mkdir()
+    (tmp_path / 'config.json').write_text(json.dumps(TEST_SETTINGS), encoding='utf-8')
+    SingletonMeta._instances.clear()
+    serializers._READ_CACHE.clear()
+    currencies.reload_registry()
+    yield tmp_path
+    SingletonMeta._instances.clear()
+    serializers._READ_CACHE.clear()
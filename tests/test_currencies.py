@@ -0,0 +1,38 @@
+import json
+import multiprocessing
+
+from valutatrade_hub.core import currencies
+
+def test_crypto_without_coingecko_id_is_not_registered():
+    assert currencies.register_codes(['NEWC'], 'crypto', persist=True) == []
+    assert not currencies.is_supported('NEWC')
+
+def test_crypto_registration_persists_coingecko_id(workdir):
+    added = currencies.register_codes(['NEWC'], 'crypto', persist=True, coingecko_ids={'NEWC': 'new-coin'})
+    assert added == ['NEWC']
+    data = json.loads((workdir / 'data' / 'currencies.json').read_text(encoding='utf-8'))
+    entry = next(e for e in data['crypto'] if e['code'] == 'NEWC')
+    assert entry['coingecko_id'] == 'new-coin'
+    currencies.reload_registry()
+    assert currencies.get_currency('NEWC').coingecko_id == 'new-coin'
+
+def _register_many(prefix: str) -> None:
+    for i in range(15):
+        currencies.register_codes([f"{prefix}{chr(65 + i)}"], 'fiat', persist=True)
+
+def test_concurrent_registration_keeps_all_codes(workdir):
+    ctx = multiprocessing.get_context('fork')
+    workers = [ctx.Process(target=_register_many, args=(prefix,)) for prefix in ('XA', 'XB', 'XC')]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    data = json.loads((workdir / 'data' / 'currencies.json').read_text(encoding='utf-8'))
+    codes = {e['code'] for e in data['fiat']}
+    assert {f"{p}{chr(65 + i)}" for p in ('XA', 'XB', 'XC') for i in range(15)} <= codes
+
+def test_supported_codes_hint_comes_from_registry():
+    currencies.register_codes(['ZZZ'], 'fiat')
+    hint = currencies.describe_supported()
+    assert hint.startswith('USD, EUR, RUB, BTC, ETH, SOL')
+    assert f"всего {len(currencies.SUPPORTED_CODES)}" in hint
@@ -0,0 +1,129 @@
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+from valutatrade_hub.core.exceptions import ApiRequestError
+from valutatrade_hub.parser_service.governor import RequestGovernor
+
+def make_governor(tmp_path, cache_ttl=0.0):
+    return RequestGovernor(tmp_path / 'governor', {}, cache_ttl, max_wait=1.0)
+
+def test_requests_counted_without_cache(tmp_path):
+    governor = make_governor(tmp_path)
+    for _ in range(3):
+        governor.call('p', 'USD', lambda: {'BTC_USD': 1.0})
+    assert governor.totals('p')['requests'] == 3
+    assert governor.snapshot()['requests'] == 3
+
+def test_failed_upstream_call_is_counted(tmp_path):
+    governor = make_governor(tmp_path)
+
+    def fail():
+        raise ApiRequestError('boom')
+    with pytest.raises(ApiRequestError):
+        governor.call('p', 'USD', fail)
+    assert governor.totals('p')['requests'] == 1
+
+def test_concurrent_identical_calls_are_coalesced(tmp_path):
+    governor = make_governor(tmp_path)
+    calls = []
+    started = threading.Event()
+
+    def fetch():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return {'BTC_USD': 1.0}
+    results = []
+    leader = threading.Thread(target=lambda: results.append(governor.call('p', 'USD', fetch)))
+    leader.start()
+    started.wait()
+    followers = [threading.Thread(target=lambda: results.append(governor.call('p', 'USD', fetch)))
+                 for _ in range(4)]
+    for thread in followers:
+        thread.start()
+    for thread in [leader] + followers:
+        thread.join()
+    assert len(calls) == 1
+    assert results == [{'BTC_USD': 1.0}] * 5
+    stats = governor.snapshot()
+    assert stats['requests'] == 1 and stats['coalesced'] == 4
+
+def test_cache_hit_is_reported_per_run(tmp_path):
+    governor = make_governor(tmp_path, cache_ttl=60.0)
+    governor.call('p', 'USD', lambda: {'BTC_USD': 1.0})
+    before = governor.snapshot()
+    governor.call('p', 'USD', lambda: {'BTC_USD': 2.0})
+    delta = {name: value - before[name] for name, value in governor.snapshot().items()}
+    assert delta == {'requests': 0, 'cache_hits': 1, 'coalesced': 0, 'throttled': 0}
+
+def test_follower_of_failed_call_is_not_counted_as_saved(tmp_path):
+    governor = make_governor(tmp_path)
+    started = threading.Event()
+
+    def fail():
+        started.set()
+        time.sleep(0.2)
+        raise ApiRequestError('boom')
+    errors = []
+
+    def call():
+        try:
+            governor.call('p', 'USD', fail)
+        except ApiRequestError as e:
+            errors.append(e)
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=call)
+    follower.start()
+    for thread in (leader, follower):
+        thread.join()
+    assert len(errors) == 2
+    assert governor.snapshot()['coalesced'] == 0
+    assert governor.totals('p') == {'requests': 1, 'saved': 0}
+
+def _call_in_process(state_dir, marker_dir, delay):
+    def fetch():
+        (marker_dir / f"fetch-{time.time_ns()}").touch()
+        time.sleep(delay)
+        return {'BTC_USD': 1.0}
+    RequestGovernor(state_dir, {}, 0.0, max_wait=1.0).call('p', 'USD', fetch)
+
+def test_identical_calls_from_other_processes_are_coalesced(tmp_path):
+    state_dir, marker_dir = tmp_path / 'governor', tmp_path / 'markers'
+    marker_dir.mkdir()
+    ctx = multiprocessing.get_context('fork')
+    leader = ctx.Process(target=_call_in_process, args=(state_dir, marker_dir, 0.5))
+    leader.start()
+    while not any(marker_dir.iterdir()):
+        time.sleep(0.01)
+    followers = [ctx.Process(target=_call_in_process, args=(state_dir, marker_dir, 0.0)) for _ in range(3)]
+    for worker in followers:
+        worker.start()
+    for worker in [leader] + followers:
+        worker.join()
+        assert worker.exitcode == 0
+    assert len(list(marker_dir.iterdir())) == 1
+    assert RequestGovernor(state_dir, {}, 0.0, max_wait=1.0).totals('p') == {'requests': 1, 'saved': 3}
+
+def test_throttled_call_waits_for_a_token(tmp_path):
+    # 600 в минуту — новый токен через 0.1 с, это меньше MAX_THROTTLE_WAIT
+    governor = RequestGovernor(tmp_path / 'governor', {'p': 600}, 0.0, max_wait=1.0)
+    governor.drain('p')
+    started = time.monotonic()
+    assert governor.call('p', 'USD', lambda: {'BTC_USD': 1.0}) == {'BTC_USD': 1.0}
+    assert time.monotonic() - started >= 0.05
+    assert governor.snapshot()['throttled'] == 1 and governor.snapshot()['requests'] == 1
+
+def test_throttle_longer_than_max_wait_fails_without_request(tmp_path):
+    governor = RequestGovernor(tmp_path / 'governor', {'p': 6}, 0.0, max_wait=0.5)
+    governor.drain('p')
+    calls = []
+    with pytest.raises(ApiRequestError):
+        governor.call('p', 'USD', lambda: calls.append(1) or {'BTC_USD': 1.0})
+    assert calls == []
+    assert governor.snapshot()['throttled'] == 1
+    assert governor.totals('p')['requests'] == 0
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from valutatrade_hub.infra.json_stream import find_first, iter_json_array
+
+ITEMS = [
+    {'user_id': 1, 'username': 'alice', 'balance': 1234.5678},
+    {'user_id': 22, 'username': 'bob, "the builder" ]', 'tags': ['a', 'b'], 'balance': -0.5e-3},
+    {'user_id': 333, 'username': 'ёжик\n\\', 'nested': {'x': [1, [2, [3]]]}},
+    123456789,
+    'строка',
+    None,
+    [],
+]
+
+def write(tmp_path, text):
+    path = tmp_path / 'data.json'
+    path.write_text(text, encoding='utf-8')
+    return path
+
+@pytest.mark.parametrize('chunk_size', list(range(1, 17)) + [64, 4096])
+def test_items_split_on_any_chunk_boundary(tmp_path, chunk_size):
+    path = write(tmp_path, json.dumps(ITEMS, ensure_ascii=False, indent=2))
+    assert list(iter_json_array(path, chunk_size=chunk_size)) == ITEMS
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 4096])
+def test_whitespace_around_items_and_commas(tmp_path, chunk_size):
+    path = write(tmp_path, '\n\t [\r\n 1 ,\n\n2.50\t,  {"a" : [ 1 , 2 ] }  ,"x"\n]\n  ')
+    assert list(iter_json_array(path, chunk_size=chunk_size)) == [1, 2.5, {'a': [1, 2]}, 'x']
+
+@pytest.mark.parametrize('text', ['', '   \n', '[]', ' [ \n ] '])
+def test_empty_input_yields_nothing(tmp_path, text):
+    assert list(iter_json_array(write(tmp_path, text), chunk_size=2)) == []
+
+def test_number_cut_by_chunk_is_read_whole(tmp_path):
+    path = write(tmp_path, '[12345678901234567890, 1.25e10]')
+    for chunk_size in range(1, 12):
+        assert list(iter_json_array(path, chunk_size=chunk_size)) == [12345678901234567890, 1.25e10]
+
+def test_predicate_filters_items(tmp_path):
+    path = write(tmp_path, json.dumps(ITEMS))
+    found = list(iter_json_array(path, lambda item: isinstance(item, dict) and item['user_id'] > 1, chunk_size=5))
+    assert [item['user_id'] for item in found] == [22, 333]
+
+def test_iteration_stops_before_the_rest_of_the_file(tmp_path):
+    # хвост файла испорчен: раз он не читается, ошибки нет
+    path = write(tmp_path, '[{"user_id": 1}, {"user_id": 2}, ' + 'x' * 1000)
+    items = iter_json_array(path, chunk_size=8)
+    assert next(items) == {'user_id': 1}
+    assert next(items) == {'user_id': 2}
+    assert find_first(path, lambda item: item['user_id'] == 2) == {'user_id': 2}
+
+def test_find_first_reads_past_the_first_chunk(tmp_path):
+    items = [{'user_id': i, 'padding': 'p' * 100} for i in range(2000)]
+    path = write(tmp_path, json.dumps(items))
+    assert find_first(path, lambda item: item['user_id'] == 1500) == items[1500]
+    assert find_first(path, lambda item: item['user_id'] == -1) is None
+
+def test_top_level_object_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        list(iter_json_array(write(tmp_path, ' {"user_id": 1}')))
+
+@pytest.mark.parametrize('text', ['[1, 2', '[{"a": 1}, {"a": ', '[1 2]', '["unterminated]', '[1, tru]'])
+@pytest.mark.parametrize('chunk_size', [1, 4, 4096])
+def test_malformed_array_raises(tmp_path, text, chunk_size):
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_array(write(tmp_path, text), chunk_size=chunk_size))
@@ -0,0 +1,85 @@
+import json
+import multiprocessing
+import struct
+from datetime import datetime, timezone
+
+import pytest
+
+from valutatrade_hub.core import ledger, usecases
+from valutatrade_hub.core.exceptions import InsufficientFundsError
+from valutatrade_hub.core.ledger import Ledger
+
+def write_fresh_rates(workdir, pairs):
+    now = datetime.now(timezone.utc).isoformat()
+    cache = {'pairs': {pair: {'rate': rate, 'updated_at': now, 'source': 'test'} for pair, rate in pairs.items()},
+             'last_refresh': now}
+    (workdir / 'data' / 'rates.json').write_text(json.dumps(cache), encoding='utf-8')
+
+def test_settlement_buy_is_not_a_trade(workdir):
+    user = usecases.create_user('alice', 'secret')
+    usecases.buy(user.user_id, 'USD', 100.0)
+    assert usecases.get_portfolio(user.user_id).get_wallet('USD').balance == 100.0
+    assert Ledger().history(user.user_id) == ([], None)
+
+def test_trade_is_recorded_after_portfolio_commit(workdir, monkeypatch):
+    user = usecases.create_user('alice', 'secret')
+    write_fresh_rates(workdir, {'EUR_USD': 1.16})
+    seen = []
+    record = usecases.record_trade
+    monkeypatch.setattr(usecases, 'record_trade', lambda *args: (
+        seen.append(usecases.get_portfolio(user.user_id).get_wallet('EUR').balance), record(*args))[1])
+    usecases.buy(user.user_id, 'EUR', 10.0)
+    assert seen == [10.0]
+    with pytest.raises(InsufficientFundsError):
+        usecases.sell(user.user_id, 'EUR', 50.0)
+    assert [(t.side, t.amount) for t in Ledger().history(user.user_id)[0]] == [('buy', 10.0)]
+
+def _record_many(user_ids):
+    for i in range(20):
+        ledger.record_trades({'user_id': user_id, 'side': 'buy', 'currency_code': 'BTC',
+                              'amount': 1.0, 'rate': 100.0 + i} for user_id in user_ids)
+
+def test_concurrent_writers_keep_ids_unique_and_indexes_ordered(workdir):
+    ctx = multiprocessing.get_context('fork')
+    workers = [ctx.Process(target=_record_many, args=(ids,)) for ids in ([1], [2], [1, 2], [3, 1])]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    root = workdir / 'data' / 'ledger'
+    lines = (root / 'trades.jsonl').read_text(encoding='utf-8').splitlines()
+    assert [json.loads(line)['trade_id'] for line in lines] == list(range(1, 121))
+    book = Ledger()
+    for user_id, expected in ((1, 60), (2, 40), (3, 20)):
+        raw = (root / 'index' / f"{user_id}.idx").read_bytes()
+        ids = [entry[0] for entry in struct.iter_unpack('<QQI', raw)]
+        assert len(ids) == expected and ids == sorted(ids)
+        assert book.positions(user_id)['BTC']['quantity'] == expected
+        assert {t.user_id for t in book.history(user_id, 100)[0]} == {user_id}
+
+def test_history_pages_and_rebuild_match(workdir):
+    book = Ledger()
+    for i in range(7):
+        book.record([{'user_id': 1, 'side': 'buy', 'currency_code': 'ETH', 'amount': 1.0, 'rate': 10.0 * (i + 1)}])
+    first, cursor = book.history(1, 3)
+    second, cursor = book.history(1, 3, cursor)
+    third, cursor = book.history(1, 3, cursor)
+    assert [t.trade_id for t in first + second + third] == [7, 6, 5, 4, 3, 2, 1]
+    assert cursor is None
+    positions = book.positions(1)
+    assert book.rebuild() == 7
+    assert book.positions(1) == positions
+    assert [t.trade_id for t in book.history(1, 10)[0]] == [7, 6, 5, 4, 3, 2, 1]
+
+def test_torn_index_entry_is_repaired(workdir):
+    book = Ledger()
+    for i in range(3):
+        book.record([{'user_id': 1, 'side': 'buy', 'currency_code': 'ETH', 'amount': 1.0, 'rate': 10.0 + i}])
+    path = workdir / 'data' / 'ledger' / 'index' / '1.idx'
+    # сбой посреди записи индекса третьей сделки
+    path.write_bytes(path.read_bytes()[:-7])
+    assert [t.trade_id for t in book.history(1)[0]] == [3, 2, 1]
+    assert path.stat().st_size == 3 * ledger._INDEX_ENTRY.size
+    path.write_bytes(path.read_bytes()[:-7])
+    book.record([{'user_id': 1, 'side': 'sell', 'currency_code': 'ETH', 'amount': 1.0, 'rate': 20.0}])
+    assert [t.trade_id for t in book.history(1)[0]] == [4, 3, 2, 1]
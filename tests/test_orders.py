@@ -0,0 +1,93 @@
+import pytest
+
+from valutatrade_hub.core import orders
+from valutatrade_hub.core.ledger import Ledger
+from valutatrade_hub.infra.database import DatabaseManager
+
+def seed_portfolio(user_id, **balances):
+    DatabaseManager().save_portfolio_record({
+        'user_id': user_id,
+        'wallets': {code: {'currency_code': code, 'balance': balance} for code, balance in balances.items()},
+    })
+
+def balances(user_id):
+    record = DatabaseManager().get_portfolio_record(user_id)
+    return {code: wallet['balance'] for code, wallet in record['wallets'].items()}
+
+def crash(*args, **kwargs):
+    raise RuntimeError('crash')
+
+def test_fill_is_journaled_as_pending_before_portfolio_changes(workdir, monkeypatch):
+    seed_portfolio(1, BTC=2.0)
+    order = orders.OrderBook.load().place(1, 'sell', 'limit', 'BTC', 1.0, 50000.0)
+    with monkeypatch.context() as m, pytest.raises(RuntimeError):
+        m.setattr(orders, '_fill_orders', crash)
+        orders.execute_triggered_orders({'BTC_USD': 51000.0})
+    assert balances(1) == {'BTC': 2.0}
+    book = orders.OrderBook.load()
+    assert book.orders[order.order_id].status == 'pending'
+    assert book.orders[order.order_id].fill_rate == 51000.0
+    with pytest.raises(ValueError):
+        book.cancel(1, order.order_id)
+    # после перезапуска ордер доисполняется по зафиксированному курсу, даже если курс ушёл
+    results = orders.execute_triggered_orders({'BTC_USD': 40000.0})
+    assert [(o.order_id, status) for o, status in results] == [(order.order_id, 'filled')]
+    assert balances(1) == {'BTC': 1.0, 'USD': 51000.0}
+    assert [t.rate for t in Ledger().history(1)[0]] == [51000.0]
+
+def test_replay_after_portfolio_commit_does_not_apply_fill_twice(workdir, monkeypatch):
+    seed_portfolio(1, BTC=2.0)
+    order = orders.OrderBook.load().place(1, 'sell', 'limit', 'BTC', 1.0, 50000.0)
+    # сбой после записи портфеля, но до журнала сделок и события close
+    with monkeypatch.context() as m, pytest.raises(RuntimeError):
+        m.setattr(orders, 'record_trades', crash)
+        orders.execute_triggered_orders({'BTC_USD': 51000.0})
+    assert balances(1) == {'BTC': 1.0, 'USD': 51000.0}
+    results = orders.execute_triggered_orders({'BTC_USD': 51000.0})
+    assert [(o.order_id, status) for o, status in results] == [(order.order_id, 'filled')]
+    assert balances(1) == {'BTC': 1.0, 'USD': 51000.0}
+    trades = Ledger().history(1)[0]
+    assert [(t.order_id, t.amount) for t in trades] == [(order.order_id, 1.0)]
+    assert orders.execute_triggered_orders({'BTC_USD': 51000.0}) == []
+
+def test_replay_after_ledger_write_does_not_duplicate_trade(workdir, monkeypatch):
+    seed_portfolio(1, BTC=2.0)
+    book = orders.OrderBook.load()
+    order = book.place(1, 'sell', 'limit', 'BTC', 1.0, 50000.0)
+    # сбой перед записью close: портфель и журнал сделок уже обновлены
+    record = book._record
+    monkeypatch.setattr(book, '_record', lambda events: crash() if events[0]['op'] == 'close' else record(events))
+    with pytest.raises(RuntimeError):
+        book.execute({'BTC_USD': 51000.0})
+    orders.execute_triggered_orders({'BTC_USD': 51000.0})
+    assert balances(1) == {'BTC': 1.0, 'USD': 51000.0}
+    assert [t.order_id for t in Ledger().history(1)[0]] == [order.order_id]
+    assert orders.OrderBook.load().closed[-1].status == 'filled'
+
+def test_rejected_order_leaves_portfolio_untouched(workdir):
+    seed_portfolio(1, BTC=0.5)
+    orders.OrderBook.load().place(1, 'sell', 'limit', 'BTC', 1.0, 50000.0)
+    results = orders.execute_triggered_orders({'BTC_USD': 51000.0})
+    assert [status for _, status in results] == ['rejected']
+    assert balances(1) == {'BTC': 0.5}
+    assert Ledger().history(1)[0] == []
+
+def test_user_queries_do_not_build_trigger_heaps(workdir, monkeypatch):
+    seed_portfolio(1, BTC=2.0)
+    orders.place_order(1, 'sell', 'limit', 'BTC', 1.0, 50000.0)
+    with monkeypatch.context() as m:
+        m.setattr(orders.TriggerBook, 'build', crash)
+        order = orders.place_order(1, 'sell', 'limit', 'BTC', 0.5, 60000.0)
+        orders.cancel_order(1, order.order_id)
+        assert [o.price for o in orders.list_orders(1)] == [50000.0]
+    assert [status for _, status in orders.execute_triggered_orders({'BTC_USD': 51000.0})] == ['filled']
+
+def test_journal_is_compacted_into_snapshot(workdir):
+    book = orders.OrderBook.load()
+    for _ in range(orders.JOURNAL_COMPACT_EVENTS + 10):
+        book.place(1, 'buy', 'limit', 'BTC', 1.0, 100.0)
+    journal = (workdir / 'data' / orders.JOURNAL_FILE).read_text(encoding='utf-8').splitlines()
+    assert len(journal) <= 11
+    reloaded = orders.OrderBook.load()
+    assert len(reloaded.user_orders(1)) == orders.JOURNAL_COMPACT_EVENTS + 10
+    assert reloaded.next_id == book.next_id
@@ -0,0 +1,22 @@
+import pytest
+
+from valutatrade_hub.core.exceptions import ApiRequestError
+from valutatrade_hub.infra.settings import SettingsLoader
+from valutatrade_hub.parser_service.config import ParserConfig
+
+def test_api_keys_come_only_from_environment(monkeypatch):
+    monkeypatch.delenv('EXCHANGERATE_API_KEY', raising=False)
+    monkeypatch.delenv('COINGECKO_API_KEY', raising=False)
+    SettingsLoader()._config['parser'] = {'exchangerate_api_key': 'from-config', 'request_timeout': 3}
+    config = ParserConfig()
+    assert config.EXCHANGERATE_API_KEY == '' and config.COINGECKO_API_KEY == ''
+    assert config.REQUEST_TIMEOUT == 3
+    with pytest.raises(ApiRequestError, match='EXCHANGERATE_API_KEY'):
+        config.validate()
+
+def test_api_keys_are_read_from_environment(monkeypatch):
+    monkeypatch.setenv('EXCHANGERATE_API_KEY', 'er-key')
+    monkeypatch.setenv('COINGECKO_API_KEY', 'cg-key')
+    config = ParserConfig()
+    assert (config.EXCHANGERATE_API_KEY, config.COINGECKO_API_KEY) == ('er-key', 'cg-key')
+    config.validate()
@@ -0,0 +1,85 @@
+import multiprocessing
+from pathlib import Path
+
+import pytest
+
+from valutatrade_hub.infra import portfolio_store
+from valutatrade_hub.infra.portfolio_store import PortfolioStore, migrate
+from valutatrade_hub.infra.serializers import write_data
+
+def record(user_id, usd):
+    return {'user_id': user_id, 'wallets': {'USD': {'currency_code': 'USD', 'balance': usd}}}
+
+def _deposit_many(user_ids):
+    store = PortfolioStore(Path('data'))
+    for _ in range(25):
+        with store.locked(user_ids) as records:
+            for user_id in user_ids:
+                current = records.get(user_id) or record(user_id, 0.0)
+                current['wallets']['USD']['balance'] += 1.0
+                records[user_id] = current
+
+def test_concurrent_deposits_are_not_lost(workdir):
+    # 1 и 257 попадают в одну корзину, 2 — в другую; пачки пересекаются по пользователям
+    ctx = multiprocessing.get_context('fork')
+    batches = ([1], [257], [1, 2], [2, 257])
+    workers = [ctx.Process(target=_deposit_many, args=(ids,)) for ids in batches]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    store = PortfolioStore(Path('data'))
+    assert {uid: store.get(uid)['wallets']['USD']['balance'] for uid in (1, 2, 257)} == {1: 50.0, 2: 50.0, 257: 50.0}
+    assert store.bucket_names() == ['01', '02']
+
+def test_locked_writes_only_changed_records(workdir, monkeypatch):
+    store = PortfolioStore(Path('data'))
+    for user_id in (1, 2):
+        store.save(record(user_id, 10.0))
+    written = []
+    write = portfolio_store.write_data
+    monkeypatch.setattr(portfolio_store, 'write_data', lambda path, data: (written.append(Path(path).name), write(path, data)))
+    with store.locked([1, 2]) as records:
+        records[2]['wallets']['USD']['balance'] = 20.0
+    assert written == ['2']
+
+def test_error_inside_lock_writes_nothing(workdir):
+    store = PortfolioStore(Path('data'))
+    store.save(record(1, 10.0))
+    with pytest.raises(RuntimeError):
+        with store.locked([1]) as records:
+            records[1]['wallets']['USD']['balance'] = 0.0
+            raise RuntimeError('abort')
+    assert store.get(1) == record(1, 10.0)
+
+def test_migration_moves_legacy_file_to_shards(workdir):
+    legacy = [record(user_id, float(user_id)) for user_id in (1, 2, 300)]
+    write_data(Path('data') / 'portfolios', legacy)
+    store = PortfolioStore(Path('data'))
+    assert not store.sharded and store.get(300) == legacy[2]
+    assert migrate(Path('data')) == 3
+    store = PortfolioStore(Path('data'))
+    assert store.sharded
+    assert list(store.iter_all()) == sorted(legacy, key=lambda r: (r['user_id'] % 256, r['user_id']))
+    assert (workdir / 'data' / 'portfolios.json.bak').exists()
+    with pytest.raises(ValueError):
+        migrate(Path('data'))
+
+def test_legacy_writer_racing_migration_switches_to_shards(workdir, monkeypatch):
+    write_data(Path('data') / 'portfolios', [record(1, 10.0)])
+    store = PortfolioStore(Path('data'))
+    assert not store.sharded
+    # перенос завершается, пока процесс со старой раскладкой ждёт portfolios.lock
+    flock = store._flock
+    pending = [True]
+
+    def racing(path):
+        if pending:
+            pending.clear()
+            migrate(Path('data'))
+        return flock(path)
+    monkeypatch.setattr(store, '_flock', racing)
+    with store.locked([1]) as records:
+        records[1]['wallets']['USD']['balance'] += 5.0
+    assert PortfolioStore(Path('data')).get(1) == record(1, 15.0)
+    assert not (workdir / 'data' / 'portfolios.json').exists()
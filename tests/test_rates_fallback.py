@@ -0,0 +1,65 @@
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from valutatrade_hub.core import ledger, usecases, utils
+from valutatrade_hub.core.exceptions import ApiRequestError
+from valutatrade_hub.infra.settings import SettingsLoader
+
+def write_rates(workdir, pairs, updated_at):
+    cache = {'pairs': {pair: {'rate': rate, 'updated_at': updated_at, 'source': 'test'} for pair, rate in pairs.items()},
+             'last_refresh': updated_at}
+    (workdir / 'data' / 'rates.json').write_text(json.dumps(cache), encoding='utf-8')
+
+def test_display_lookup_does_not_refresh_stale_cache(workdir):
+    user = usecases.create_user('alice', 'secret')
+    write_rates(workdir, {'EUR_USD': 1.16}, '2020-01-01T00:00:00+00:00')
+    before = (workdir / 'data' / 'rates.json').read_bytes()
+    with pytest.raises(ApiRequestError):
+        usecases.buy(user.user_id, 'EUR', 10.0)
+    # show-portfolio / pnl: курс старше ttl+grace не показывается, кеш не становится «свежим»
+    assert utils.get_exchange_rate('EUR', 'USD') == utils.EXCHANGE_RATES['EUR_USD']
+    assert utils.get_exchange_rate('BTC', 'USD') == utils.EXCHANGE_RATES['BTC_USD']
+    assert usecases.get_display_quote('EUR', 'USD').mock
+    assert (workdir / 'data' / 'rates.json').read_bytes() == before
+    with pytest.raises(ApiRequestError):
+        usecases.buy(user.user_id, 'EUR', 10.0)
+
+def test_missing_pair_is_mock_for_display_and_refused_for_trades(workdir):
+    write_rates(workdir, {}, '2020-01-01T00:00:00+00:00')
+    quote = usecases.get_rate_quote('BTC', 'USD')
+    assert quote.mock and quote.stale and quote.rate == utils.EXCHANGE_RATES['BTC_USD']
+    with pytest.raises(ApiRequestError):
+        usecases.get_trade_rate('BTC')
+
+def test_background_refresh_runs_cli_from_package_root(workdir, monkeypatch):
+    SettingsLoader()._config['rates_background_refresh'] = True
+    calls = []
+    monkeypatch.setattr(utils.subprocess, 'Popen', lambda args, **kwargs: calls.append((args, kwargs)))
+    assert utils.trigger_background_refresh()
+    args, kwargs = calls[0]
+    assert args[1:] == ['-m', 'cli.interface', 'update-rates']
+    assert kwargs['env']['PYTHONPATH'].split(os.pathsep)[0] == utils.PACKAGE_ROOT
+    assert os.path.exists(os.path.join(utils.PACKAGE_ROOT, 'cli', 'interface.py'))
+
+def test_display_quote_flags_rates_past_ttl(workdir, monkeypatch):
+    refreshes = []
+    monkeypatch.setattr(usecases, 'trigger_background_refresh', lambda: refreshes.append(1))
+    now = datetime.now(timezone.utc)
+    write_rates(workdir, {'EUR_USD': 1.16}, (now - timedelta(seconds=10)).isoformat())
+    quote = usecases.get_display_quote('EUR', 'USD')
+    assert (quote.rate, quote.stale, refreshes) == (1.16, False, [])
+    # в пределах grace: последний курс с пометкой stale и фоновым обновлением
+    write_rates(workdir, {'EUR_USD': 1.17}, (now - timedelta(seconds=1000)).isoformat())
+    quote = usecases.get_display_quote('EUR', 'USD')
+    assert (quote.rate, quote.stale, quote.mock, refreshes) == (1.17, True, False, [1])
+
+def test_pnl_marks_stale_market_rate(workdir, monkeypatch):
+    monkeypatch.setattr(usecases, 'trigger_background_refresh', lambda: None)
+    stamp = (datetime.now(timezone.utc) - timedelta(seconds=1000)).isoformat()
+    write_rates(workdir, {'BTC_USD': 60000.0}, stamp)
+    ledger.record_trade(1, 'buy', 'BTC', 1.0, 50000.0)
+    [row] = ledger.get_pnl(1)
+    assert (row['market_rate'], row['market_stale'], row['unrealized_pnl']) == (60000.0, True, 10000.0)
@@ -0,0 +1,106 @@
+import fcntl
+import json
+import multiprocessing
+from datetime import datetime, timezone
+
+import pytest
+
+from valutatrade_hub.core import utils
+from valutatrade_hub.parser_service import compaction, storage
+from valutatrade_hub.parser_service.config import ParserConfig
+from valutatrade_hub.parser_service.storage import RatesStorage
+
+def lock_is_held(workdir):
+    with open(workdir / 'data' / 'rates.lock', 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return False
+
+@pytest.fixture
+def writes(workdir, monkeypatch):
+    # каждая запись файлов курсов фиксирует, держал ли кто-то rates.lock в этот момент
+    seen = []
+    write_data = storage.write_data
+
+    def checked(path, data):
+        seen.append((str(path), lock_is_held(workdir)))
+        write_data(path, data)
+    monkeypatch.setattr(storage, 'write_data', checked)
+    return seen
+
+def test_every_rates_write_holds_the_lock(workdir, writes):
+    rates = RatesStorage(ParserConfig())
+    rates.save_rate_entries({'EUR_USD': {'rate': 1.16, 'updated_at': '2026-01-01T00:00:00+00:00', 'source': 't'}})
+    rates.save_rates_cache({'GBP_USD': 1.3}, 'test')
+    rates.save_rates(rates.load_rates_cache())
+    rates.append_history([{'id': 'EUR_USD_1', 'rate': 1.16}])
+    rates.save_history(rates.load_history())
+    assert writes and all(held for _, held in writes)
+    assert not lock_is_held(workdir)
+
+def test_compaction_reenters_the_lock(workdir, writes):
+    (workdir / 'data' / 'rates.json').write_text('{"EUR_USD": {"rate": 1.16, "updated_at": "2026-01-01T00:00:00Z"}}')
+    compaction.compact_data(ParserConfig())
+    assert any(path.endswith('rates.json') and held for path, held in writes)
+    assert not lock_is_held(workdir)
+
+def _save_many(prefix):
+    rates = RatesStorage(ParserConfig())
+    for i in range(20):
+        rates.save_rates_cache({f"{prefix}{i}_USD": 1.0 + i}, 'test')
+
+def test_concurrent_updates_keep_all_pairs(workdir):
+    ctx = multiprocessing.get_context('fork')
+    workers = [ctx.Process(target=_save_many, args=(prefix,)) for prefix in ('A', 'B', 'C')]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    pairs = RatesStorage(ParserConfig()).load_rates_cache()['pairs']
+    assert {f"{p}{i}_USD" for p in 'ABC' for i in range(20)} <= set(pairs)
+
+def write_legacy(workdir):
+    (workdir / 'data' / 'rates.json').write_text(json.dumps({
+        'EUR_USD': {'rate': 0.8, 'updated_at': '2026-01-01T00:00:00Z', 'source': 'ExchangeRate-API'},
+        'BTC_USD': {'rate': 50000.0, 'updated_at': '2026-01-01T00:00:00Z', 'source': 'CoinGecko'},
+        'last_refresh': '2026-01-01T00:00:00Z',
+    }), encoding='utf-8')
+    (workdir / 'data' / 'exchange_rates.json').write_text(json.dumps([
+        {'id': 'EUR_USD_1', 'rate': 0.8, 'timestamp': '2026-01-01T00:00:00Z', 'source': 'ExchangeRate-API'},
+        {'id': 'BTC_USD_1', 'rate': 50000.0, 'timestamp': '2026-01-01T00:00:00Z', 'source': 'CoinGecko'},
+    ]), encoding='utf-8')
+
+def test_legacy_fiat_pairs_are_inverted_on_read(workdir):
+    write_legacy(workdir)
+    assert utils.get_cached_rate('EUR', 'USD')[0] == 1.25
+    assert utils.get_cached_rate('BTC', 'USD')[0] == 50000.0
+
+def test_update_migrates_legacy_cache_and_history_once(workdir):
+    write_legacy(workdir)
+    rates = RatesStorage(ParserConfig())
+    for _ in range(2):
+        rates.save_rate_entries({'GBP_USD': {'rate': 1.3, 'updated_at': '2026-01-02T00:00:00Z',
+                                             'source': 'ExchangeRate-API'}})
+    cache = json.loads((workdir / 'data' / 'rates.json').read_text(encoding='utf-8'))
+    assert cache['schema'] == utils.RATES_SCHEMA
+    assert {pair: entry['rate'] for pair, entry in cache['pairs'].items()} == {
+        'BTC_USD': 50000.0, 'EUR_USD': 1.25, 'GBP_USD': 1.3}
+    assert [entry['rate'] for entry in rates.load_history()] == [1.25, 50000.0]
+
+def test_compaction_migrates_legacy_cache(workdir):
+    write_legacy(workdir)
+    compaction.compact_data(ParserConfig(), now=datetime(2026, 1, 1, 12, tzinfo=timezone.utc))
+    compaction.compact_data(ParserConfig(), now=datetime(2026, 1, 1, 12, tzinfo=timezone.utc))
+    assert utils.get_cached_rate('EUR', 'USD')[0] == 1.25
+    assert [entry['rate'] for entry in RatesStorage(ParserConfig()).load_history()] == [1.25, 50000.0]
+
+def test_compaction_reports_history_size_before_migration(workdir):
+    write_legacy(workdir)
+    history_path = workdir / 'data' / 'exchange_rates.json'
+    size = history_path.stat().st_size
+    _, history_report = compaction.compact_data(ParserConfig(), now=datetime(2026, 1, 1, 12, tzinfo=timezone.utc))
+    assert history_report.bytes_before == size
+    assert history_report.bytes_after == history_path.stat().st_size
@@ -0,0 +1,76 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from valutatrade_hub.core import rebalance as rb
+from valutatrade_hub.core.exceptions import ApiRequestError, InsufficientFundsError
+from valutatrade_hub.core.ledger import Ledger
+from valutatrade_hub.infra.database import DatabaseManager
+
+def write_rates(workdir, pairs):
+    # pairs: {'BTC_USD': (курс, возраст в секундах)}
+    now = datetime.now(timezone.utc)
+    cache = {'schema': 2, 'pairs': {pair: {'rate': rate, 'source': 'test',
+                                           'updated_at': (now - timedelta(seconds=age)).isoformat()}
+                                    for pair, (rate, age) in pairs.items()}}
+    (workdir / 'data' / 'rates.json').write_text(json.dumps(cache), encoding='utf-8')
+    return now
+
+def seed_portfolio(user_id, **balances):
+    DatabaseManager().save_portfolio_record({
+        'user_id': user_id,
+        'wallets': {code: {'currency_code': code, 'balance': balance} for code, balance in balances.items()},
+    })
+
+def balances(user_id):
+    record = DatabaseManager().get_portfolio_record(user_id)
+    return {code: wallet['balance'] for code, wallet in record['wallets'].items()}
+
+def test_rebalance_reports_oldest_rate_and_debits_usd(workdir):
+    now = write_rates(workdir, {'BTC_USD': (50000.0, 10), 'EUR_USD': (1.25, 120)})
+    seed_portfolio(1, USD=1000.0)
+    result = rb.rebalance({'USD': 0.5, 'BTC': 0.5}, [1], tolerance=0.0)
+    assert balances(1) == pytest.approx({'USD': 500.0, 'BTC': 0.01})
+    assert result['snapshot_time'] == (now - timedelta(seconds=10)).isoformat()
+    assert [(t.side, t.currency_code, t.source) for t in Ledger().history(1)[0]] == [('buy', 'BTC', 'rebalance')]
+
+def test_stale_target_rate_is_refused(workdir):
+    write_rates(workdir, {'BTC_USD': (50000.0, 3600)})
+    seed_portfolio(1, USD=1000.0)
+    with pytest.raises(ApiRequestError):
+        rb.rebalance({'USD': 0.5, 'BTC': 0.5}, [1], dry_run=True)
+    with pytest.raises(ApiRequestError):
+        rb.rebalance({'USD': 0.5, 'BTC': 0.5}, [1])
+    assert balances(1) == {'USD': 1000.0}
+
+def test_holder_of_stale_currency_is_skipped(workdir):
+    write_rates(workdir, {'BTC_USD': (50000.0, 10), 'ETH_USD': (3000.0, 3600)})
+    seed_portfolio(1, USD=1000.0, ETH=1.0)
+    seed_portfolio(2, USD=1000.0)
+    result = rb.rebalance({'USD': 0.5, 'BTC': 0.5}, [1, 2], tolerance=0.0)
+    assert result['skipped'] == [(1, 'нет свежего курса для ETH')]
+    assert balances(1) == {'USD': 1000.0, 'ETH': 1.0}
+    assert {t['user_id'] for t in result['trades']} == {2}
+
+def test_overspend_raises_and_leaves_portfolios_untouched(workdir, monkeypatch):
+    write_rates(workdir, {'BTC_USD': (50000.0, 10)})
+    seed_portfolio(1, USD=1000.0)
+    seed_portfolio(2, USD=100.0)
+    plan = rb.plan_rebalance
+
+    def overspending(records, targets, rates, tolerance):
+        trades, skipped = plan(records, targets, rates, tolerance)
+        return trades + [{'user_id': 2, 'side': 'buy', 'currency_code': 'BTC', 'amount': 1.0,
+                          'rate': 50000.0, 'source': 'rebalance'}], skipped
+    monkeypatch.setattr(rb, 'plan_rebalance', overspending)
+    with pytest.raises(InsufficientFundsError):
+        rb.rebalance({'USD': 0.5, 'BTC': 0.5}, [1, 2])
+    assert balances(1) == {'USD': 1000.0}
+    assert balances(2) == {'USD': 100.0}
+    assert Ledger().history(1) == ([], None)
+
+def test_apply_trade_refuses_selling_more_than_held():
+    with pytest.raises(InsufficientFundsError):
+        rb._apply_trade({'wallets': {'BTC': {'currency_code': 'BTC', 'balance': 0.5}}},
+                        {'side': 'sell', 'currency_code': 'BTC', 'amount': 1.0, 'rate': 50000.0})
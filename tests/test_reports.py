@@ -0,0 +1,100 @@
+import csv
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+
+from valutatrade_hub.core import reports
+from valutatrade_hub.infra.database import DatabaseManager
+from valutatrade_hub.infra.serializers import write_data
+
+# BTC и EUR — прямые пары к USD, RUB — только обратная USD_RUB, у ETH пути к базам нет
+RATES = {'BTC_USD': 50000.0, 'EUR_USD': 1.25, 'USD_RUB': 80.0, 'ETH_BTC': 0.05}
+PORTFOLIOS = {
+    300: {'BTC': 0.5},
+    1: {'USD': 100.0, 'BTC': 0.1},
+    257: {'EUR': 10.0},
+    2: {'RUB': 8000.0, 'ETH': 2.0},
+}
+EXPECTED = [
+    ['1', 'alice', 'BTC', '0.10000000', '5000.00', '4000.00', '400000.00'],
+    ['1', 'alice', 'USD', '100.00000000', '100.00', '80.00', '8000.00'],
+    ['2', 'bob', 'ETH', '2.00000000', '', '', ''],
+    ['2', 'bob', 'RUB', '8000.00000000', '100.00', '80.00', '8000.00'],
+    ['257', '', 'EUR', '10.00000000', '12.50', '10.00', '1000.00'],
+    ['300', '', 'BTC', '0.50000000', '25000.00', '20000.00', '2000000.00'],
+]
+
+def records():
+    return [{'user_id': user_id, 'wallets': {code: {'currency_code': code, 'balance': balance}
+                                             for code, balance in wallets.items()}}
+            for user_id, wallets in PORTFOLIOS.items()]
+
+@pytest.fixture
+def seeded(workdir):
+    now = datetime.now(timezone.utc).isoformat()
+    cache = {'schema': 2, 'last_refresh': now,
+             'pairs': {pair: {'rate': rate, 'updated_at': now, 'source': 'test'} for pair, rate in RATES.items()}}
+    (workdir / 'data' / 'rates.json').write_text(json.dumps(cache), encoding='utf-8')
+    # без create_user: регистрация создаёт портфель, и хранилище сразу становится шардированным
+    write_data(Path('data') / 'users', [{'user_id': 1, 'username': 'alice'}, {'user_id': 2, 'username': 'bob'}])
+    return workdir
+
+def read_report(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.reader(f))
+
+def parts_left(workdir):
+    return [p.name for p in workdir.iterdir() if p.name.startswith('report-parts-')]
+
+def test_rate_snapshot_uses_direct_inverse_and_usd_cross_rates(seeded):
+    snapshot, _ = reports.build_rate_snapshot(['USD', 'EUR', 'RUB'])
+    assert snapshot[('BTC', 'USD')] == 50000.0
+    assert snapshot[('RUB', 'USD')] == pytest.approx(1 / 80)
+    assert snapshot[('USD', 'RUB')] == 80.0
+    assert snapshot[('BTC', 'EUR')] == pytest.approx(40000.0)
+    assert snapshot[('EUR', 'RUB')] == pytest.approx(100.0)
+    assert ('ETH', 'USD') not in snapshot
+
+@pytest.mark.parametrize('workers', [1, 3])
+@pytest.mark.parametrize('layout', ['sharded', 'legacy'])
+def test_report_is_ordered_and_converted(seeded, layout, workers):
+    if layout == 'legacy':
+        write_data(Path('data') / 'portfolios', records())
+    else:
+        for record in records():
+            DatabaseManager().save_portfolio_record(record)
+    assert DatabaseManager().portfolios.sharded == (layout == 'sharded')
+    result = reports.export_report('report.csv', ['usd', 'EUR', 'RUB'], workers=workers)
+    rows = read_report(seeded / 'report.csv')
+    assert rows[0] == ['user_id', 'username', 'currency', 'balance', 'value_USD', 'value_EUR', 'value_RUB']
+    assert rows[1:] == EXPECTED
+    assert result['rows'] == len(EXPECTED) and result['users'] == 4 and result['workers'] == workers
+    assert parts_left(seeded) == []
+    assert not (seeded / 'report.csv.tmp').exists()
+
+def test_parts_are_removed_when_merge_fails(seeded, monkeypatch):
+    for record in records():
+        DatabaseManager().save_portfolio_record(record)
+
+    def fail(*args):
+        raise OSError('disk full')
+    monkeypatch.setattr(reports, '_merge_parts', fail)
+    with pytest.raises(OSError):
+        reports.export_report('report.csv', ['USD'], workers=1)
+    assert parts_left(seeded) == []
+    assert not (seeded / 'report.csv').exists()
+
+def test_merge_interleaves_sorted_parts(tmp_path):
+    parts = []
+    for index, rows in enumerate(([[1, 'BTC', '1'], [3, 'USD', '3']], [[1, 'EUR', '2'], [2, 'USD', '4']], [])):
+        path = tmp_path / f"part-{index}.csv"
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows(rows)
+        parts.append(str(path))
+    out = tmp_path / 'out.csv'
+    assert reports._merge_parts(parts, str(out), ['USD'], {1: 'alice'}) == (4, 3)
+    assert read_report(out) == [['user_id', 'username', 'currency', 'balance', 'value_USD'],
+                                ['1', 'alice', 'BTC', '1'], ['1', 'alice', 'EUR', '2'],
+                                ['2', '', 'USD', '4'], ['3', '', 'USD', '3']]
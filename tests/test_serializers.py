@@ -0,0 +1,29 @@
+from datetime import datetime, timedelta, timezone
+
+from valutatrade_hub.infra.serializers import BinarySerializer, read_data, write_data
+
+def sample_records():
+    return [
+        {'id': 'BTC_USD_2025-11-15T18:00:00.123Z', 'rate': 95951.5, 'count': 3, 'ok': True, 'note': None,
+         'timestamp': '2025-11-15T18:00:00.123Z', 'source': 'CoinGecko',
+         'meta': {'samples': 2, 'label': 'ёжик', 'tags': ['a', 1, None], 'when': datetime(2025, 1, 2, 3, 4, 5)}},
+        {'id': 'EUR_USD', 'rate': 1.16, 'count': -1, 'ok': False, 'note': None,
+         'timestamp': '2025-11-15T18:00:01+00:00', 'source': '',
+         'meta': {'samples': 1, 'label': '', 'tags': [], 'when': datetime(2025, 1, 2, tzinfo=timezone(timedelta(hours=3)))}},
+        {'user_id': 7, 'wallets': {'USD': {'currency_code': 'USD', 'balance': 10.5}}},
+    ]
+
+def test_binary_round_trip_with_nested_schemas():
+    serializer = BinarySerializer()
+    records = sample_records()
+    assert serializer.decode(serializer.encode(records)) == records
+    mapping = {'BTC_USD': records[0], 'EUR_USD': records[1]}
+    assert serializer.decode(serializer.encode(mapping)) == mapping
+
+def test_write_and_read_data_in_binary_format(workdir):
+    from valutatrade_hub.infra.settings import SettingsLoader
+    SettingsLoader()._config['storage_format'] = 'binary'
+    records = sample_records()
+    target = write_data(workdir / 'data' / 'history', records)
+    assert target.suffix == '.vtb'
+    assert read_data(workdir / 'data' / 'history') == records
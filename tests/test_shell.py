@@ -0,0 +1,90 @@
+import io
+import types
+
+import pytest
+
+pytest.importorskip('prettytable')
+
+from cli import interface  # noqa: E402
+from valutatrade_hub.core import usecases  # noqa: E402
+
+@pytest.fixture
+def shell(workdir, monkeypatch, capsys):
+    monkeypatch.setattr(interface, 'current_user', None)
+    monkeypatch.setattr(interface, 'HISTORY_FILE', str(workdir / 'history'))
+    # команды подаются через stdin, как при вводе в терминале; input() без tty читает sys.stdin
+    monkeypatch.setattr(interface, '_setup_readline', lambda parser: None)
+
+    def run(*lines):
+        monkeypatch.setattr('sys.stdin', io.StringIO(''.join(line + '\n' for line in lines)))
+        interface.run_shell(interface.build_parser())
+        return capsys.readouterr().out
+    return run
+
+def test_login_session_is_kept_between_commands(shell):
+    usecases.create_user('alice', 'secret')
+    out = shell('login --username alice --password secret',
+                'buy --currency USD --amount 100',
+                'place-order --side buy --type limit --currency BTC --amount 1 --price 100',
+                'orders')
+    assert "Вы вошли как 'alice'" in out
+    assert 'valutatrade(alice)> ' in out
+    assert 'Ордер размещён: #1 BUY limit' in out
+    assert 'Сначала выполните login' not in out
+    user = usecases.get_user_by_id(1)
+    assert usecases.get_portfolio(user.user_id).get_wallet('USD').balance == 100.0
+    # сессия сохранена и переживает перезапуск shell
+    interface.current_user = None
+    interface.restore_session()
+    assert shell('orders').count('valutatrade(alice)> ') == 2
+
+def test_errors_do_not_end_the_session(shell):
+    usecases.create_user('alice', 'secret')
+    out = shell('buy --currency USD --amount 1',
+                'login "--username alice',
+                'no-such-command',
+                'buy --currency USD --amount many',
+                'login --username alice --password secret',
+                'buy --currency USD --amount -1',
+                'shell',
+                'timing maybe',
+                'logout',
+                'exit',
+                'orders')
+    assert 'Сначала выполните login' in out
+    assert 'Ошибка разбора команды' in out
+    assert "Вы вошли как 'alice'" in out
+    assert 'Ошибка валидации' in out
+    assert 'Вы уже в режиме shell' in out
+    assert 'Использование: timing on|off' in out
+    # после exit команды не выполняются
+    assert out.count('Сначала выполните login') == 1
+
+def test_timing_is_printed_only_when_enabled(shell):
+    out = shell('orders', 'timing on', 'orders', 'timing off', 'orders')
+    assert 'Замер времени включён' in out and 'Замер времени выключен' in out
+    assert out.count('[orders: ') == 1
+    assert out.count('Сначала выполните login') == 3
+
+def test_end_of_input_and_blank_lines(shell):
+    out = shell('', '   ', 'help')
+    assert 'Команды shell: timing on|off' in out
+    assert out.count('valutatrade> ') == 4
+
+def complete_all(parser, monkeypatch, buffer):
+    monkeypatch.setattr(interface, 'readline', types.SimpleNamespace(get_line_buffer=lambda: buffer))
+    complete = interface._make_completer(parser)
+    text = '' if buffer.endswith(' ') else buffer.split()[-1]
+    matches = []
+    while (match := complete(text, len(matches))) is not None:
+        matches.append(match)
+    return matches
+
+def test_completer_suggests_commands_options_and_codes(monkeypatch):
+    parser = interface.build_parser()
+    assert complete_all(parser, monkeypatch, 'ti') == ['timing ']
+    assert 'show-portfolio ' in complete_all(parser, monkeypatch, 'sh')
+    assert 'shell ' not in complete_all(parser, monkeypatch, 'sh')
+    assert complete_all(parser, monkeypatch, 'buy --currency BTC --') == ['--amount ']
+    assert complete_all(parser, monkeypatch, 'get-rate --from bt') == ['BTC ']
+    assert complete_all(parser, monkeypatch, 'timing ') == ['on ', 'off ']
@@ -0,0 +1,20 @@
+from valutatrade_hub import tracing
+from valutatrade_hub.infra.serializers import iter_data, read_data, write_data
+
+def test_disabled_tracing_does_not_stat_files(workdir, monkeypatch):
+    calls = []
+    monkeypatch.setattr(tracing.os.path, 'getsize', lambda path: calls.append(path) or 0)
+    write_data('data/sample', [{'id': 1}, {'id': 2}])
+    assert read_data('data/sample') == [{'id': 1}, {'id': 2}]
+    assert list(iter_data('data/sample')) == [{'id': 1}, {'id': 2}]
+    assert calls == []
+
+def test_enabled_tracing_records_file_sizes(workdir):
+    tracer = tracing.enable()
+    try:
+        path = write_data('data/sample', [{'id': 1}])
+        read_data('data/sample')
+    finally:
+        tracing.disable()
+    sizes = {span.name: span.bytes for span in tracer.spans}
+    assert sizes['io.write[sample.json]'] == sizes['io.read[sample.json]'] == path.stat().st_size > 0
@@ -1,50 +1,218 @@
+import json
 from abc import ABC, abstractmethod
-from typing import Dict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional
 from .exceptions import CurrencyNotFoundError
+from ..infra.settings import SettingsLoader
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессная блокировка недоступна
+    fcntl = None
 
 class Currency(ABC):
-    def __init__(self, name: str, code: str):
+    __slots__ = ('name', 'code', 'precision', '_frozen')
+
+    def __init__(self, name: str, code: str, precision: int = 2):
         if not name or not isinstance(name, str):
             raise ValueError("Name не может быть пустым")
         if not code or not isinstance(code, str) or len(code) < 2 or len(code) > 5 or not code.isupper() or ' ' in code:
             raise ValueError("Code — верхний регистр, 2–5 символов, без пробелов")
-        self.name = name
-        self.code = code
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'code', code)
+        object.__setattr__(self, 'precision', int(precision))
+
+    def _freeze(self) -> None:
+        object.__setattr__(self, '_frozen', True)
+
+    def __setattr__(self, key, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError(f"Валюта '{self.code}' неизменяема")
+        object.__setattr__(self, key, value)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.code!r})"
 
     @abstractmethod
     def get_display_info(self) -> str:
         pass
 
-CURRENCY_REGISTRY: Dict[str, type[Currency]] = {}
-
 class FiatCurrency(Currency):
-    def __init__(self, name: str, code: str, issuing_country: str):
-        super().__init__(name, code)
+    __slots__ = ('issuing_country',)
+
+    def __init__(self, name: str, code: str, issuing_country: str, precision: int = 2):
+        super().__init__(name, code, precision)
         self.issuing_country = issuing_country
+        self._freeze()
 
     def get_display_info(self) -> str:
         return f"[FIAT] {self.code} — {self.name} (Issuing: {self.issuing_country})"
 
 class CryptoCurrency(Currency):
-    def __init__(self, name: str, code: str, algorithm: str, market_cap: float = 0.0):
-        super().__init__(name, code)
+    __slots__ = ('algorithm', 'market_cap', 'coingecko_id')
+
+    def __init__(self, name: str, code: str, algorithm: str, market_cap: float = 0.0,
+                 precision: int = 8, coingecko_id: Optional[str] = None):
+        super().__init__(name, code, precision)
         self.algorithm = algorithm
         self.market_cap = market_cap
+        self.coingecko_id = coingecko_id
+        self._freeze()
 
     def get_display_info(self) -> str:
         mcap_str = f"{self.market_cap:.2e}" if self.market_cap > 0 else "N/A"
         return f"[CRYPTO] {self.code} — {self.name} (Algo: {self.algorithm}, MCAP: {mcap_str})"
 
-CURRENCY_REGISTRY = {
-    'USD': lambda: FiatCurrency("US Dollar", "USD", "United States"),
-    'EUR': lambda: FiatCurrency("Euro", "EUR", "Eurozone"),
-    'RUB': lambda: FiatCurrency("Russian Ruble", "RUB", "Russia"),
-    'BTC': lambda: CryptoCurrency("Bitcoin", "BTC", "SHA-256", 1.12e12),
-    'ETH': lambda: CryptoCurrency("Ethereum", "ETH", "Ethash", 4.5e11),
+DEFAULT_CURRENCIES = {
+    'fiat': [
+        {'code': 'USD', 'name': 'US Dollar', 'issuing_country': 'United States'},
+        {'code': 'EUR', 'name': 'Euro', 'issuing_country': 'Eurozone'},
+        {'code': 'RUB', 'name': 'Russian Ruble', 'issuing_country': 'Russia'},
+        {'code': 'GBP', 'name': 'Pound Sterling', 'issuing_country': 'United Kingdom'},
+    ],
+    'crypto': [
+        {'code': 'BTC', 'name': 'Bitcoin', 'algorithm': 'SHA-256', 'market_cap': 1.12e12, 'coingecko_id': 'bitcoin'},
+        {'code': 'ETH', 'name': 'Ethereum', 'algorithm': 'Ethash', 'market_cap': 4.5e11, 'coingecko_id': 'ethereum'},
+        {'code': 'SOL', 'name': 'Solana', 'algorithm': 'Proof of History', 'market_cap': 8.0e10, 'coingecko_id': 'solana'},
+    ],
 }
 
+CURRENCY_REGISTRY: Dict[str, Currency] = {}
+SUPPORTED_CODES: FrozenSet[str] = frozenset()
+
+def _registry_path() -> Path:
+    settings = SettingsLoader()
+    custom = settings.get('currencies_file')
+    if custom:
+        return Path(custom)
+    return Path(settings.get('data_dir', 'data')) / 'currencies.json'
+
+def _build_currency(kind: str, entry: Dict) -> Currency:
+    if kind == 'crypto':
+        return CryptoCurrency(
+            entry.get('name') or entry['code'],
+            entry['code'],
+            entry.get('algorithm', 'Unknown'),
+            float(entry.get('market_cap', 0.0)),
+            int(entry.get('precision', 8)),
+            entry.get('coingecko_id'),
+        )
+    return FiatCurrency(
+        entry.get('name') or entry['code'],
+        entry['code'],
+        entry.get('issuing_country', 'Unknown'),
+        int(entry.get('precision', 2)),
+    )
+
+def _load_registry() -> None:
+    global SUPPORTED_CODES
+    path = _registry_path()
+    data = DEFAULT_CURRENCIES
+    if path.exists():
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except json.JSONDecodeError:
+            print(f"Ошибка в {path} — используем встроенный список валют")
+    CURRENCY_REGISTRY.clear()
+    for kind in ('fiat', 'crypto'):
+        for entry in data.get(kind, []):
+            try:
+                currency = _build_currency(kind, entry)
+            except (KeyError, ValueError):
+                continue
+            CURRENCY_REGISTRY.setdefault(currency.code, currency)
+    SUPPORTED_CODES = frozenset(CURRENCY_REGISTRY)
+
+@contextmanager
+def _locked(path: Path) -> Iterator[None]:
+    # реестр дополняют и updater, и CLI: чтение-изменение-запись под межпроцессной блокировкой
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.with_suffix('.lock'), 'a') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _persist_entries(kind: str, currencies: List[Currency]) -> None:
+    path = _registry_path()
+    with _locked(path):
+        _write_entries(path, kind, currencies)
+
+def _write_entries(path: Path, kind: str, currencies: List[Currency]) -> None:
+    if path.exists():
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    else:
+        data = {kind_: [dict(e) for e in entries] for kind_, entries in DEFAULT_CURRENCIES.items()}
+    known = {e['code'] for entries in data.values() for e in entries}
+    for currency in currencies:
+        if currency.code in known:
+            continue
+        entry = {'code': currency.code, 'name': currency.name, 'precision': currency.precision}
+        if isinstance(currency, CryptoCurrency):
+            entry.update({'algorithm': currency.algorithm, 'market_cap': currency.market_cap,
+                          'coingecko_id': currency.coingecko_id})
+        else:
+            entry['issuing_country'] = currency.issuing_country
+        data.setdefault(kind, []).append(entry)
+    temp_path = path.with_suffix('.tmp')
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    temp_path.replace(path)
+
+def is_supported(code: str) -> bool:
+    return isinstance(code, str) and code.upper() in SUPPORTED_CODES
+
 def get_currency(code: str) -> Currency:
     code_upper = code.upper()
-    if code_upper not in CURRENCY_REGISTRY:
+    currency = CURRENCY_REGISTRY.get(code_upper)
+    if currency is None:
         raise CurrencyNotFoundError(code_upper)
-    return CURRENCY_REGISTRY[code_upper]()
+    return currency
+
+def describe_supported(per_kind: int = 3) -> str:
+    # самые ходовые коды: фиат из встроенного списка, крипта по капитализации
+    preferred = [e['code'] for e in DEFAULT_CURRENCIES['fiat']]
+    fiat = sorted((c for c in CURRENCY_REGISTRY.values() if isinstance(c, FiatCurrency)),
+                  key=lambda c: (preferred.index(c.code) if c.code in preferred else len(preferred), c.code))
+    crypto = sorted((c for c in CURRENCY_REGISTRY.values() if isinstance(c, CryptoCurrency)),
+                    key=lambda c: (-c.market_cap, c.code))
+    codes = [c.code for c in fiat[:per_kind] + crypto[:per_kind]]
+    return f"{', '.join(codes)} и другие (всего {len(SUPPORTED_CODES)})"
+
+def register_codes(codes: Iterable[str], kind: str = 'fiat', persist: bool = False,
+                   coingecko_ids: Optional[Dict[str, str]] = None) -> List[str]:
+    # криптовалюта без coingecko_id не может обновляться парсером — такие коды не регистрируются
+    global SUPPORTED_CODES
+    added: List[Currency] = []
+    for code in codes:
+        code_upper = str(code).upper()
+        if code_upper in CURRENCY_REGISTRY:
+            continue
+        entry = {'code': code_upper}
+        if kind == 'crypto':
+            coingecko_id = (coingecko_ids or {}).get(code_upper)
+            if not coingecko_id:
+                continue
+            entry['coingecko_id'] = coingecko_id
+        try:
+            currency = _build_currency(kind, entry)
+        except ValueError:
+            continue
+        CURRENCY_REGISTRY[code_upper] = currency
+        added.append(currency)
+    if added:
+        SUPPORTED_CODES = frozenset(CURRENCY_REGISTRY)
+        if persist:
+            _persist_entries(kind, added)
+    return [c.code for c in added]
+
+def reload_registry() -> None:
+    _load_registry()
+
+_load_registry()
@@ -0,0 +1,362 @@
+import argparse
+import json
+import os
+import struct
+from collections.abc import Iterable, Iterator
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timezone
+from typing import Any
+
+from ..infra.serializers import read_data, write_data
+from ..tracing import traced
+from .utils import DATA_DIR
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессная блокировка недоступна
+    fcntl = None
+
+# Раскладка data/ledger/:
+#   trades.jsonl          — журнал сделок, только дозапись, по строке на сделку;
+#   index/<user_id>.idx   — записи фиксированной длины (trade_id, смещение, длина
+#                           строки) по возрастанию trade_id: страница истории —
+#                           бинарный поиск + одно чтение;
+#   positions/<user_id>.* — количество, себестоимость и реализованный P&L по валютам
+#                           (метод средней цены), обновляются при каждой сделке;
+#   locks/<user_id>.lock  — блокировка индекса и сводки пользователя.
+# Запись сделки: .lock (разделяемая; rebuild берёт её монопольно) → блокировки
+# пользователей по возрастанию id → trades.lock на выдачу номеров, дозапись строк
+# и индексов. Сводки разных пользователей обновляются параллельно, а у одного
+# пользователя — в порядке trade_id.
+LEDGER_DIR = 'ledger'
+TRADES_FILE = 'trades.jsonl'
+_INDEX_ENTRY = struct.Struct('<QQI')
+_TAIL_CHUNK = 4096
+
+class Trade:
+    def __init__(self, trade_id: int, user_id: int, side: str, currency_code: str,
+                 amount: float, rate: float, usd_value: float | None = None,
+                 timestamp: str | None = None, source: str = 'market',
+                 order_id: int | None = None):
+        self.trade_id = trade_id
+        self.user_id = user_id
+        self.side = side
+        self.currency_code = currency_code
+        self.amount = float(amount)
+        self.rate = float(rate)
+        if usd_value is None:
+            usd_value = self.amount * self.rate
+        self.usd_value = float(usd_value)
+        now = datetime.now(timezone.utc)
+        self.timestamp = timestamp or now.isoformat(timespec='milliseconds')
+        self.source = source
+        self.order_id = order_id
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'trade_id': self.trade_id,
+            'user_id': self.user_id,
+            'side': self.side,
+            'currency_code': self.currency_code,
+            'amount': self.amount,
+            'rate': self.rate,
+            'usd_value': self.usd_value,
+            'timestamp': self.timestamp,
+            'source': self.source,
+            'order_id': self.order_id,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> 'Trade':
+        return cls(**data)
+
+    def __repr__(self) -> str:
+        return (f"Trade(#{self.trade_id} {self.side.upper()} {self.amount:.4f} "
+                f"{self.currency_code} @ {self.rate:.2f} USD)")
+
+def _apply_position(positions: dict[str, dict[str, float]], trade: Trade) -> None:
+    if trade.currency_code == 'USD':
+        return
+    position = positions.setdefault(trade.currency_code, {
+        'quantity': 0.0, 'cost_basis': 0.0, 'realized_pnl': 0.0,
+        'untracked_sold': 0.0, 'trades': 0})
+    position['trades'] += 1
+    if trade.side == 'buy':
+        position['quantity'] += trade.amount
+        position['cost_basis'] += trade.usd_value
+        return
+    # продажа сверх учтённого количества (валюта куплена до появления журнала)
+    # в P&L не попадает
+    matched = min(trade.amount, position['quantity'])
+    quantity = position['quantity']
+    average = position['cost_basis'] / quantity if quantity else 0.0
+    position['realized_pnl'] += matched * (trade.rate - average)
+    position['cost_basis'] -= matched * average
+    position['quantity'] -= matched
+    position['untracked_sold'] += trade.amount - matched
+    if position['quantity'] <= 1e-12:
+        position['quantity'] = position['cost_basis'] = 0.0
+
+@contextmanager
+def _flock(path: str, exclusive: bool = True) -> Iterator[None]:
+    with open(path, 'a') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+class Ledger:
+    def __init__(self, root: str | None = None):
+        self.root = root or os.path.join(DATA_DIR, LEDGER_DIR)
+        self.trades_path = os.path.join(self.root, TRADES_FILE)
+        self.index_dir = os.path.join(self.root, 'index')
+        self.positions_dir = os.path.join(self.root, 'positions')
+
+    def _index_path(self, user_id: int) -> str:
+        return os.path.join(self.index_dir, f"{user_id}.idx")
+
+    def _positions_path(self, user_id: int) -> str:
+        return os.path.join(self.positions_dir, str(user_id))
+
+    @contextmanager
+    def _locked(self, user_ids: Iterable[int] | None = None) -> Iterator[None]:
+        # без user_ids — монопольно весь журнал (rebuild)
+        os.makedirs(self.index_dir, exist_ok=True)
+        os.makedirs(os.path.join(self.root, 'locks'), exist_ok=True)
+        with ExitStack() as stack:
+            root_lock = os.path.join(self.root, '.lock')
+            stack.enter_context(_flock(root_lock, exclusive=user_ids is None))
+            for user_id in sorted(set(user_ids or ())):
+                user_lock = os.path.join(self.root, 'locks', f"{user_id}.lock")
+                stack.enter_context(_flock(user_lock))
+            yield
+
+    def _last_trade_id(self) -> int:
+        if not os.path.exists(self.trades_path):
+            return 0
+        with open(self.trades_path, 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            start = max(0, size - _TAIL_CHUNK)
+            f.seek(start)
+            tail = f.read()
+            while start > 0 and tail.count(b'\n') < 2:
+                start = max(0, start - _TAIL_CHUNK)
+                f.seek(start)
+                tail = f.read()
+            if tail and not tail.endswith(b'\n'):
+                # недописанная строка после сбоя: сделка не подтверждена, отрезаем её
+                cut = tail.rfind(b'\n') + 1
+                f.truncate(start + cut)
+                tail = tail[:cut]
+            lines = tail.splitlines()
+        return json.loads(lines[-1])['trade_id'] if lines else 0
+
+    @traced('ledger.record')
+    def record(self, entries: Iterable[dict[str, Any]]) -> list[Trade]:
+        entries = list(entries)
+        if not entries:
+            return []
+        with self._locked(entry['user_id'] for entry in entries):
+            index: dict[int, list[bytes]] = {}
+            with _flock(os.path.join(self.root, 'trades.lock')):
+                next_id = self._last_trade_id() + 1
+                for user_id in {entry['user_id'] for entry in entries}:
+                    self._repair_index(user_id)
+                trades = [Trade(next_id + i, **entry)
+                          for i, entry in enumerate(entries)]
+                with open(self.trades_path, 'ab') as f:
+                    offset = f.tell()
+                    for trade in trades:
+                        text = json.dumps(trade.to_dict(), ensure_ascii=False)
+                        line = (text + '\n').encode('utf-8')
+                        f.write(line)
+                        entry = _INDEX_ENTRY.pack(trade.trade_id, offset, len(line))
+                        index.setdefault(trade.user_id, []).append(entry)
+                        offset += len(line)
+                    f.flush()
+                    os.fsync(f.fileno())
+                for user_id, packed in index.items():
+                    with open(self._index_path(user_id), 'ab') as f:
+                        f.write(b''.join(packed))
+                        f.flush()
+                        os.fsync(f.fileno())
+            self._update_positions(trades)
+        return trades
+
+    def _repair_index(self, user_id: int) -> None:
+        # вызывается под блокировкой пользователя и trades.lock: недописанная после
+        # сбоя запись индекса отрезается, а сделки пользователя после последней
+        # целой записи дописываются заново
+        path = self._index_path(user_id)
+        if not os.path.exists(path):
+            return
+        size = _INDEX_ENTRY.size
+        keep = os.path.getsize(path) // size * size
+        if keep == os.path.getsize(path):
+            return
+        with open(path, 'rb+') as index:
+            index.truncate(keep)
+            last_id, offset = 0, 0
+            if keep:
+                index.seek(keep - size)
+                last_id, offset, length = _INDEX_ENTRY.unpack(index.read(size))
+                offset += length
+            packed = []
+            if os.path.exists(self.trades_path):
+                with open(self.trades_path, 'rb') as f:
+                    f.seek(offset)
+                    for line in f:
+                        trade = json.loads(line)
+                        trade_id = trade['trade_id']
+                        if trade['user_id'] == user_id and trade_id > last_id:
+                            entry = _INDEX_ENTRY.pack(trade_id, offset, len(line))
+                            packed.append(entry)
+                        offset += len(line)
+            index.seek(keep)
+            index.write(b''.join(packed))
+            index.flush()
+            os.fsync(index.fileno())
+
+    def _update_positions(self, trades: list[Trade]) -> None:
+        by_user: dict[int, list[Trade]] = {}
+        for trade in trades:
+            by_user.setdefault(trade.user_id, []).append(trade)
+        for user_id, user_trades in by_user.items():
+            summary = (read_data(self._positions_path(user_id))
+                       or {'user_id': user_id, 'positions': {}})
+            for trade in user_trades:
+                _apply_position(summary['positions'], trade)
+            summary['last_trade_id'] = user_trades[-1].trade_id
+            write_data(self._positions_path(user_id), summary)
+
+    def history(self, user_id: int, limit: int = 50,
+                before: int | None = None) -> tuple[list[Trade], int | None]:
+        path = self._index_path(user_id)
+        if limit <= 0 or not os.path.exists(path):
+            return [], None
+        size = _INDEX_ENTRY.size
+        if os.path.getsize(path) % size:
+            trades_lock = os.path.join(self.root, 'trades.lock')
+            with self._locked([user_id]), _flock(trades_lock):
+                self._last_trade_id()
+                self._repair_index(user_id)
+        with open(path, 'rb') as index:
+            count = index.seek(0, os.SEEK_END) // size
+            end = count
+            if before is not None:
+                # бинарный поиск первой записи с trade_id >= before
+                lo, hi = 0, count
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    index.seek(mid * size)
+                    if _INDEX_ENTRY.unpack(index.read(size))[0] < before:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                end = lo
+            start = max(0, end - limit)
+            index.seek(start * size)
+            raw = index.read((end - start) * size)
+        entries = [_INDEX_ENTRY.unpack_from(raw, i * size) for i in range(end - start)]
+        trades = []
+        with open(self.trades_path, 'rb') as f:
+            for _, offset, length in reversed(entries):
+                f.seek(offset)
+                trades.append(Trade.from_dict(json.loads(f.read(length))))
+        next_cursor = trades[-1].trade_id if start > 0 and trades else None
+        return trades, next_cursor
+
+    def has_order_trade(self, user_id: int, order_id: int) -> bool:
+        # нужно только при восстановлении после сбоя: простой просмотр истории с конца
+        before = None
+        while True:
+            trades, before = self.history(user_id, 500, before)
+            if any(trade.order_id == order_id for trade in trades):
+                return True
+            if before is None:
+                return False
+
+    def positions(self, user_id: int) -> dict[str, dict[str, float]]:
+        summary = read_data(self._positions_path(user_id))
+        return summary['positions'] if summary else {}
+
+    def rebuild(self) -> int:
+        # восстановление индексов и сводок по trades.jsonl, например после сбоя
+        with self._locked():
+            self._last_trade_id()
+            for directory in (self.index_dir, self.positions_dir):
+                if os.path.isdir(directory):
+                    for name in os.listdir(directory):
+                        os.unlink(os.path.join(directory, name))
+            os.makedirs(self.index_dir, exist_ok=True)
+            if not os.path.exists(self.trades_path):
+                return 0
+            index: dict[int, list[bytes]] = {}
+            trades = []
+            with open(self.trades_path, 'rb') as f:
+                offset = 0
+                for line in f:
+                    trade = Trade.from_dict(json.loads(line))
+                    entry = _INDEX_ENTRY.pack(trade.trade_id, offset, len(line))
+                    index.setdefault(trade.user_id, []).append(entry)
+                    offset += len(line)
+                    trades.append(trade)
+            for user_id, packed in index.items():
+                with open(self._index_path(user_id), 'wb') as f:
+                    f.write(b''.join(packed))
+            self._update_positions(trades)
+        return len(trades)
+
+def record_trades(entries: Iterable[dict[str, Any]]) -> list[Trade]:
+    return Ledger().record(entries)
+
+def record_trade(user_id: int, side: str, currency_code: str, amount: float,
+                 rate: float | None, source: str = 'market',
+                 order_id: int | None = None) -> Trade:
+    entry = {'user_id': user_id, 'side': side, 'currency_code': currency_code,
+             'amount': amount, 'rate': rate if rate is not None else 1.0,
+             'source': source, 'order_id': order_id}
+    return record_trades([entry])[0]
+
+def get_trade_history(user_id: int, limit: int = 50,
+                      before: int | None = None) -> tuple[list[Trade], int | None]:
+    if limit <= 0:
+        raise ValueError("'limit' должен быть положительным числом")
+    return Ledger().history(user_id, limit, before)
+
+def get_pnl(user_id: int) -> list[dict[str, Any]]:
+    from .usecases import get_display_quote  # usecases импортирует ledger
+    report = []
+    for code, position in sorted(Ledger().positions(user_id).items()):
+        quote = get_display_quote(code, 'USD') if position['quantity'] else None
+        rate = quote.rate if quote else None
+        quantity, cost_basis = position['quantity'], position['cost_basis']
+        market_value = quantity * rate if rate is not None else None
+        report.append(dict(
+            position,
+            currency_code=code,
+            average_cost=cost_basis / quantity if quantity else 0.0,
+            market_rate=rate,
+            market_stale=bool(quote and quote.stale),
+            market_value=market_value,
+            unrealized_pnl=(market_value - cost_basis
+                            if market_value is not None else None),
+        ))
+    return report
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Обслуживание журнала сделок data/ledger/')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Пересобрать индексы и сводки позиций по trades.jsonl')
+    args = parser.parse_args()
+    if args.rebuild:
+        print(f"Журнал пересобран: {Ledger().rebuild()} сделок")
+    else:
+        parser.print_help()
+
+if __name__ == '__main__':
+    main()
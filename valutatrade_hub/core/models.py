@@ -1,4 +1,5 @@
 import hashlib  
+from dataclasses import dataclass
 from datetime import datetime  
 from typing import Optional  
 from typing import Dict
@@ -130,3 +131,11 @@ class Portfolio:
                     rate = 1.0  
                 total += wallet.balance * rate
         return total
+
+
+@dataclass(frozen=True)
+class RateQuote:
+    rate: float
+    updated_at: Optional[datetime] = None
+    stale: bool = False
+    mock: bool = False
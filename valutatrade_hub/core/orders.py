@@ -0,0 +1,417 @@
+import heapq
+import json
+import os
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any
+
+from ..decorators import log_action
+from ..infra.database import DatabaseManager
+from .currencies import get_currency
+from .exceptions import InsufficientFundsError
+from .ledger import Ledger, record_trades
+from .utils import DATA_DIR, load_json, save_json
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессная блокировка недоступна
+    fcntl = None
+
+SIDES = ('buy', 'sell')
+ORDER_TYPES = ('limit', 'stop')
+SNAPSHOT_FILE = 'orders.json'
+JOURNAL_FILE = 'orders.journal'
+# номера исполненных ордеров хранятся в записи портфеля (applied_orders) и пишутся
+# атомарно вместе с балансами: повторное исполнение после сбоя их не меняет.
+# Хватает последних N.
+APPLIED_ORDERS_KEPT = 200
+# журнал сворачивается в снимок, когда в нём больше событий, чем
+# max(N, половина открытых ордеров): каждый вызов CLI перечитывает снимок и весь журнал
+JOURNAL_COMPACT_EVENTS = 256
+
+class Order:
+    def __init__(self, order_id: int, user_id: int, side: str, order_type: str,
+                 currency_code: str, amount: float, price: float, status: str = 'open',
+                 created_at: str | None = None, filled_at: str | None = None,
+                 fill_rate: float | None = None):
+        self.order_id = order_id
+        self.user_id = user_id
+        self.side = side
+        self.order_type = order_type
+        self.currency_code = currency_code
+        self.amount = float(amount)
+        self.price = float(price)
+        self.status = status
+        now = datetime.now(timezone.utc)
+        self.created_at = created_at or now.isoformat(timespec='milliseconds')
+        self.filled_at = filled_at
+        self.fill_rate = fill_rate
+
+    @property
+    def triggers_above(self) -> bool:
+        # sell limit и buy stop срабатывают при росте курса,
+        # buy limit и sell stop — при падении
+        return (self.side == 'sell') == (self.order_type == 'limit')
+
+    def is_triggered(self, rate: float) -> bool:
+        return rate >= self.price if self.triggers_above else rate <= self.price
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'order_id': self.order_id,
+            'user_id': self.user_id,
+            'side': self.side,
+            'order_type': self.order_type,
+            'currency_code': self.currency_code,
+            'amount': self.amount,
+            'price': self.price,
+            'status': self.status,
+            'created_at': self.created_at,
+            'filled_at': self.filled_at,
+            'fill_rate': self.fill_rate,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> 'Order':
+        return cls(**data)
+
+    def __repr__(self) -> str:
+        return f"Order({self.describe()})"
+
+    def describe(self) -> str:
+        trigger = '≥' if self.triggers_above else '≤'
+        return (f"#{self.order_id} {self.side.upper()} {self.order_type} "
+                f"{self.amount:.4f} {self.currency_code} "
+                f"при курсе {trigger} {self.price:.2f} USD [{self.status}]")
+
+class TriggerBook:
+    def __init__(self):
+        self._above: dict[str, list[tuple[float, int]]] = {}
+        self._below: dict[str, list[tuple[float, int]]] = {}
+
+    def add(self, order: Order) -> None:
+        code = order.currency_code
+        if order.triggers_above:
+            heap, key = self._above.setdefault(code, []), order.price
+        else:
+            heap, key = self._below.setdefault(code, []), -order.price
+        heapq.heappush(heap, (key, order.order_id))
+
+    def build(self, orders: Iterable[Order]) -> None:
+        self._above.clear()
+        self._below.clear()
+        for order in orders:
+            if order.status != 'open':
+                continue
+            heap = self._above if order.triggers_above else self._below
+            key = order.price if order.triggers_above else -order.price
+            heap.setdefault(order.currency_code, []).append((key, order.order_id))
+        for heaps in (self._above, self._below):
+            for heap in heaps.values():
+                heapq.heapify(heap)
+
+    def pop_triggered(self, currency_code: str, rate: float) -> list[int]:
+        triggered = []
+        above = self._above.get(currency_code)
+        while above and above[0][0] <= rate:
+            triggered.append(heapq.heappop(above)[1])
+        below = self._below.get(currency_code)
+        while below and -below[0][0] >= rate:
+            triggered.append(heapq.heappop(below)[1])
+        return triggered
+
+class OrderBook:
+    def __init__(self):
+        self.orders: dict[int, Order] = {}
+        self.closed: list[Order] = []
+        self.next_id = 1
+        self._book: TriggerBook | None = None
+        self._journal_path = os.path.join(DATA_DIR, JOURNAL_FILE)
+        self._journal_offset = 0
+        self._journal_size = 0
+        self._generation = None
+
+    @property
+    def book(self) -> TriggerBook:
+        # кучи нужны только исполнению; list/place/cancel одного пользователя
+        # их не строят
+        if self._book is None:
+            self._book = TriggerBook()
+            self._book.build(self.orders.values())
+        return self._book
+
+    @classmethod
+    def load(cls) -> 'OrderBook':
+        order_book = cls()
+        order_book._reload()
+        return order_book
+
+    def _reload(self) -> None:
+        snapshot = load_json(SNAPSHOT_FILE)
+        self.orders = {}
+        self.next_id = snapshot.get('next_id', 1)
+        self._generation = snapshot.get('generation')
+        for data in snapshot.get('open', []):
+            order = Order.from_dict(data)
+            self.orders[order.order_id] = order
+        self.closed = [Order.from_dict(data) for data in snapshot.get('closed', [])]
+        self._journal_offset = 0
+        self._journal_size = 0
+        # журнал от другого поколения снимка уже учтён в снимке
+        # (сбой во время компактизации)
+        if self._journal_generation() == self._generation:
+            self._read_journal()
+        self._book = None
+
+    def _read_journal(self) -> list[Order]:
+        placed = []
+        if not os.path.exists(self._journal_path):
+            return placed
+        with open(self._journal_path, encoding='utf-8') as f:
+            f.seek(self._journal_offset)
+            while True:
+                line = f.readline()
+                if not line.endswith('\n'):
+                    break
+                self._journal_offset = f.tell()
+                event = json.loads(line)
+                if event['op'] == 'generation':
+                    continue
+                self._journal_size += 1
+                order = self._apply(event)
+                if event['op'] == 'place':
+                    placed.append(order)
+        return placed
+
+    def refresh(self) -> None:
+        # подхватываем события других процессов: хвост журнала или,
+        # после компактизации, весь снимок
+        if self._journal_generation() != self._generation:
+            self._reload()
+            return
+        for order in self._read_journal():
+            if self._book is not None:
+                self._book.add(order)
+
+    def _journal_generation(self) -> str | None:
+        if not os.path.exists(self._journal_path):
+            return None
+        with open(self._journal_path, encoding='utf-8') as f:
+            first = f.readline()
+        if first.endswith('\n'):
+            event = json.loads(first)
+            if event['op'] == 'generation':
+                return event['generation']
+        return None
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        with open(os.path.join(DATA_DIR, 'orders.lock'), 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self.refresh()
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _apply(self, event: dict[str, Any]) -> Order | None:
+        if event['op'] == 'place':
+            order = Order.from_dict(event['order'])
+            self.orders[order.order_id] = order
+            self.next_id = max(self.next_id, order.order_id + 1)
+            return order
+        if event['op'] == 'pending':
+            # ордер сработал, исполнение начато: курс зафиксирован,
+            # из кучи он уже извлечён
+            order = self.orders.get(event['order_id'])
+            if order is not None:
+                order.status = 'pending'
+                order.fill_rate = event['fill_rate']
+            return order
+        order = self.orders.pop(event['order_id'], None)
+        if order is None:
+            return None
+        order.status = event['status']
+        order.filled_at = event.get('filled_at')
+        order.fill_rate = event.get('fill_rate')
+        self.closed.append(order)
+        return order
+
+    def _record(self, events: list[dict[str, Any]]) -> None:
+        if not events:
+            return
+        with open(self._journal_path, 'a', encoding='utf-8') as f:
+            for event in events:
+                f.write(json.dumps(event, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+            self._journal_offset = f.tell()
+        self._journal_size += len(events)
+        if self._journal_size > max(JOURNAL_COMPACT_EVENTS, len(self.orders) // 2):
+            self.compact()
+
+    def compact(self, keep_closed: int = 1000) -> None:
+        self.closed = self.closed[-keep_closed:]
+        self._generation = datetime.now(timezone.utc).isoformat()
+        save_json(SNAPSHOT_FILE, {
+            'generation': self._generation,
+            'next_id': self.next_id,
+            'open': [order.to_dict() for order in self.orders.values()],
+            'closed': [order.to_dict() for order in self.closed],
+        })
+        temp_path = self._journal_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            marker = {'op': 'generation', 'generation': self._generation}
+            f.write(json.dumps(marker) + '\n')
+            self._journal_offset = f.tell()
+        os.replace(temp_path, self._journal_path)
+        self._journal_size = 0
+
+    def place(self, user_id: int, side: str, order_type: str, currency_code: str,
+              amount: float, price: float) -> Order:
+        with self._locked():
+            order = Order(self.next_id, user_id, side, order_type, currency_code,
+                          amount, price)
+            self._apply({'op': 'place', 'order': order.to_dict()})
+            if self._book is not None:
+                self._book.add(order)
+            self._record([{'op': 'place', 'order': order.to_dict()}])
+        return order
+
+    def cancel(self, user_id: int, order_id: int) -> Order:
+        with self._locked():
+            order = self.orders.get(order_id)
+            if order is None or order.user_id != user_id:
+                raise ValueError(f"Открытый ордер #{order_id} не найден")
+            if order.status == 'pending':
+                raise ValueError(f"Ордер #{order_id} уже исполняется")
+            # из кучи ордер удаляется лениво — при извлечении его уже не будет
+            # в self.orders
+            event = {'op': 'close', 'order_id': order_id, 'status': 'cancelled'}
+            self._apply(event)
+            self._record([event])
+        return order
+
+    def user_orders(self, user_id: int) -> list[Order]:
+        return sorted((o for o in self.orders.values() if o.user_id == user_id),
+                      key=lambda o: o.order_id)
+
+    def _pop_triggered(self, rates: dict[str, float]) -> list[Order]:
+        triggered = []
+        for pair, rate in rates.items():
+            code, _, base = pair.partition('_')
+            if base != 'USD':
+                continue
+            for order_id in self.book.pop_triggered(code, rate):
+                order = self.orders.get(order_id)
+                if order is not None:
+                    order.fill_rate = rate
+                    triggered.append(order)
+        return triggered
+
+    def execute(self, rates: dict[str, float]) -> list[tuple[Order, str]]:
+        with self._locked():
+            # сначала в журнал пишется pending: после сбоя ордер доисполняется
+            # по тому же курсу, а не остаётся открытым и не срабатывает повторно
+            pending = [{'op': 'pending', 'order_id': order.order_id,
+                        'fill_rate': order.fill_rate}
+                       for order in self._pop_triggered(rates)]
+            for event in pending:
+                self._apply(event)
+            self._record(pending)
+            # вместе с новыми — pending, оставшиеся от прерванного исполнения
+            orders = sorted((o for o in self.orders.values() if o.status == 'pending'),
+                            key=lambda o: o.order_id)
+            if not orders:
+                return []
+            results = _fill_orders(orders)
+            filled_at = datetime.now(timezone.utc).isoformat(timespec='milliseconds')
+            events = [{'op': 'close', 'order_id': order.order_id, 'status': status,
+                       'filled_at': filled_at, 'fill_rate': order.fill_rate}
+                      for order, status in results]
+            for event in events:
+                self._apply(event)
+            self._record(events)
+        return results
+
+def _fill_orders(orders: list[Order]) -> list[tuple[Order, str]]:
+    db = DatabaseManager()
+    results = []
+    fresh, recovered = [], []
+    # блокируются и перезаписываются только шарды владельцев сработавших ордеров
+    with db.lock_portfolios(order.user_id for order in orders) as by_user:
+        for order in orders:
+            p_data = by_user.setdefault(order.user_id,
+                                        {'user_id': order.user_id, 'wallets': {}})
+            applied = p_data.setdefault('applied_orders', [])
+            if order.order_id in applied:
+                # портфель изменён до сбоя — повторно не применяется
+                recovered.append(order)
+                results.append((order, 'filled'))
+                continue
+            try:
+                _apply_fill(p_data, order)
+            except InsufficientFundsError:
+                results.append((order, 'rejected'))
+                continue
+            applied.append(order.order_id)
+            del applied[:-APPLIED_ORDERS_KEPT]
+            fresh.append(order)
+            results.append((order, 'filled'))
+    # журнал сделок — только после записи портфелей; пропущенные из-за сбоя сделки
+    # дописываются
+    ledger = Ledger()
+    filled = fresh + [order for order in recovered
+                      if not ledger.has_order_trade(order.user_id, order.order_id)]
+    record_trades({'user_id': order.user_id, 'side': order.side,
+                   'currency_code': order.currency_code, 'amount': order.amount,
+                   'rate': order.fill_rate, 'source': 'order',
+                   'order_id': order.order_id}
+                  for order in sorted(filled, key=lambda o: o.order_id))
+    return results
+
+def _apply_fill(p_data: dict[str, Any], order: Order) -> None:
+    wallets = p_data.setdefault('wallets', {})
+    code = order.currency_code
+    balance = wallets.get(code, {}).get('balance', 0.0)
+    if order.side == 'buy':
+        wallets[code] = {'currency_code': code, 'balance': balance + order.amount}
+        return
+    if order.amount > balance:
+        raise InsufficientFundsError(balance, order.amount, code)
+    wallets[code] = {'currency_code': code, 'balance': balance - order.amount}
+    usd_balance = wallets.get('USD', {}).get('balance', 0.0)
+    proceeds = order.amount * order.fill_rate
+    wallets['USD'] = {'currency_code': 'USD', 'balance': usd_balance + proceeds}
+
+def execute_triggered_orders(
+        rates: dict[str, float],
+        order_book: OrderBook | None = None) -> list[tuple[Order, str]]:
+    return (order_book or OrderBook.load()).execute(rates)
+
+@log_action('PLACE_ORDER', verbose=True)
+def place_order(user_id: int, side: str, order_type: str, currency_code: str,
+                amount: float, price: float) -> Order:
+    if side not in SIDES:
+        raise ValueError(f"Сторона ордера должна быть одной из: {', '.join(SIDES)}")
+    if order_type not in ORDER_TYPES:
+        raise ValueError(f"Тип ордера должен быть одним из: {', '.join(ORDER_TYPES)}")
+    if amount <= 0:
+        raise ValueError("'amount' должен быть положительным числом")
+    if price <= 0:
+        raise ValueError("'price' должен быть положительным числом")
+    code = get_currency(currency_code).code
+    if code == 'USD':
+        raise ValueError("Ордера на USD не поддерживаются: курс задаётся в USD")
+    return OrderBook.load().place(user_id, side, order_type, code, amount, price)
+
+@log_action('CANCEL_ORDER', verbose=True)
+def cancel_order(user_id: int, order_id: int) -> Order:
+    return OrderBook.load().cancel(user_id, order_id)
+
+def list_orders(user_id: int) -> list[Order]:
+    return OrderBook.load().user_orders(user_id)
@@ -0,0 +1,193 @@
+from collections.abc import Iterable, Sequence
+from typing import Any
+
+from ..infra.database import DatabaseManager
+from ..tracing import traced
+from .currencies import get_currency
+from .exceptions import ApiRequestError, InsufficientFundsError
+from .ledger import record_trades
+from .models import RateQuote
+from .usecases import get_trade_quote
+from .utils import get_cached_rate
+
+# Расчёты за счёт USD: продажа зачисляет USD, покупка списывает. Поэтому на каждую
+# отклонившуюся валюту приходится ровно одна сделка — меньше сделок быть не может.
+# В отличие от команды buy, которая только зачисляет валюту, покупка
+# при ребалансировке оплачивается из USD-кошелька: иначе доли не сойдутся.
+SETTLEMENT = 'USD'
+MIN_TRADE_VALUE = 0.01
+DEFAULT_TOLERANCE = 1.0
+
+def parse_targets(text: str) -> dict[str, float]:
+    # 'USD=50,BTC=30,EUR=20' → доли {'USD': 0.5, 'BTC': 0.3, 'EUR': 0.2}
+    targets: dict[str, float] = {}
+    for item in (part.strip() for part in text.split(',')):
+        if not item:
+            continue
+        code, sep, value = item.partition('=')
+        if not sep:
+            raise ValueError(f"Цель '{item}' должна иметь вид КОД=процент")
+        code = get_currency(code.strip().upper()).code
+        try:
+            percent = float(value)
+        except ValueError:
+            raise ValueError(
+                f"Доля для {code} должна быть числом, получено '{value}'")
+        if percent < 0:
+            raise ValueError(f"Доля для {code} не может быть отрицательной")
+        if code in targets:
+            raise ValueError(f"Валюта {code} указана в целях дважды")
+        targets[code] = percent
+    total = sum(targets.values())
+    if abs(total - 100.0) > 0.01:
+        raise ValueError(f"Сумма долей должна быть 100%, получено {total:g}%")
+    return {code: percent / 100.0 for code, percent in targets.items()}
+
+def _balance_matrix(records: Iterable[dict[str, Any]],
+                    codes: Sequence[str]) -> tuple[list[int], list[list[float]]]:
+    column = {code: i for i, code in enumerate(codes)}
+    user_ids, rows = [], []
+    for record in records:
+        row = [0.0] * len(codes)
+        for code, wallet in record.get('wallets', {}).items():
+            row[column[code]] = wallet['balance']
+        user_ids.append(record['user_id'])
+        rows.append(row)
+    return user_ids, rows
+
+def plan_rebalance(
+        records: Iterable[dict[str, Any]], targets: dict[str, float],
+        rates: dict[str, float], tolerance: float = DEFAULT_TOLERANCE,
+) -> tuple[list[dict[str, Any]], list[tuple[int, str]]]:
+    # матрица балансов (пользователи × валюты) и один вектор курсов в USD; все шаги —
+    # поэлементные операции над строками матрицы. tolerance — допустимое отклонение
+    # доли в процентных пунктах
+    records = list(records)
+    held = {code for record in records for code in record.get('wallets', {})}
+    codes = sorted({SETTLEMENT} | set(targets) | held)
+    user_ids, balances = _balance_matrix(records, codes)
+    rate_vector = [rates.get(code) for code in codes]
+    target_vector = [targets.get(code, 0.0) for code in codes]
+    band = tolerance / 100.0
+    settle = codes.index(SETTLEMENT)
+    trades: list[dict[str, Any]] = []
+    skipped: list[tuple[int, str]] = []
+    for user_id, row in zip(user_ids, balances):
+        missing = [code for code, balance, rate in zip(codes, row, rate_vector)
+                   if balance and rate is None]
+        if missing:
+            skipped.append((user_id, f"нет свежего курса для {', '.join(missing)}"))
+            continue
+        values = [balance * (rate or 0.0)
+                  for balance, rate in zip(row, rate_vector)]
+        total = sum(values)
+        if total <= 0:
+            skipped.append((user_id, 'пустой портфель'))
+            continue
+        deltas = [target * total - value if abs(value / total - target) > band else 0.0
+                  for value, target in zip(values, target_vector)]
+        deltas[settle] = 0.0
+        # без USD-запаса (например, при отклонениях в пределах допуска) покупки
+        # пропорционально урезаются
+        buys = sum(delta for delta in deltas if delta > 0)
+        available = values[settle] - sum(delta for delta in deltas if delta < 0)
+        scale = min(1.0, available / buys) if buys > 0 else 1.0
+        deltas = [delta * scale if delta > 0 else delta for delta in deltas]
+        for code, delta, rate in zip(codes, deltas, rate_vector):
+            if abs(delta) < MIN_TRADE_VALUE:
+                continue
+            trades.append({'user_id': user_id, 'side': 'buy' if delta > 0 else 'sell',
+                           'currency_code': code, 'amount': abs(delta) / rate,
+                           'rate': rate, 'source': 'rebalance'})
+    # продажи раньше покупок, чтобы USD для покупок уже был на счёте
+    trades.sort(key=lambda t: (t['user_id'], t['side'] != 'sell', t['currency_code']))
+    return trades, skipped
+
+# расхождения на уровне 1e-9 — погрешность округления при пересчёте долей
+EPSILON = 1e-9
+
+def _apply_trade(p_data: dict[str, Any], trade: dict[str, Any]) -> None:
+    wallets = p_data.setdefault('wallets', {})
+    code = trade['currency_code']
+    sign = 1 if trade['side'] == 'buy' else -1
+    old_balance = wallets.get(code, {}).get('balance', 0.0)
+    old_usd = wallets.get(SETTLEMENT, {}).get('balance', 0.0)
+    cost = trade['amount'] * trade['rate']
+    if sign < 0 and trade['amount'] > old_balance + EPSILON:
+        raise InsufficientFundsError(old_balance, trade['amount'], code)
+    if sign > 0 and cost > old_usd + EPSILON:
+        raise InsufficientFundsError(old_usd, cost, SETTLEMENT)
+    balance = old_balance + sign * trade['amount']
+    usd_balance = old_usd - sign * cost
+    wallets[code] = {'currency_code': code,
+                     'balance': balance if balance > EPSILON else 0.0}
+    wallets[SETTLEMENT] = {'currency_code': SETTLEMENT,
+                           'balance': usd_balance if usd_balance > EPSILON else 0.0}
+
+def _trade_quotes(
+        codes: Iterable[str]) -> tuple[dict[str, RateQuote], list[str], list[str]]:
+    # курсы к USD с той же проверкой свежести, что у buy/sell (get_trade_quote):
+    # свежие котировки, валюты без курса и валюты с устаревшим курсом
+    quotes: dict[str, RateQuote] = {}
+    missing, stale = [], []
+    for code in sorted(set(codes) - {SETTLEMENT}):
+        if get_cached_rate(code, SETTLEMENT) is None:
+            missing.append(code)
+            continue
+        try:
+            quotes[code] = get_trade_quote(code)
+        except ApiRequestError:
+            stale.append(code)
+    return quotes, missing, stale
+
+def _plan(
+        records: list[dict[str, Any]], targets: dict[str, float], tolerance: float,
+) -> tuple[list[dict[str, Any]], list[tuple[int, str]], str | None]:
+    # без свежего курса целевой валюты план невозможен; владельцы прочих валют
+    # без свежего курса пропускаются. Время снимка — самый старый из курсов плана
+    held = {code for record in records for code in record.get('wallets', {})}
+    quotes, missing, stale = _trade_quotes(set(targets) | held)
+    unpriced = sorted(code for code in targets if code in missing)
+    if unpriced:
+        raise ValueError(f"Нет курса для целевых валют: {', '.join(unpriced)}. "
+                         "Выполните update-rates.")
+    outdated = sorted(code for code in targets if code in stale)
+    if outdated:
+        raise ApiRequestError(f"курсы целевых валют устарели: {', '.join(outdated)}. "
+                              "Выполните update-rates")
+    rates = {code: quote.rate for code, quote in quotes.items()}
+    rates[SETTLEMENT] = 1.0
+    trades, skipped = plan_rebalance(records, targets, rates, tolerance)
+    stamps = [quote.updated_at for quote in quotes.values()]
+    return trades, skipped, min(stamps).isoformat() if stamps else None
+
+@traced('usecase.rebalance')
+def rebalance(targets: dict[str, float], user_ids: list[int] | None = None,
+              tolerance: float = DEFAULT_TOLERANCE,
+              dry_run: bool = False) -> dict[str, Any]:
+    if tolerance < 0:
+        raise ValueError("'tolerance' не может быть отрицательным")
+    db = DatabaseManager()
+    if dry_run:
+        if user_ids is None:
+            records = list(db.iter_portfolios())
+        else:
+            records = [record for record in map(db.get_portfolio_record, user_ids)
+                       if record]
+        trades, skipped, snapshot_time = _plan(records, targets, tolerance)
+        return {'users': len(records), 'snapshot_time': snapshot_time, 'dry_run': True,
+                'trades': trades, 'skipped': skipped}
+    if user_ids is None:
+        user_ids = [record['user_id'] for record in db.iter_portfolios()]
+    # одна пакетная операция: портфели всех участников под блокировкой, план по свежим
+    # данным, по одной записи на портфель. Ошибка любой сделки отменяет всю пачку —
+    # портфели не записываются
+    with db.lock_portfolios(user_ids) as records:
+        trades, skipped, snapshot_time = _plan(list(records.values()), targets,
+                                               tolerance)
+        for trade in trades:
+            _apply_trade(records[trade['user_id']], trade)
+    # в журнал — после записи портфелей, как у buy/sell
+    record_trades(trades)
+    return {'users': len(records), 'snapshot_time': snapshot_time, 'dry_run': False,
+            'trades': trades, 'skipped': skipped}
@@ -0,0 +1,144 @@
+import csv
+import heapq
+import os
+import shutil
+import tempfile
+from collections.abc import Iterable, Iterator, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Any
+
+from ..infra.database import DatabaseManager
+from ..infra.portfolio_store import PortfolioStore
+from .currencies import get_currency
+from .utils import load_rates_snapshot, normalize_rates_cache
+
+RateSnapshot = dict[tuple[str, str], float]
+
+def build_rate_snapshot(bases: Sequence[str]) -> tuple[RateSnapshot, str | None]:
+    # один снимок кеша на весь отчёт: курс CODE→BASE берётся напрямую,
+    # через обратную пару или через USD
+    cache = normalize_rates_cache(load_rates_snapshot())
+    direct = {tuple(pair.split('_')): entry['rate']
+              for pair, entry in cache['pairs'].items() if entry['rate']}
+    to_usd: dict[str, float] = {'USD': 1.0}
+    for (from_code, to_code), rate in direct.items():
+        if to_code == 'USD':
+            to_usd.setdefault(from_code, rate)
+        elif from_code == 'USD':
+            to_usd.setdefault(to_code, 1 / rate)
+    codes = set(to_usd) | {code for pair in direct for code in pair}
+    snapshot: RateSnapshot = {}
+    for base in bases:
+        for code in codes:
+            if code == base:
+                continue
+            if (code, base) in direct:
+                snapshot[(code, base)] = direct[(code, base)]
+            elif (base, code) in direct:
+                snapshot[(code, base)] = 1 / direct[(base, code)]
+            elif code in to_usd and base in to_usd:
+                snapshot[(code, base)] = to_usd[code] / to_usd[base]
+    return snapshot, cache['last_refresh']
+
+def _value_rows(records: Iterable[dict[str, Any]], bases: Sequence[str],
+                snapshot: RateSnapshot) -> Iterator[list[Any]]:
+    for record in sorted(records, key=lambda r: r['user_id']):
+        for code, wallet in sorted(record.get('wallets', {}).items()):
+            balance = wallet['balance']
+            row = [record['user_id'], code, f"{balance:.8f}"]
+            for base in bases:
+                rate = 1.0 if code == base else snapshot.get((code, base))
+                row.append(f"{balance * rate:.2f}" if rate is not None else '')
+            yield row
+
+_worker_state: dict[str, Any] = {}
+
+def _init_worker(data_dir: str, bases: Sequence[str], snapshot: RateSnapshot) -> None:
+    _worker_state.update(store=PortfolioStore(Path(data_dir)), bases=bases,
+                         snapshot=snapshot)
+
+def _export_chunk(
+        task: tuple[int, str, list[str], list[dict[str, Any]]]) -> tuple[int, str, int]:
+    # задача: номер, каталог частей, корзины шардов (читаются воркером)
+    # или готовые записи при старой раскладке
+    index, parts_dir, buckets, records = task
+    store: PortfolioStore = _worker_state['store']
+    records = records + [record for bucket in buckets
+                         for record in store.iter_bucket(bucket)]
+    part_path = os.path.join(parts_dir, f"part-{index:05d}.csv")
+    rows = 0
+    with open(part_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        bases, snapshot = _worker_state['bases'], _worker_state['snapshot']
+        for row in _value_rows(records, bases, snapshot):
+            writer.writerow(row)
+            rows += 1
+    return index, part_path, rows
+
+def _split(items: list[Any], parts: int) -> list[list[Any]]:
+    size = max(1, -(-len(items) // parts))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def export_report(out_path: str, bases: Sequence[str],
+                  workers: int | None = None) -> dict[str, Any]:
+    bases = [get_currency(base).code for base in bases]
+    if not bases:
+        raise ValueError("Укажите хотя бы одну базовую валюту")
+    workers = workers or os.cpu_count() or 1
+    db = DatabaseManager()
+    store = db.portfolios
+    snapshot, snapshot_time = build_rate_snapshot(bases)
+    # задач больше, чем процессов, — для выравнивания нагрузки между корзинами
+    # разного размера
+    if store.sharded:
+        chunks = [(buckets, [])
+                  for buckets in _split(store.bucket_names(), workers * 4)]
+    else:
+        records = sorted(store.iter_all(), key=lambda r: r['user_id'])
+        chunks = [([], chunk) for chunk in _split(records, workers * 4)]
+    usernames = {u['user_id']: u['username'] for u in db.iter_collection('users.json')}
+    out_dir = os.path.dirname(os.path.abspath(out_path))
+    parts_dir = tempfile.mkdtemp(prefix='report-parts-', dir=out_dir)
+    try:
+        tasks = [(index, parts_dir, buckets, records)
+                 for index, (buckets, records) in enumerate(chunks)]
+        init_args = (str(db.data_dir), bases, snapshot)
+        if workers == 1 or len(tasks) <= 1:
+            _init_worker(*init_args)
+            results = [_export_chunk(task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=init_args) as pool:
+                results = list(pool.map(_export_chunk, tasks))
+        part_paths = [path for _, path, _ in sorted(results)]
+        rows, users = _merge_parts(part_paths, out_path, bases, usernames)
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+    return {'rows': rows, 'users': users, 'chunks': len(tasks), 'workers': workers,
+            'snapshot_time': snapshot_time}
+
+def _merge_parts(part_paths: list[str], out_path: str, bases: Sequence[str],
+                 usernames: dict[int, str]) -> tuple[int, int]:
+    # каждая часть отсортирована по (user_id, валюта) — слияние потоковое
+    # и не зависит от порядка завершения задач
+    temp_path = out_path + '.tmp'
+    rows = users = 0
+    last_user = None
+    with ExitStack() as stack, \
+            open(temp_path, 'w', newline='', encoding='utf-8') as out:
+        readers = [csv.reader(stack.enter_context(
+                       open(path, newline='', encoding='utf-8')))
+                   for path in part_paths]
+        writer = csv.writer(out)
+        writer.writerow(['user_id', 'username', 'currency', 'balance']
+                        + [f"value_{base}" for base in bases])
+        for row in heapq.merge(*readers, key=lambda r: (int(r[0]), r[1])):
+            user_id = int(row[0])
+            writer.writerow([user_id, usernames.get(user_id, '')] + row[1:])
+            rows += 1
+            if user_id != last_user:
+                users, last_user = users + 1, user_id
+    os.replace(temp_path, out_path)
+    return rows, users
@@ -1,14 +1,17 @@
 import hashlib
-from datetime import datetime, timedelta, timezone
-from typing import Optional, List, Dict, Any
-from .models import User, Portfolio, Wallet
-from .utils import load_json, save_json, generate_salt, get_exchange_rate
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any
+from .models import User, Portfolio, Wallet, RateQuote
+from .utils import generate_salt, get_cached_rate, get_mock_rate, rate_policy, trigger_background_refresh
 from .exceptions import CurrencyNotFoundError, InsufficientFundsError, ApiRequestError
 from .currencies import get_currency
+from .ledger import record_trade
 from ..infra.database import DatabaseManager
 from ..decorators import log_action
+from ..tracing import traced
 from ..infra.settings import SettingsLoader
 
+@traced('usecase.create_user')
 def create_user(username: str, password: str) -> Optional[User]:
     db = DatabaseManager()
     users = db.get_collection('users.json')
@@ -32,107 +35,106 @@ def create_user(username: str, password: str) -> Optional[User]:
     create_portfolio(user_id)
     return User(user_id, username, hashed_password, salt, reg_date)
 
+def _user_from_record(u_data: Dict[str, Any]) -> User:
+    reg_date = u_data['registration_date']
+    if isinstance(reg_date, str):
+        reg_date = datetime.fromisoformat(reg_date)
+    return User(
+        u_data['user_id'],
+        u_data['username'],
+        u_data['hashed_password'],
+        u_data['salt'],
+        reg_date
+    )
+
 def get_user_by_username(username: str) -> Optional[User]:
     db = DatabaseManager()
-    users = db.get_collection('users.json')
-    for u_data in users:
-        if u_data['username'] == username:
-            reg_date = u_data['registration_date']
-            if isinstance(reg_date, str):
-                reg_date = datetime.fromisoformat(reg_date)  
-            return User(
-                u_data['user_id'],
-                u_data['username'],
-                u_data['hashed_password'],
-                u_data['salt'],
-                reg_date
-            )
-    return None
+    u_data = db.find_one('users.json', lambda u: u['username'] == username)
+    return _user_from_record(u_data) if u_data else None
 
 
+@traced('usecase.verify_user_login')
 def verify_user_login(username: str, password: str) -> Optional[User]:
     user = get_user_by_username(username)
     if user and user.verify_password(password):
         return user
     return None
 
+@traced('usecase.get_user_by_id')
 def get_user_by_id(user_id: int) -> Optional[User]:
     db = DatabaseManager()
-    users = db.get_collection('users.json')
-    for u_data in users:
-        if u_data['user_id'] == user_id:
-            reg_date = u_data['registration_date']
-            if isinstance(reg_date, str):
-                reg_date = datetime.fromisoformat(reg_date) 
-            return User(
-                u_data['user_id'],
-                u_data['username'],
-                u_data['hashed_password'],
-                u_data['salt'],
-                reg_date
-            )
-    return None
+    u_data = db.get_user_by_id(user_id)
+    return _user_from_record(u_data) if u_data else None
 
 
 def create_portfolio(user_id: int) -> None:
     db = DatabaseManager()
-    portfolios = db.get_collection('portfolios.json')
-    if not any(p['user_id'] == user_id for p in portfolios):
-        portfolios.append({'user_id': user_id, 'wallets': {}})
-        db.save_collection('portfolios.json', portfolios)
+    with db.lock_portfolios([user_id]) as records:
+        records.setdefault(user_id, {'user_id': user_id, 'wallets': {}})
 
+def _portfolio_from_record(p_data: Dict[str, Any]) -> Portfolio:
+    wallets_dict: Dict[str, Wallet] = {}
+    for code, w_data in p_data['wallets'].items():
+        wallets_dict[code] = Wallet(code, w_data['balance'])
+    return Portfolio(p_data['user_id'], wallets_dict)
+
+def _merge_record(p_data: Optional[Dict[str, Any]], portfolio: Portfolio) -> Dict[str, Any]:
+    # служебные поля записи (applied_orders и т.п.) сохраняются при перезаписи кошельков
+    return dict(p_data or {}, **_portfolio_to_record(portfolio))
+
+def _portfolio_to_record(portfolio: Portfolio) -> Dict[str, Any]:
+    wallets_data: Dict[str, Dict[str, Any]] = {}
+    for code, wallet in portfolio.wallets.items():
+        wallets_data[code] = {
+            'currency_code': code,
+            'balance': wallet.balance
+        }
+    return {'user_id': portfolio.user_id, 'wallets': wallets_data}
+
+@traced('usecase.get_portfolio')
 def get_portfolio(user_id: int) -> Optional[Portfolio]:
     db = DatabaseManager()
-    portfolios = db.get_collection('portfolios.json')
-    for p_data in portfolios:
-        if p_data['user_id'] == user_id:
-            wallets_dict: Dict[str, Wallet] = {}
-            for code, w_data in p_data['wallets'].items():
-                wallets_dict[code] = Wallet(code, w_data['balance'])
-            return Portfolio(user_id, wallets_dict)
-    return None
+    p_data = db.get_portfolio_record(user_id)
+    if p_data is None:
+        return None
+    return _portfolio_from_record(p_data)
 
+@traced('usecase.save_portfolio')
 def save_portfolio(portfolio: Portfolio) -> None:
     db = DatabaseManager()
-    portfolios = db.get_collection('portfolios.json')
-    for i, p in enumerate(portfolios):
-        if p['user_id'] == portfolio.user_id:
-            wallets_data: Dict[str, Dict[str, Any]] = {}
-            for code, wallet in portfolio.wallets.items():
-                wallets_data[code] = {
-                    'currency_code': code,
-                    'balance': wallet.balance
-                }
-            portfolios[i]['wallets'] = wallets_data
-            db.save_collection('portfolios.json', portfolios)
-            return
-    create_portfolio(portfolio.user_id)
-    save_portfolio(portfolio)
+    with db.lock_portfolios([portfolio.user_id]) as records:
+        records[portfolio.user_id] = _merge_record(records.get(portfolio.user_id), portfolio)
 
+@traced('usecase.buy')
 @log_action('BUY', verbose=True)
 def buy(user_id: int, currency_code: str, amount: float) -> None:
     if amount <= 0:
         raise ValueError("'amount' должен быть положительным числом")
     get_currency(currency_code) 
     db = DatabaseManager()
-    portfolio = get_portfolio(user_id) or Portfolio(user_id)
-    wallet = portfolio.get_wallet(currency_code)
-    if not wallet:
-        portfolio.add_currency(currency_code)
+    usd_rate = get_trade_rate(currency_code)
+    # чтение и запись портфеля под блокировкой шарда пользователя: чужие портфели не затрагиваются
+    with db.lock_portfolios([user_id]) as records:
+        p_data = records.get(user_id)
+        portfolio = _portfolio_from_record(p_data) if p_data else Portfolio(user_id)
         wallet = portfolio.get_wallet(currency_code)
-    old_balance = wallet.balance
-    wallet.deposit(amount)
-    usd_rate = get_exchange_rate(currency_code, 'USD')
-    if usd_rate is None and currency_code != 'USD':
-        raise ApiRequestError('No rate data')
+        if not wallet:
+            portfolio.add_currency(currency_code)
+            wallet = portfolio.get_wallet(currency_code)
+        old_balance = wallet.balance
+        wallet.deposit(amount)
+        records[user_id] = _merge_record(records.get(user_id), portfolio)
+    # в журнал — только после записи портфеля; покупка USD за USD сделкой не является
+    if usd_rate is not None:
+        record_trade(user_id, 'buy', currency_code, amount, usd_rate)
     cost = amount * usd_rate if usd_rate else amount
     rate_str = f"{usd_rate:.2f}" if usd_rate is not None else 'N/A'
-    save_portfolio(portfolio)
     print(f"Покупка выполнена: {amount:.4f} {currency_code} по курсу {rate_str} USD/{currency_code}")
     print(f"Изменения в портфеле:\n- {currency_code}: было {old_balance:.4f} → стало {wallet.balance:.4f}")
     print(f"Оценочная стоимость покупки: {cost:.2f} USD")
     return f"Cost: {cost:.2f} USD"
 
+@traced('usecase.sell')
 @log_action('SELL', verbose=True)
 def sell(user_id: int, currency_code: str, amount: float) -> None:
     if amount <= 0:
@@ -147,39 +149,74 @@ def sell(user_id: int, currency_code: str, amount: float) -> None:
         raise CurrencyNotFoundError(currency_code)
     if amount > wallet.balance:
         raise InsufficientFundsError(wallet.balance, amount, currency_code)
-    old_balance = wallet.balance
-    wallet.withdraw(amount)
-    usd_rate = get_exchange_rate(currency_code, 'USD')
-    if usd_rate is None and currency_code != 'USD':
-        raise ApiRequestError('No rate data')
-    revenue = amount * usd_rate if usd_rate else amount
-    rate_str = f"{usd_rate:.2f}" if usd_rate is not None else 'N/A'
-    usd_wallet = portfolio.get_wallet('USD')
-    if not usd_wallet:
-        portfolio.add_currency('USD')
+    usd_rate = get_trade_rate(currency_code)
+    with db.lock_portfolios([user_id]) as records:
+        # баланс перепроверяется по свежей записи: между чтением и блокировкой мог пройти другой процесс
+        if user_id not in records:
+            raise ValueError("У вас нет портфеля.")
+        portfolio = _portfolio_from_record(records[user_id])
+        wallet = portfolio.get_wallet(currency_code)
+        if not wallet:
+            raise CurrencyNotFoundError(currency_code)
+        if amount > wallet.balance:
+            raise InsufficientFundsError(wallet.balance, amount, currency_code)
+        old_balance = wallet.balance
+        wallet.withdraw(amount)
+        revenue = amount * usd_rate if usd_rate else amount
         usd_wallet = portfolio.get_wallet('USD')
-    usd_wallet.deposit(revenue)
-    save_portfolio(portfolio)
+        if not usd_wallet:
+            portfolio.add_currency('USD')
+            usd_wallet = portfolio.get_wallet('USD')
+        usd_wallet.deposit(revenue)
+        records[user_id] = _merge_record(records.get(user_id), portfolio)
+    if usd_rate is not None:
+        record_trade(user_id, 'sell', currency_code, amount, usd_rate)
+    rate_str = f"{usd_rate:.2f}" if usd_rate is not None else 'N/A'
     print(f"Продажа выполнена: {amount:.4f} {currency_code} по курсу {rate_str} USD/{currency_code}")
     print(f"Изменения в портфеле:\n- {currency_code}: было {old_balance:.4f} → стало {wallet.balance:.4f}")
     print(f"Оценочная выручка: {revenue:.2f} USD")
     return f"Revenue: {revenue:.2f} USD"
 
-def get_rate(from_code: str, to_code: str) -> float:
+@traced('usecase.get_rate_quote')
+def get_rate_quote(from_code: str, to_code: str, max_age: Optional[int] = None, allow_mock: bool = True) -> RateQuote:
     get_currency(from_code)
     get_currency(to_code)
-    settings = SettingsLoader()
-    ttl = settings.get('rates_ttl_seconds', 300)
-    data = load_json('rates.json')
-    key = f"{from_code}_{to_code}"
-    if key in data:
-        updated_at = data[key].get('updated_at')
-        if updated_at:
-            update_time = datetime.fromisoformat(updated_at.replace('Z', '+00:00'))
-            now = datetime.now(timezone.utc)
-            if now - update_time > timedelta(seconds=ttl):
-                raise ApiRequestError('Кеш устарел, требуется обновление API')
-    rate = get_exchange_rate(from_code, to_code)
+    ttl, grace = rate_policy()
+    limit = ttl + grace if max_age is None else max_age
+    cached = get_cached_rate(from_code, to_code)
+    if cached:
+        rate, update_time = cached
+        age = (datetime.now(timezone.utc) - update_time).total_seconds()
+        if age <= ttl and age <= limit:
+            return RateQuote(rate, update_time)
+        trigger_background_refresh()
+        if age <= limit:
+            return RateQuote(rate, update_time, stale=True)
+        raise ApiRequestError('Кеш устарел, требуется обновление API')
+    # пары нет в кеше: встроенный курс допустим только для отображения и помечается как mock
+    rate = get_mock_rate(from_code, to_code) if allow_mock else None
     if rate is None:
         raise ApiRequestError('Данные курса недоступны')
-    return rate
+    return RateQuote(rate, stale=True, mock=True)
+
+def get_display_quote(from_code: str, to_code: str) -> Optional[RateQuote]:
+    # для отображения (портфель, P&L): курс не старше ttl+grace, старше ttl — с пометкой stale
+    # и фоновым обновлением; более старый не показывается — вместо него встроенный (mock) или None
+    try:
+        return get_rate_quote(from_code, to_code)
+    except ApiRequestError:
+        rate = get_mock_rate(from_code, to_code)
+        return RateQuote(rate, stale=True, mock=True) if rate is not None else None
+
+def get_trade_quote(currency_code: str) -> RateQuote:
+    # курс для сделки: не старше rates_trade_max_age_seconds и никогда не встроенный
+    max_age = SettingsLoader().get('rates_trade_max_age_seconds', 600)
+    return get_rate_quote(currency_code, 'USD', max_age=max_age, allow_mock=False)
+
+def get_trade_rate(currency_code: str) -> Optional[float]:
+    if currency_code == 'USD':
+        return None
+    return get_trade_quote(currency_code).rate
+
+def get_rate(from_code: str, to_code: str) -> float:
+    return get_rate_quote(from_code, to_code).rate
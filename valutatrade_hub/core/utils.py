@@ -1,8 +1,19 @@
-import json  
-import os    
-from datetime import datetime, timedelta, timezone
-from typing import Dict, Any, Optional, Union, List
+import os
+import subprocess
+import sys
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional, Union, List, Callable, Iterator, Tuple
+from ..infra.serializers import get_serializer, iter_data, read_data, read_data_cached, write_data
+from ..infra.settings import SettingsLoader
+from ..tracing import traced
 DATA_DIR = 'data'
+# корень пакета: фоновое обновление запускает `python -m cli.interface` из любого рабочего каталога
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+MOCK_SOURCE = 'MockParser'
+# версия схемы rates.json. Без маркера файл записан до schema 2: тогда ExchangeRate-API хранил
+# CODE_USD как «сколько CODE за 1 USD» (EUR_USD=0.86), а не цену 1 CODE в USD, как остальные источники
+RATES_SCHEMA = 2
+LEGACY_INVERTED_SOURCE = 'ExchangeRate-API'
 
 EXCHANGE_RATES = {
     'EUR_USD': 1.0786,     
@@ -15,51 +26,145 @@ EXCHANGE_RATES = {
     'USD_ETH': 1 / 3720.00,
 }
 
+def _convert_dates(item: Any) -> Any:
+    if isinstance(item, dict) and isinstance(item.get('registration_date'), str):
+        item['registration_date'] = datetime.fromisoformat(item['registration_date'])
+    return item
+
 def load_json(filename: str) -> Union[List[Dict[str, Any]], Dict[str, Any]]:
     path = os.path.join(DATA_DIR, filename)
-    if os.path.exists(path):
-        with open(path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            if isinstance(data, list):
-                for item in data:
-                    if 'registration_date' in item:
-                        item['registration_date'] = datetime.fromisoformat(item['registration_date'])
-            return data
+    data = read_data(path)
+    if data is not None:
+        if isinstance(data, list):
+            for item in data:
+                _convert_dates(item)
+        return data
     return [] if 'users' in filename or 'portfolios' in filename else {}
 
+def iter_json(filename: str, predicate: Optional[Callable[[Dict[str, Any]], bool]] = None) -> Iterator[Dict[str, Any]]:
+    path = os.path.join(DATA_DIR, filename)
+    for item in iter_data(path, predicate):
+        yield _convert_dates(item)
+
 def save_json(filename: str, data: Union[List[Dict[str, Any]], Dict[str, Any]]) -> None:
     path = os.path.join(DATA_DIR, filename)
     os.makedirs(DATA_DIR, exist_ok=True)  
     data_copy = data.copy() if isinstance(data, dict) else [item.copy() for item in data]
-    if isinstance(data_copy, list):
+    if isinstance(data_copy, list) and get_serializer().name == 'json':
         for item in data_copy:
             if 'registration_date' in item and isinstance(item['registration_date'], datetime):
                 item['registration_date'] = item['registration_date'].isoformat()
-    with open(path, 'w', encoding='utf-8') as f:
-        json.dump(data_copy, f, indent=2, ensure_ascii=False)  
+    write_data(path, data_copy)
 
-def get_exchange_rate(from_currency: str, to_currency: str) -> Optional[float]:
-    key = f"{from_currency.upper()}_{to_currency.upper()}"
-    data = load_json('rates.json')
-    if key in data:
-        updated_at = data[key].get('updated_at')
-        if updated_at:
-            reg_date_str = updated_at
-            update_time = datetime.fromisoformat(reg_date_str) 
-            now = datetime.now(timezone.utc) 
-            if now - update_time < timedelta(minutes=5):
-                return data[key]['rate']
-    
-    rate = EXCHANGE_RATES.get(key)
-    if rate is not None:
-        timestamp = datetime.now(timezone.utc).isoformat(timespec='milliseconds') 
-        data[key] = {'rate': rate, 'updated_at': timestamp}
-        data['last_refresh'] = timestamp
-        data['source'] = 'MockParser'
-        save_json('rates.json', data)
-        return rate
+def rate_policy() -> Tuple[int, int]:
+    settings = SettingsLoader()
+    return settings.get('rates_ttl_seconds', 300), settings.get('rates_stale_grace_seconds', 3600)
+
+def unwrap_rate_entry(entry: Any) -> Optional[Dict[str, Any]]:
+    # старые версии оборачивали запись кеша в новую запись при каждом обновлении:
+    # {'rate': {'rate': {'rate': 1.0, ...}, ...}, ...} — настоящие значения лежат внутри
+    merged: Dict[str, Any] = {}
+    while isinstance(entry, dict):
+        for key in ('updated_at', 'source'):
+            if key in entry:
+                merged[key] = entry[key]
+        rate = entry.get('rate')
+        if isinstance(rate, dict):
+            entry = rate
+            continue
+        if isinstance(rate, (int, float)) and not isinstance(rate, bool):
+            return dict(rate=float(rate), **merged)
+        return None
     return None
 
+def is_pair_key(key: str) -> bool:
+    from_code, sep, to_code = key.partition('_')
+    return bool(sep) and from_code.isupper() and to_code.isupper() and from_code.isalnum() and to_code.isalnum()
+
+def is_legacy_rates(data: Any) -> bool:
+    return not isinstance(data, dict) or data.get('schema') != RATES_SCHEMA
+
+def migrate_rate_entry(entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    # курс ExchangeRate-API из файла без маркера схемы переворачивается; нулевой отбрасывается
+    if entry.get('source') != LEGACY_INVERTED_SOURCE:
+        return entry
+    return dict(entry, rate=1 / entry['rate']) if entry['rate'] else None
+
+def normalize_rates_cache(data: Any) -> Dict[str, Any]:
+    # каноническая схема rates.json:
+    # {'schema': 2, 'pairs': {'BTC_USD': {'rate', 'updated_at', 'source'}}, 'last_refresh': ...}
+    legacy = is_legacy_rates(data)
+    data = data if isinstance(data, dict) else {}
+    raw = {key: value for key, value in data.items() if is_pair_key(key)}
+    raw.update(data.get('pairs') or {})
+    pairs = {}
+    for key, value in raw.items():
+        entry = unwrap_rate_entry(value)
+        if entry is not None and legacy:
+            entry = migrate_rate_entry(entry)
+        if entry is not None:
+            entry.setdefault('source', 'unknown')
+            pairs[key] = entry
+    last_refresh = data.get('last_refresh')
+    if not isinstance(last_refresh, str):
+        stamps = [entry['updated_at'] for entry in pairs.values() if isinstance(entry.get('updated_at'), str)]
+        last_refresh = max(stamps, key=parse_timestamp) if stamps else None
+    return {'schema': RATES_SCHEMA, 'pairs': dict(sorted(pairs.items())), 'last_refresh': last_refresh}
+
+def parse_timestamp(value: str) -> datetime:
+    moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+def load_rates_snapshot() -> Dict[str, Any]:
+    return read_data_cached(os.path.join(DATA_DIR, 'rates.json'), {})
+
+@traced('rates.get_cached_rate')
+def get_cached_rate(from_currency: str, to_currency: str) -> Optional[Tuple[float, datetime]]:
+    key = f"{from_currency.upper()}_{to_currency.upper()}"
+    data = load_rates_snapshot()
+    entry = unwrap_rate_entry((data.get('pairs') or {}).get(key, data.get(key)))
+    if entry is not None and is_legacy_rates(data):
+        entry = migrate_rate_entry(entry)
+    if entry is None or not entry.get('updated_at'):
+        return None
+    return entry['rate'], parse_timestamp(entry['updated_at'])
+
+def trigger_background_refresh() -> bool:
+    settings = SettingsLoader()
+    if not settings.get('rates_background_refresh', True):
+        return False
+    marker = os.path.join(DATA_DIR, '.refresh.lock')
+    cooldown = settings.get('rates_refresh_cooldown_seconds', 60)
+    try:
+        if os.path.exists(marker) and datetime.now().timestamp() - os.path.getmtime(marker) < cooldown:
+            return False
+        os.makedirs(DATA_DIR, exist_ok=True)
+        with open(marker, 'w', encoding='utf-8') as f:
+            f.write(datetime.now(timezone.utc).isoformat())
+        # рабочий каталог не меняется — процесс пишет в тот же data/, что читает вызывающий
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [PACKAGE_ROOT, env.get('PYTHONPATH')]))
+        subprocess.Popen(
+            [sys.executable, '-m', 'cli.interface', 'update-rates'],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            start_new_session=True, env=env,
+        )
+        return True
+    except OSError:
+        return False
+
+def get_mock_rate(from_currency: str, to_currency: str) -> Optional[float]:
+    # встроенные курсы — только для отображения при пустом кеше; в rates.json не пишутся
+    return EXCHANGE_RATES.get(f"{from_currency.upper()}_{to_currency.upper()}")
+
+@traced('rates.get_exchange_rate')
+def get_exchange_rate(from_currency: str, to_currency: str) -> Optional[float]:
+    # для отображения: та же политика, что у usecases.get_display_quote (он же отдаёт признак stale).
+    # Сделки используют usecases.get_trade_rate с проверкой возраста
+    from .usecases import get_display_quote
+    quote = get_display_quote(from_currency, to_currency)
+    return quote.rate if quote else None
+
 def generate_salt() -> str:
     import hashlib  
     return hashlib.sha256(str(datetime.now()).encode()).hexdigest()[:8]
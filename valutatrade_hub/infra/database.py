@@ -1,27 +1,49 @@
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Callable, Iterator, Iterable, ContextManager
 from pathlib import Path
+from .portfolio_store import PortfolioStore
 from .settings import SettingsLoader, SingletonMeta  
-from ..core.utils import load_json, save_json  
+from ..core.utils import load_json, save_json, iter_json
+from ..tracing import traced
 
 class DatabaseManager(metaclass=SingletonMeta):
     def __init__(self):
         self.settings = SettingsLoader()
         self.data_dir = Path(self.settings.get('data_dir', 'data'))
         self.data_dir.mkdir(exist_ok=True)  
+        self.portfolios = PortfolioStore(self.data_dir)
 
+    @traced('db.get_collection')
     def get_collection(self, filename: str) -> List[Dict[str, Any]] or Dict[str, Any]:
-        path = self.data_dir / filename
-        if path.exists():
-            return load_json(filename)
-        return [] if 'users' in filename or 'portfolios' in filename else {}
+        return load_json(filename)
 
+    @traced('db.save_collection')
     def save_collection(self, filename: str, data: List[Dict[str, Any]] or Dict[str, Any]) -> None:
         save_json(filename, data)
 
-    def get_user_by_id(self, user_id: int) -> Optional[Dict[str, Any]]:
-        users = self.get_collection('users.json')
-        for u in users:
-            if u.get('user_id') == user_id:
-                return u
+    def iter_collection(self, filename: str, predicate: Optional[Callable[[Dict[str, Any]], bool]] = None) -> Iterator[Dict[str, Any]]:
+        return iter_json(filename, predicate)
+
+    @traced('db.find_one')
+    def find_one(self, filename: str, predicate: Callable[[Dict[str, Any]], bool]) -> Optional[Dict[str, Any]]:
+        for item in self.iter_collection(filename, predicate):
+            return item
         return None
 
+    @traced('db.get_user_by_id')
+    def get_user_by_id(self, user_id: int) -> Optional[Dict[str, Any]]:
+        return self.find_one('users.json', lambda u: u.get('user_id') == user_id)
+
+
+    @traced('db.get_portfolio_record')
+    def get_portfolio_record(self, user_id: int) -> Optional[Dict[str, Any]]:
+        return self.portfolios.get(user_id)
+
+    @traced('db.save_portfolio_record')
+    def save_portfolio_record(self, record: Dict[str, Any]) -> None:
+        self.portfolios.save(record)
+
+    def lock_portfolios(self, user_ids: Iterable[int]) -> ContextManager[Dict[int, Dict[str, Any]]]:
+        return self.portfolios.locked(user_ids)
+
+    def iter_portfolios(self) -> Iterator[Dict[str, Any]]:
+        return self.portfolios.iter_all()
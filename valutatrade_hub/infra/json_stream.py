@@ -0,0 +1,62 @@
+import json
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional, Union
+
+CHUNK_SIZE = 64 * 1024
+_WHITESPACE = ' \t\n\r'
+
+Predicate = Callable[[Any], bool]
+
+def _skip(buf: str, pos: int, chars: str) -> int:
+    while pos < len(buf) and buf[pos] in chars:
+        pos += 1
+    return pos
+
+def iter_json_array(path: Union[str, Path], predicate: Optional[Predicate] = None,
+                    chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buf = f.read(chunk_size)
+        eof = not buf
+        pos = _skip(buf, 0, _WHITESPACE)
+        while pos >= len(buf) and not eof:
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buf += chunk
+            pos = _skip(buf, pos, _WHITESPACE)
+        if pos >= len(buf):
+            return
+        if buf[pos] != '[':
+            raise ValueError(f"{path}: ожидался JSON-массив на верхнем уровне")
+        pos += 1
+        while True:
+            pos = _skip(buf, pos, _WHITESPACE + ',')
+            if pos < len(buf) and buf[pos] == ']':
+                return
+            try:
+                if pos >= len(buf):
+                    raise json.JSONDecodeError('need more data', buf, pos)
+                item, end = decoder.raw_decode(buf, pos)
+                # число на границе чанка могло быть обрезано — дочитываем до разделителя
+                nxt = _skip(buf, end, _WHITESPACE)
+                if nxt >= len(buf) or buf[nxt] not in ',]':
+                    raise json.JSONDecodeError('Expecting \',\' delimiter', buf, nxt)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+            pos = end
+            if pos > chunk_size:
+                buf = buf[pos:]
+                pos = 0
+            if predicate is None or predicate(item):
+                yield item
+
+def find_first(path: Union[str, Path], predicate: Predicate) -> Optional[Any]:
+    for item in iter_json_array(path, predicate):
+        return item
+    return None
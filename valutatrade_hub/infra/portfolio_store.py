@@ -0,0 +1,201 @@
+import argparse
+import copy
+import os
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from .serializers import SERIALIZERS, data_exists, read_data, write_data
+from .settings import SettingsLoader
+from ..tracing import span
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессная блокировка недоступна
+    fcntl = None
+
+# Раскладка data/portfolios/: manifest.* описывает шардирование, портфель
+# пользователя лежит в <bucket>/<user_id>.*, где bucket = user_id % buckets
+# (две шестнадцатеричные цифры). Блокировка — на корзину (<bucket>/.lock),
+# так что сделки разных пользователей не ждут друг друга и не трогают чужие файлы.
+LEGACY_NAME = 'portfolios'
+SHARD_DIR = 'portfolios'
+MANIFEST_NAME = 'manifest'
+LAYOUT_VERSION = 1
+DEFAULT_BUCKETS = 256
+
+Record = Dict[str, Any]
+
+class PortfolioStore:
+    def __init__(self, data_dir: Path, buckets: int = DEFAULT_BUCKETS):
+        self.data_dir = Path(data_dir)
+        self.root = self.data_dir / SHARD_DIR
+        self.legacy_path = self.data_dir / LEGACY_NAME
+        self.manifest: Optional[Record] = None
+        self._default_buckets = buckets
+
+    @property
+    def sharded(self) -> bool:
+        if self.manifest is None:
+            self.manifest = read_data(self.root / MANIFEST_NAME)
+        if self.manifest is not None:
+            return True
+        # свежая установка сразу работает с шардами, старый файл продолжает обслуживаться до миграции
+        return not data_exists(self.legacy_path)
+
+    @property
+    def buckets(self) -> int:
+        return (self.manifest or {}).get('buckets', self._default_buckets)
+
+    def _bucket_dir(self, user_id: int) -> Path:
+        return self.root / f"{user_id % self.buckets:02x}"
+
+    def _record_path(self, user_id: int) -> Path:
+        return self._bucket_dir(user_id) / str(user_id)
+
+    def _ensure_manifest(self) -> None:
+        if self.manifest is not None:
+            return
+        manifest = {
+            'version': LAYOUT_VERSION,
+            'layout': 'user-per-file',
+            'buckets': self._default_buckets,
+            'created_at': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+        }
+        write_data(self.root / MANIFEST_NAME, manifest)
+        self.manifest = manifest
+
+    @contextmanager
+    def _flock(self, path: Path) -> Iterator[None]:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get(self, user_id: int) -> Optional[Record]:
+        if not self.sharded:
+            return next((p for p in self._load_legacy() if p['user_id'] == user_id), None)
+        return read_data(self._record_path(user_id))
+
+    def save(self, record: Record) -> None:
+        with self.locked([record['user_id']]) as records:
+            records[record['user_id']] = record
+
+    @contextmanager
+    def locked(self, user_ids: Iterable[int]) -> Iterator[Dict[int, Record]]:
+        user_ids = sorted(set(user_ids))
+        if self.manifest is None:
+            # раскладка ещё не закреплена манифестом — решаем под portfolios.lock: иначе запись
+            # в старый файл могла бы разминуться с migrate(), а первые сделки свежей установки
+            # создавали бы манифест одновременно
+            with self._flock(self.data_dir / 'portfolios.lock'):
+                if not self.sharded:
+                    with self._locked_legacy(user_ids) as records:
+                        yield records
+                    return
+                self._ensure_manifest()
+        with self._locked_sharded(user_ids) as records:
+            yield records
+
+    @contextmanager
+    def _locked_sharded(self, user_ids: List[int]) -> Iterator[Dict[int, Record]]:
+        # корзины блокируются в порядке возрастания, чтобы пакетные операции не взаимоблокировались
+        bucket_dirs = sorted({self._bucket_dir(user_id) for user_id in user_ids})
+        with ExitStack() as stack:
+            with span('portfolio.lock', buckets=len(bucket_dirs)):
+                for bucket_dir in bucket_dirs:
+                    stack.enter_context(self._flock(bucket_dir / '.lock'))
+                records = {}
+                for user_id in user_ids:
+                    record = read_data(self._record_path(user_id))
+                    if record is not None:
+                        records[user_id] = record
+                original = copy.deepcopy(records)
+            yield records
+            with span('portfolio.commit'):
+                for user_id, record in records.items():
+                    if record != original.get(user_id):
+                        write_data(self._record_path(user_id), record)
+
+    def iter_all(self) -> Iterator[Record]:
+        if not self.sharded:
+            yield from self._load_legacy()
+            return
+        for bucket in self.bucket_names():
+            yield from self.iter_bucket(bucket)
+
+    def bucket_names(self) -> List[str]:
+        if not self.root.exists():
+            return []
+        return sorted(entry.name for entry in os.scandir(self.root) if entry.is_dir())
+
+    def iter_bucket(self, bucket: str) -> Iterator[Record]:
+        bucket_dir = self.root / bucket
+        stems = sorted({Path(e.name).stem for e in os.scandir(bucket_dir) if _is_data_file(e.name)}, key=int)
+        for stem in stems:
+            record = read_data(bucket_dir / stem)
+            if record is not None:
+                yield record
+
+    def _load_legacy(self) -> List[Record]:
+        return read_data(self.legacy_path, [])
+
+    @contextmanager
+    def _locked_legacy(self, user_ids: List[int]) -> Iterator[Dict[int, Record]]:
+        # вызывается под portfolios.lock
+        portfolios = self._load_legacy()
+        by_user = {p['user_id']: p for p in portfolios}
+        records = {user_id: by_user[user_id] for user_id in user_ids if user_id in by_user}
+        original = copy.deepcopy(records)
+        yield records
+        changed = False
+        for user_id, record in records.items():
+            if record == original.get(user_id):
+                continue
+            changed = True
+            if user_id in by_user:
+                portfolios[portfolios.index(by_user[user_id])] = record
+            else:
+                portfolios.append(record)
+        if changed:
+            write_data(self.legacy_path, portfolios)
+
+def _is_data_file(name: str) -> bool:
+    return any(name.endswith(s.extension) for s in SERIALIZERS.values()) and name[0].isdigit()
+
+def migrate(data_dir: Path, buckets: int = DEFAULT_BUCKETS) -> int:
+    store = PortfolioStore(data_dir, buckets)
+    # та же блокировка, что у записей в старый файл: перенос не пересекается со сделками
+    with store._flock(store.data_dir / 'portfolios.lock'):
+        if store.sharded:
+            raise ValueError(f"{store.root}: портфели уже хранятся по шардам")
+        portfolios = store._load_legacy()
+        for record in portfolios:
+            write_data(store._record_path(record['user_id']), record)
+        for record in portfolios:
+            if read_data(store._record_path(record['user_id'])) != record:
+                raise ValueError(f"Портфель пользователя {record['user_id']} записан с искажениями")
+        # манифест пишется последним: до этого момента читатели продолжают работать со старым файлом
+        store._ensure_manifest()
+        for serializer in SERIALIZERS.values():
+            legacy = store.legacy_path.with_suffix(serializer.extension)
+            if legacy.exists():
+                os.replace(legacy, legacy.with_suffix(legacy.suffix + '.bak'))
+    return len(portfolios)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Перенос portfolios.json в шардированное хранилище data/portfolios/')
+    parser.add_argument('--data-dir', default=SettingsLoader().get('data_dir', 'data'))
+    parser.add_argument('--buckets', type=int, default=DEFAULT_BUCKETS, help='Число корзин (каталогов) для файлов пользователей')
+    args = parser.parse_args()
+    count = migrate(Path(args.data_dir), args.buckets)
+    print(f"Перенесено портфелей: {count} → {Path(args.data_dir) / SHARD_DIR} ({args.buckets} корзин)")
+    print("Исходный файл сохранён с расширением .bak")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,511 @@
+import argparse
+import json
+import os
+import struct
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+from .json_stream import iter_json_array
+from .settings import SettingsLoader
+from ..tracing import span
+
+PathLike = Union[str, Path]
+Predicate = Optional[Callable[[Any], bool]]
+
+class JsonSerializer:
+    name = 'json'
+    extension = '.json'
+
+    def dump(self, data: Any, path: PathLike) -> None:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False, default=_json_default)
+
+    def load(self, path: PathLike) -> Any:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def iter_records(self, path: PathLike, predicate: Predicate = None) -> Iterator[Any]:
+        return iter_json_array(path, predicate)
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+# Формат .vtb: b'VTB1' + вид коллекции (b'L' список / b'D' словарь), затем
+# записи «uint32 длина + тело». Первый байт тела — тип записи:
+#   'S' — определение схемы (набор полей и их типов), выдаётся один раз;
+#   'R' — запись по схеме: id схемы, фиксированная часть struct, затем строки;
+#   'G' — произвольное значение в тегированном виде.
+# В коллекции-словаре после типа записи 'R'/'G' идёт ключ.
+MAGIC = b'VTB1'
+_U16 = struct.Struct('<H')
+_U32 = struct.Struct('<I')
+_I64 = struct.Struct('<q')
+_F64 = struct.Struct('<d')
+_TS = struct.Struct('<qB')
+_DT = struct.Struct('<qBh')
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_EPOCH_NAIVE = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+# стиль строковой метки времени: зона (0 — без зоны, 1 — 'Z', 2 — '+00:00') и число знаков дробной части
+_TZ_SUFFIX = ('', 'Z', '+00:00')
+_FRACTION = (0, 3, 6)
+_TIMESPEC = ('seconds', 'milliseconds', 'microseconds')
+_FIELD_FORMATS = {'N': '', '?': '?', 'q': 'q', 'd': 'd', 's': 'I', 'z': 'qB', 't': 'qBh', 'g': 'I'}
+_MAX_DEPTH = 4
+
+def _pack_timestamp_string(text: str) -> Optional[Tuple[int, int]]:
+    if not 19 <= len(text) <= 32 or text[4:5] != '-' or text[10:11] != 'T':
+        return None
+    body = text
+    tz_style = 0
+    if text.endswith('Z'):
+        tz_style, body = 1, text[:-1]
+    elif text.endswith('+00:00'):
+        tz_style, body = 2, text[:-6]
+    fraction = len(body) - 20 if len(body) > 19 else 0
+    if fraction not in _FRACTION:
+        return None
+    try:
+        moment = datetime.fromisoformat(body)
+    except ValueError:
+        return None
+    if moment.tzinfo is not None:
+        return None
+    micros = (moment - _EPOCH_NAIVE) // _MICROSECOND
+    style = tz_style * 4 + _FRACTION.index(fraction)
+    if _unpack_timestamp_string(micros, style) != text:
+        return None
+    return micros, style
+
+def _unpack_timestamp_string(micros: int, style: int) -> str:
+    moment = _EPOCH_NAIVE + timedelta(microseconds=micros)
+    return moment.isoformat(timespec=_TIMESPEC[style % 4]) + _TZ_SUFFIX[style // 4]
+
+def _pack_datetime(value: datetime) -> Tuple[int, int, int]:
+    if value.tzinfo is None:
+        return (value - _EPOCH_NAIVE) // _MICROSECOND, 0, 0
+    offset = int(value.utcoffset().total_seconds() // 60)
+    return (value - _EPOCH) // _MICROSECOND, 1, offset
+
+def _unpack_datetime(micros: int, aware: int, offset: int) -> datetime:
+    if not aware:
+        return _EPOCH_NAIVE + timedelta(microseconds=micros)
+    return (_EPOCH + timedelta(microseconds=micros)).astimezone(timezone(timedelta(minutes=offset)))
+
+def _encode(value: Any, out: List[bytes]) -> None:
+    if value is None:
+        out.append(b'N')
+    elif value is True:
+        out.append(b'T')
+    elif value is False:
+        out.append(b'F')
+    elif isinstance(value, int):
+        if -(1 << 63) <= value < (1 << 63):
+            out.append(b'i' + _I64.pack(value))
+        else:
+            raw = str(value).encode('ascii')
+            out.append(b'I' + _U32.pack(len(raw)) + raw)
+    elif isinstance(value, float):
+        out.append(b'f' + _F64.pack(value))
+    elif isinstance(value, str):
+        packed = _pack_timestamp_string(value)
+        if packed is not None:
+            out.append(b'z' + _TS.pack(*packed))
+        else:
+            raw = value.encode('utf-8')
+            out.append(b's' + _U32.pack(len(raw)) + raw)
+    elif isinstance(value, datetime):
+        out.append(b't' + _DT.pack(*_pack_datetime(value)))
+    elif isinstance(value, (list, tuple)):
+        out.append(b'l' + _U32.pack(len(value)))
+        for item in value:
+            _encode(item, out)
+    elif isinstance(value, dict):
+        out.append(b'd' + _U32.pack(len(value)))
+        for key, item in value.items():
+            raw = str(key).encode('utf-8')
+            out.append(_U32.pack(len(raw)) + raw)
+            _encode(item, out)
+    else:
+        _encode(str(value), out)
+
+def _decode(buf: bytes, pos: int) -> Tuple[Any, int]:
+    tag = buf[pos:pos + 1]
+    pos += 1
+    if tag == b's':
+        (size,) = _U32.unpack_from(buf, pos)
+        pos += 4
+        return buf[pos:pos + size].decode('utf-8'), pos + size
+    if tag == b'f':
+        return _F64.unpack_from(buf, pos)[0], pos + 8
+    if tag == b'i':
+        return _I64.unpack_from(buf, pos)[0], pos + 8
+    if tag == b'd':
+        (count,) = _U32.unpack_from(buf, pos)
+        pos += 4
+        result = {}
+        for _ in range(count):
+            (size,) = _U32.unpack_from(buf, pos)
+            pos += 4
+            key = buf[pos:pos + size].decode('utf-8')
+            result[key], pos = _decode(buf, pos + size)
+        return result, pos
+    if tag == b'z':
+        return _unpack_timestamp_string(*_TS.unpack_from(buf, pos)), pos + _TS.size
+    if tag == b'l':
+        (count,) = _U32.unpack_from(buf, pos)
+        pos += 4
+        items = []
+        for _ in range(count):
+            item, pos = _decode(buf, pos)
+            items.append(item)
+        return items, pos
+    if tag == b'N':
+        return None, pos
+    if tag == b'T':
+        return True, pos
+    if tag == b'F':
+        return False, pos
+    if tag == b't':
+        return _unpack_datetime(*_DT.unpack_from(buf, pos)), pos + _DT.size
+    if tag == b'I':
+        (size,) = _U32.unpack_from(buf, pos)
+        pos += 4
+        return int(buf[pos:pos + size].decode('ascii')), pos + size
+    raise ValueError(f"Неизвестный тег {tag!r} в позиции {pos - 1}")
+
+def _flatten(value: Dict, signature: List, fixed: List, blobs: List[bytes], depth: int = 0) -> None:
+    for key, item in value.items():
+        key = str(key)
+        if item is None:
+            signature.append((key, 'N'))
+        elif item is True or item is False:
+            signature.append((key, '?'))
+            fixed.append(item)
+        elif isinstance(item, int) and -(1 << 63) <= item < (1 << 63):
+            signature.append((key, 'q'))
+            fixed.append(item)
+        elif isinstance(item, float):
+            signature.append((key, 'd'))
+            fixed.append(item)
+        elif isinstance(item, str):
+            packed = _pack_timestamp_string(item)
+            if packed is not None:
+                signature.append((key, 'z'))
+                fixed.extend(packed)
+            else:
+                raw = item.encode('utf-8')
+                signature.append((key, 's'))
+                fixed.append(len(raw))
+                blobs.append(raw)
+        elif isinstance(item, datetime):
+            signature.append((key, 't'))
+            fixed.extend(_pack_datetime(item))
+        elif isinstance(item, dict) and depth < _MAX_DEPTH:
+            nested: List = []
+            _flatten(item, nested, fixed, blobs, depth + 1)
+            signature.append((key, tuple(nested)))
+        else:
+            parts: List[bytes] = []
+            _encode(item, parts)
+            raw = b''.join(parts)
+            signature.append((key, 'g'))
+            fixed.append(len(raw))
+            blobs.append(raw)
+
+def _signature_format(signature: Tuple) -> str:
+    return ''.join(_signature_format(kind) if isinstance(kind, tuple) else _FIELD_FORMATS[kind]
+                   for _, kind in signature)
+
+def _signature_to_plain(signature: Tuple) -> List:
+    return [[key, _signature_to_plain(kind) if isinstance(kind, tuple) else kind] for key, kind in signature]
+
+def _signature_from_plain(plain: List) -> Tuple:
+    return tuple((key, _signature_from_plain(kind) if isinstance(kind, list) else kind) for key, kind in plain)
+
+def _compile_builder(signature: Tuple) -> Callable[[Tuple, bytes, int], Dict]:
+    # Для каждой схемы один раз собираются замыкания-читатели полей; запись разбирается
+    # проходом по ним в порядке схемы (в том же порядке лежат строки и прочие блобы).
+    counter = [0]
+
+    def take(n: int) -> int:
+        start = counter[0]
+        counter[0] += n
+        return start
+
+    def field_reader(kind: Any) -> Callable[[Tuple, bytes, int], Tuple[Any, int]]:
+        if isinstance(kind, tuple):
+            return dict_reader(kind)
+        if kind == 'N':
+            return lambda v, buf, pos: (None, pos)
+        if kind in ('?', 'q', 'd'):
+            i = take(1)
+            return lambda v, buf, pos: (v[i], pos)
+        if kind == 'z':
+            i = take(2)
+            return lambda v, buf, pos: (_unpack_timestamp_string(v[i], v[i + 1]), pos)
+        if kind == 't':
+            i = take(3)
+            return lambda v, buf, pos: (_unpack_datetime(v[i], v[i + 1], v[i + 2]), pos)
+        i = take(1)
+        if kind == 's':
+            return lambda v, buf, pos: (buf[pos:pos + v[i]].decode('utf-8'), pos + v[i])
+        return lambda v, buf, pos: (_decode(buf, pos)[0], pos + v[i])
+
+    def dict_reader(sig: Tuple) -> Callable[[Tuple, bytes, int], Tuple[Dict, int]]:
+        fields = [(key, field_reader(kind)) for key, kind in sig]
+
+        def read(v: Tuple, buf: bytes, pos: int) -> Tuple[Dict, int]:
+            result = {}
+            for key, reader in fields:
+                result[key], pos = reader(v, buf, pos)
+            return result, pos
+        return read
+
+    read_record = dict_reader(signature)
+    return lambda v, buf, pos: read_record(v, buf, pos)[0]
+
+class _SchemaReader:
+    def __init__(self, kind: bytes):
+        self.kind = kind
+        self.schemas: List[Tuple[Callable, struct.Struct]] = []
+
+    def parse(self, body: bytes, pos: int = 0) -> Optional[Tuple[Optional[str], Any]]:
+        tag = body[pos:pos + 1]
+        pos += 1
+        if tag == b'S':
+            signature = _signature_from_plain(_decode(body, pos)[0])
+            self.schemas.append((_compile_builder(signature), struct.Struct('<' + _signature_format(signature))))
+            return None
+        key = None
+        if self.kind == b'D':
+            (size,) = _U32.unpack_from(body, pos)
+            pos += 4
+            key = body[pos:pos + size].decode('utf-8')
+            pos += size
+        if tag == b'R':
+            (schema_id,) = _U16.unpack_from(body, pos)
+            build, layout = self.schemas[schema_id]
+            pos += 2
+            return key, build(layout.unpack_from(body, pos), body, pos + layout.size)
+        if tag == b'G':
+            return key, _decode(body, pos)[0]
+        raise ValueError(f"Неизвестный тип записи {tag!r}")
+
+class BinarySerializer:
+    name = 'binary'
+    extension = '.vtb'
+
+    def encode(self, data: Any) -> bytes:
+        kind = b'D' if isinstance(data, dict) else b'L'
+        parts = [MAGIC, kind]
+        items = data.items() if kind == b'D' else ((None, value) for value in data)
+        schemas: Dict[Tuple, Tuple[int, struct.Struct]] = {}
+        for key, value in items:
+            prefix = b''
+            if key is not None:
+                raw = str(key).encode('utf-8')
+                prefix = _U32.pack(len(raw)) + raw
+            if isinstance(value, dict):
+                signature: List = []
+                fixed: List = []
+                blobs: List[bytes] = []
+                _flatten(value, signature, fixed, blobs)
+                signature = tuple(signature)
+                schema = schemas.get(signature)
+                if schema is None and len(schemas) <= 0xFFFF:
+                    schema = schemas[signature] = (len(schemas), struct.Struct('<' + _signature_format(signature)))
+                    definition: List[bytes] = [b'S']
+                    _encode(_signature_to_plain(signature), definition)
+                    body = b''.join(definition)
+                    parts.append(_U32.pack(len(body)))
+                    parts.append(body)
+                if schema is not None:
+                    schema_id, layout = schema
+                    body = b''.join([b'R', prefix, _U16.pack(schema_id), layout.pack(*fixed)] + blobs)
+                    parts.append(_U32.pack(len(body)))
+                    parts.append(body)
+                    continue
+            record: List[bytes] = [b'G', prefix]
+            _encode(value, record)
+            body = b''.join(record)
+            parts.append(_U32.pack(len(body)))
+            parts.append(body)
+        return b''.join(parts)
+
+    def decode(self, buf: bytes) -> Any:
+        kind = self._check_header(buf)
+        reader = _SchemaReader(kind)
+        result: Union[Dict[str, Any], List[Any]] = {} if kind == b'D' else []
+        pos = len(MAGIC) + 1
+        size_of = _U32.unpack_from
+        while pos < len(buf):
+            (size,) = size_of(buf, pos)
+            parsed = reader.parse(buf, pos + 4)
+            pos += 4 + size
+            if parsed is None:
+                continue
+            if kind == b'D':
+                result[parsed[0]] = parsed[1]
+            else:
+                result.append(parsed[1])
+        return result
+
+    def dump(self, data: Any, path: PathLike) -> None:
+        with open(path, 'wb') as f:
+            f.write(self.encode(data))
+
+    def load(self, path: PathLike) -> Any:
+        with open(path, 'rb') as f:
+            return self.decode(f.read())
+
+    def iter_records(self, path: PathLike, predicate: Predicate = None) -> Iterator[Any]:
+        with open(path, 'rb') as f:
+            kind = self._check_header(f.read(len(MAGIC) + 1))
+            reader = _SchemaReader(kind)
+            while True:
+                size_raw = f.read(4)
+                if len(size_raw) < 4:
+                    return
+                parsed = reader.parse(f.read(_U32.unpack(size_raw)[0]))
+                if parsed is None:
+                    continue
+                item = parsed[1] if kind == b'L' else parsed
+                if predicate is None or predicate(item):
+                    yield item
+
+    @staticmethod
+    def _check_header(buf: bytes) -> bytes:
+        if buf[:len(MAGIC)] != MAGIC:
+            raise ValueError("Файл не является снимком VTB1")
+        kind = buf[len(MAGIC):len(MAGIC) + 1]
+        if kind not in (b'L', b'D'):
+            raise ValueError(f"Неизвестный вид коллекции {kind!r}")
+        return kind
+
+SERIALIZERS = {s.name: s for s in (JsonSerializer(), BinarySerializer())}
+
+def get_serializer(name: Optional[str] = None):
+    name = name or SettingsLoader().get('storage_format', 'json')
+    if name not in SERIALIZERS:
+        raise ValueError(f"Неизвестный формат хранения '{name}'")
+    return SERIALIZERS[name]
+
+def _locate(path: PathLike):
+    path = Path(path)
+    preferred = get_serializer()
+    candidates = [preferred] + [s for s in SERIALIZERS.values() if s is not preferred]
+    for serializer in candidates:
+        candidate = path.with_suffix(serializer.extension)
+        if candidate.exists():
+            return serializer, candidate
+    return preferred, None
+
+def data_exists(path: PathLike) -> bool:
+    return _locate(path)[1] is not None
+
+def data_file(path: PathLike) -> Optional[Path]:
+    return _locate(path)[1]
+
+def read_data(path: PathLike, default: Any = None) -> Any:
+    serializer, real_path = _locate(path)
+    if real_path is None:
+        return default
+    with span(f"io.read[{real_path.name}]") as s:
+        s.add_file(real_path)
+        return serializer.load(real_path)
+
+_READ_CACHE: Dict[Path, Tuple[Tuple[int, int, int], Any]] = {}
+
+def read_data_cached(path: PathLike, default: Any = None) -> Any:
+    # для долгоживущих процессов (shell): файл разбирается заново только после изменения на диске.
+    # Возвращаемый объект общий для всех вызовов — изменять его нельзя.
+    serializer, real_path = _locate(path)
+    if real_path is None:
+        return default
+    try:
+        stat = real_path.stat()
+    except FileNotFoundError:
+        return default
+    signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    cached = _READ_CACHE.get(real_path)
+    if cached and cached[0] == signature:
+        return cached[1]
+    with span(f"io.read[{real_path.name}]", cached=False) as s:
+        s.add_bytes(stat.st_size)
+        data = serializer.load(real_path)
+    _READ_CACHE[real_path] = (signature, data)
+    return data
+
+def iter_data(path: PathLike, predicate: Predicate = None) -> Iterator[Any]:
+    serializer, real_path = _locate(path)
+    if real_path is None:
+        return iter(())
+    # разбор потоковый, его время попадает в спан вызывающего кода; здесь — открытие и размер файла
+    with span(f"io.scan[{real_path.name}]") as s:
+        s.add_file(real_path)
+        return serializer.iter_records(real_path, predicate)
+
+def write_data(path: PathLike, data: Any) -> Path:
+    serializer = get_serializer()
+    target = Path(path).with_suffix(serializer.extension)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = target.with_suffix(target.suffix + '.tmp')
+    with span(f"io.write[{target.name}]") as s:
+        serializer.dump(data, temp_path)
+        s.add_file(temp_path)
+        os.replace(temp_path, target)
+    for other in SERIALIZERS.values():
+        stale = target.with_suffix(other.extension)
+        if other is not serializer and stale.exists():
+            stale.unlink()
+    return target
+
+def _normalized(data: Any) -> Any:
+    return json.loads(json.dumps(data, default=_json_default))
+
+DATA_FILES = ('users', 'portfolios', 'session', 'rates', 'exchange_rates')
+
+def convert(data_dir: PathLike, to: str, names: Tuple[str, ...] = DATA_FILES) -> List[Tuple[str, int, int]]:
+    target = SERIALIZERS[to]
+    report = []
+    for name in names:
+        for source in SERIALIZERS.values():
+            if source is target:
+                continue
+            # коллекция может быть одним файлом или каталогом шардов (data/portfolios/)
+            src_paths = [Path(data_dir) / f"{name}{source.extension}"]
+            shard_dir = Path(data_dir) / name
+            if shard_dir.is_dir():
+                src_paths += sorted(shard_dir.rglob(f"*{source.extension}"))
+            before = after = 0
+            for src_path in src_paths:
+                if not src_path.exists():
+                    continue
+                data = source.load(src_path)
+                dst_path = src_path.with_suffix(target.extension)
+                target.dump(data, dst_path)
+                if _normalized(target.load(dst_path)) != _normalized(data):
+                    dst_path.unlink()
+                    raise ValueError(f"{src_path}: преобразование в {to} не без потерь")
+                before += src_path.stat().st_size
+                after += dst_path.stat().st_size
+                src_path.unlink()
+            if before:
+                report.append((name, before, after))
+    return report
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Импорт/экспорт снимков data/ между JSON и VTB1')
+    parser.add_argument('--to', choices=sorted(SERIALIZERS), required=True)
+    parser.add_argument('--data-dir', default=SettingsLoader().get('data_dir', 'data'))
+    parser.add_argument('files', nargs='*', help='Имена коллекций без расширения (по умолчанию все)')
+    args = parser.parse_args()
+    for name, before, after in convert(args.data_dir, args.to, tuple(args.files) or DATA_FILES):
+        print(f"{name}: {before} → {after} байт")
+    print(f"Не забудьте указать \"storage_format\": \"{args.to}\" в config.json")
+
+if __name__ == '__main__':
+    main()
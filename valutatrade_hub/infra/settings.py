@@ -26,6 +26,9 @@ class SettingsLoader(metaclass=SingletonMeta):
         return {
             'data_dir': 'data',
             'rates_ttl_seconds': 300,  
+            'rates_stale_grace_seconds': 3600,
+            'rates_trade_max_age_seconds': 600,
+            'rates_background_refresh': True,
             'default_base': 'USD',
             'log_level': 'INFO',
             'supported_currencies': ['USD', 'EUR', 'RUB', 'BTC', 'ETH']
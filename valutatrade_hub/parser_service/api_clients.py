@@ -1,60 +1,157 @@
+import logging
+import zlib
 import requests
 from abc import ABC, abstractmethod
-from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List
+from urllib.parse import quote
 from .config import ParserConfig
+from .governor import get_governor
 from ..core.exceptions import ApiRequestError
+from ..tracing import span
+
+logger = logging.getLogger(__name__)
 
 class BaseApiClient(ABC):
-    @abstractmethod
+    provider: str = ''
+
+    def __init__(self, config: ParserConfig):
+        self.config = config
+        self.governor = get_governor(config)
+
     def fetch_rates(self, base_currency: str) -> Dict[str, float]:
+        return self.governor.call(self.provider, base_currency.upper(), lambda: self._fetch_rates(base_currency))
+
+    def _get(self, url: str, **kwargs) -> requests.Response:
+        with span(f"http.{self.provider}") as s:
+            response = requests.get(url, timeout=self.timeout, **kwargs)
+            s.set(status=response.status_code)
+            s.add_bytes(len(response.content))
+        return response
+
+    def _check_status(self, response: requests.Response) -> None:
+        if response.status_code == 429:
+            self.governor.drain(self.provider)
+            raise ApiRequestError(f"{self.provider}: 429 Too Many Requests")
+        response.raise_for_status()
+
+    @abstractmethod
+    def _fetch_rates(self, base_currency: str) -> Dict[str, float]:
         pass
 
 class CoinGeckoClient(BaseApiClient):
+    provider = 'coingecko'
+
     def __init__(self, config: ParserConfig):
-        self.config = config
+        super().__init__(config)
         self.url = config.COINGECKO_URL
         self.api_key = config.COINGECKO_API_KEY
         self.timeout = config.REQUEST_TIMEOUT
 
     def fetch_rates(self, base_currency: str) -> Dict[str, float]:
-        ids = [self.config.CRYPTO_ID_MAP[code] for code in self.config.CRYPTO_CURRENCIES]
+        base = base_currency.upper()
+        chunks = self._id_chunks()
+        if len(chunks) <= 1:
+            return super().fetch_rates(base)
+        # каждый кусок — отдельный запрос через governor: токены лимита тратятся на каждый,
+        # параллельность ограничена FETCH_CONCURRENCY
+        with ThreadPoolExecutor(max_workers=min(self.config.FETCH_CONCURRENCY, len(chunks))) as pool:
+            futures = []
+            for chunk in chunks:
+                key = f"{base}:{zlib.crc32(','.join(chunk).encode()):08x}"
+                futures.append(pool.submit(self.governor.call, self.provider, key, partial(self._fetch_chunk, chunk, base)))
+        rates: Dict[str, float] = {}
+        errors = []
+        for chunk, future in zip(chunks, futures):
+            try:
+                rates.update(future.result())
+            except ApiRequestError as e:
+                logger.error(f"CoinGecko chunk of {len(chunk)} ids failed: {e}")
+                errors.append(e)
+        if errors and not rates:
+            raise errors[0]
+        return rates
+
+    def _id_chunks(self) -> List[List[str]]:
+        # ids уходят в query string как 'a%2Cb%2Cc', длина URL не должна превышать MAX_URL_LENGTH
+        budget = self.config.MAX_URL_LENGTH - len(self.url) - len('?ids=&vs_currencies=xxxx')
+        chunks: List[List[str]] = []
+        current: List[str] = []
+        length = 0
+        for coin_id in self._ids():
+            cost = len(quote(coin_id, safe='')) + 3
+            if current and (length + cost > budget or len(current) >= self.config.COINGECKO_MAX_IDS_PER_REQUEST):
+                chunks.append(current)
+                current, length = [], 0
+            current.append(coin_id)
+            length += cost
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def _ids(self) -> List[str]:
+        ids = []
+        for code in self.config.CRYPTO_CURRENCIES:
+            coin_id = self.config.CRYPTO_ID_MAP.get(code)
+            if coin_id:
+                ids.append(coin_id)
+            else:
+                logger.warning(f"No CoinGecko id for {code}, skipped")
+        return ids
+
+    def _fetch_rates(self, base_currency: str) -> Dict[str, float]:
+        return self._fetch_chunk(self._ids(), base_currency.upper())
+
+    def _fetch_chunk(self, ids: List[str], base_currency: str) -> Dict[str, float]:
         params = {'ids': ','.join(ids), 'vs_currencies': base_currency.lower()}
         headers = {'x-cg-demo-api-key': self.api_key} if self.api_key else {} 
         try:
-            response = requests.get(self.url, params=params, headers=headers, timeout=self.timeout)
-            response.raise_for_status()
+            response = self._get(self.url, params=params, headers=headers)
+            self._check_status(response)
             data = response.json()
+            wanted = set(ids)
             rates = {}
             for code in self.config.CRYPTO_CURRENCIES:
-                id_key = self.config.CRYPTO_ID_MAP[code]
-                if id_key in data and base_currency.lower() in data[id_key]:
+                id_key = self.config.CRYPTO_ID_MAP.get(code)
+                if id_key in wanted and id_key in data and base_currency.lower() in data[id_key]:
                     rates[f"{code}_{base_currency}"] = data[id_key][base_currency.lower()]
             return rates
         except requests.exceptions.RequestException as e:
             raise ApiRequestError(f"CoinGecko error: {str(e)}")
 
 class ExchangeRateApiClient(BaseApiClient):
+    provider = 'exchangerate'
+
     def __init__(self, config: ParserConfig):
-        self.config = config
+        super().__init__(config)
         self.url = config.EXCHANGERATE_API_URL
         self.api_key = config.EXCHANGERATE_API_KEY
         self.timeout = config.REQUEST_TIMEOUT
 
     def fetch_rates(self, base_currency: str) -> Dict[str, float]:
+        # без ключа запрос не отправляется: ключ — часть URL
+        self.config.validate()
+        return super().fetch_rates(base_currency)
+
+    def _fetch_rates(self, base_currency: str) -> Dict[str, float]:
         endpoint = f"{self.url}/{self.api_key}/latest/{base_currency}" 
         try:
-            response = requests.get(endpoint, timeout=self.timeout)
-            response.raise_for_status()
+            response = self._get(endpoint)
+            self._check_status(response)
             data = response.json()
-            print(f"Debug ExchangeRate response: {data}")  
+            logger.debug("ExchangeRate response: %s", data)
             if data.get('result') != 'success':
                 raise ApiRequestError(f"ExchangeRate-API error: {data.get('error-type', 'Unknown')}")
             if 'conversion_rates' not in data:  
                 raise ApiRequestError(f"Invalid response structure: missing 'conversion_rates' key. Response: {data}")
+            # conversion_rates — сколько единиц валюты дают за 1 base; в кеше CODE_BASE — цена 1 CODE в base,
+            # как у CoinGecko. Сохраняется весь ответ, а не только FIAT_CURRENCIES
+            base = base_currency.upper()
             rates = {}
-            for code in self.config.FIAT_CURRENCIES:
-                if code in data['conversion_rates']: 
-                    rates[f"{code}_{base_currency}"] = data['conversion_rates'][code] 
+            for code, value in data['conversion_rates'].items():
+                if code != base and value:
+                    rates[f"{code}_{base}"] = 1 / value
             return rates
         except requests.exceptions.RequestException as e:
             raise ApiRequestError(f"ExchangeRate-API error: {str(e)}")
@@ -0,0 +1,137 @@
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from .config import ParserConfig
+from .storage import RatesStorage
+from ..core.utils import RATES_SCHEMA, is_pair_key, parse_timestamp
+from ..infra.serializers import data_file, read_data
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class CompactionReport:
+    name: str
+    records_before: int = 0
+    records_after: int = 0
+    bytes_before: int = 0
+    bytes_after: int = 0
+    duplicates: int = 0
+    downsampled: int = 0
+    dropped: int = 0
+    repaired: int = 0
+
+    @property
+    def reclaimed(self) -> int:
+        return self.bytes_before - self.bytes_after
+
+def _size(path: Path) -> int:
+    real_path = data_file(path)
+    return real_path.stat().st_size if real_path else 0
+
+def _pair_of(entry: Dict[str, Any]) -> Optional[str]:
+    if entry.get('from_currency') and entry.get('to_currency'):
+        return f"{entry['from_currency']}_{entry['to_currency']}"
+    # ранние записи содержат только id вида BTC_USD_<timestamp>
+    pair = str(entry.get('id', '')).rsplit('_', 1)[0]
+    return pair if is_pair_key(pair) else None
+
+def _bucket_start(moment: datetime, resolution: str) -> datetime:
+    moment = moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0) if resolution == 'day' else moment
+
+def _merge(group: List[Dict[str, Any]], resolution: str) -> Dict[str, Any]:
+    # в прореженной точке остаётся последний курс периода (close), плюс число исходных точек и диапазон
+    samples, low, high = 0, float('inf'), float('-inf')
+    for entry in group:
+        meta = entry.get('meta') or {}
+        samples += meta.get('samples', 1)
+        low = min(low, meta.get('min', entry['rate']))
+        high = max(high, meta.get('max', entry['rate']))
+    merged = dict(group[-1])
+    merged['meta'] = dict(merged.get('meta') or {}, resolution=resolution, samples=samples, min=low, max=high)
+    return merged
+
+def compact_history(history: List[Dict[str, Any]], now: datetime, full_hours: int, hourly_days: int,
+                    retention_days: int = 0) -> Tuple[List[Dict[str, Any]], CompactionReport]:
+    report = CompactionReport('exchange_rates', records_before=len(history))
+    seen = set()
+    dated = []
+    for entry in history:
+        pair = _pair_of(entry)
+        if pair is None or not isinstance(entry.get('rate'), (int, float)) or not entry.get('timestamp'):
+            report.dropped += 1
+            continue
+        moment = parse_timestamp(entry['timestamp'])
+        if (pair, moment) in seen:
+            report.duplicates += 1
+            continue
+        seen.add((pair, moment))
+        from_code, to_code = pair.split('_')
+        entry = dict(entry, id=entry.get('id') or f"{pair}_{entry['timestamp']}",
+                     from_currency=from_code, to_currency=to_code)
+        dated.append((moment, pair, entry))
+    dated.sort(key=lambda item: item[0])
+
+    full_cutoff = now - timedelta(hours=full_hours)
+    hourly_cutoff = now - timedelta(days=hourly_days)
+    retention_cutoff = now - timedelta(days=retention_days) if retention_days else None
+    kept: List[Tuple[datetime, Dict[str, Any]]] = []
+    groups: Dict[Tuple[str, str, datetime], List[Tuple[datetime, Dict[str, Any]]]] = {}
+    for moment, pair, entry in dated:
+        if retention_cutoff and moment < retention_cutoff:
+            report.dropped += 1
+        elif moment >= full_cutoff:
+            kept.append((moment, entry))
+        else:
+            resolution = 'hour' if moment >= hourly_cutoff else 'day'
+            groups.setdefault((pair, resolution, _bucket_start(moment, resolution)), []).append((moment, entry))
+    for (_, resolution, _), group in groups.items():
+        entries = [entry for _, entry in group]
+        if len(entries) == 1 and (entries[0].get('meta') or {}).get('resolution') == resolution:
+            kept.append(group[0])
+            continue
+        report.downsampled += len(entries) - 1
+        kept.append((group[-1][0], _merge(entries, resolution)))
+    kept.sort(key=lambda item: item[0])
+    compacted = [entry for _, entry in kept]
+    report.records_after = len(compacted)
+    return compacted, report
+
+def compact_data(config: ParserConfig, now: Optional[datetime] = None) -> List[CompactionReport]:
+    storage = RatesStorage(config)
+    now = now or datetime.now(timezone.utc)
+    with storage.locked():
+        raw = read_data(storage.rates_path, {})
+        raw = raw if isinstance(raw, dict) else {}
+        rates_report = CompactionReport('rates', bytes_before=_size(storage.rates_path))
+        # размеры — до migrate_legacy(): перенос переписывает оба файла
+        history_bytes_before = _size(storage.history_path)
+        if storage.migrate_legacy():
+            logger.info(f"Migrated legacy rates cache and history to schema {RATES_SCHEMA}")
+        entries = {key: value for key, value in raw.items() if key not in ('schema', 'pairs', 'last_refresh')}
+        entries.update(raw.get('pairs') or {})
+        rates_report.records_before = len(entries)
+        rates_report.repaired = sum(1 for value in entries.values()
+                                    if isinstance(value, dict) and isinstance(value.get('rate'), dict))
+        cache = storage.load_rates_cache()
+        rates_report.records_after = len(cache['pairs'])
+        rates_report.dropped = rates_report.records_before - rates_report.records_after
+        if cache != raw:
+            storage.save_rates(cache)
+        rates_report.bytes_after = _size(storage.rates_path)
+
+        history = storage.load_history()
+        compacted, history_report = compact_history(history, now, config.HISTORY_FULL_RESOLUTION_HOURS,
+                                                    config.HISTORY_HOURLY_DAYS, config.HISTORY_RETENTION_DAYS)
+        history_report.bytes_before = history_bytes_before
+        if compacted != history:
+            storage.save_history(compacted)
+        history_report.bytes_after = _size(storage.history_path)
+    reports = [rates_report, history_report]
+    for report in reports:
+        logger.info(f"Compacted {report.name}: records {report.records_before} -> {report.records_after}, "
+                    f"bytes {report.bytes_before} -> {report.bytes_after}, duplicates={report.duplicates} "
+                    f"downsampled={report.downsampled} dropped={report.dropped} repaired={report.repaired}")
+    return reports
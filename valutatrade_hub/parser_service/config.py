@@ -1,11 +1,17 @@
 import os
 from dataclasses import dataclass, field
 from typing import Dict, Tuple
+from ..core.exceptions import ApiRequestError
+from ..infra.settings import SettingsLoader
+
+ENV_OVERRIDES = ("COINGECKO_URL", "EXCHANGERATE_API_URL")
+# ключи API читаются только из окружения: ни в коде, ни в config.json их нет
+ENV_ONLY = ("EXCHANGERATE_API_KEY", "COINGECKO_API_KEY")
 
 @dataclass
 class ParserConfig:
-    EXCHANGERATE_API_KEY: str = os.getenv("EXCHANGERATE_API_KEY", "64c6484f05f6897d95314a5e") 
-    COINGECKO_API_KEY: str = os.getenv("COINGECKO_API_KEY", "CG-pR4hNqCAbSYYYANudbNLgAw2") 
+    EXCHANGERATE_API_KEY: str = ""
+    COINGECKO_API_KEY: str = ""
 
     COINGECKO_URL: str = "https://api.coingecko.com/api/v3/simple/price"
     EXCHANGERATE_API_URL: str = "https://v6.exchangerate-api.com/v6"
@@ -19,16 +25,61 @@ class ParserConfig:
         "SOL": "solana",
     })
 
+    # "registry" — валюты и id CoinGecko берутся из реестра валют (data/currencies.json),
+    # "static" — только перечисленные выше; явные FIAT_/CRYPTO_CURRENCIES в config.json важнее реестра
+    CURRENCY_UNIVERSE: str = "registry"
+    MAX_URL_LENGTH: int = 2000
+    COINGECKO_MAX_IDS_PER_REQUEST: int = 100
+    FETCH_CONCURRENCY: int = 4
+
     RATES_FILE_PATH: str = "data/rates.json"
     HISTORY_FILE_PATH: str = "data/exchange_rates.json"
 
     REQUEST_TIMEOUT: int = 10
 
+    RATE_LIMITS_PER_MIN: Dict[str, int] = field(default_factory=lambda: {
+        "coingecko": 50,
+        "exchangerate": 30,
+    })
+    RESPONSE_CACHE_TTL: int = 30
+    MAX_THROTTLE_WAIT: int = 60
+    GOVERNOR_STATE_DIR: str = "data/.governor"
+
+    # история: полное разрешение за последние часы, затем по точке в час, старше — по точке в день
+    HISTORY_FULL_RESOLUTION_HOURS: int = 24
+    HISTORY_HOURLY_DAYS: int = 30
+    HISTORY_RETENTION_DAYS: int = 0
+    COMPACT_INTERVAL_HOURS: int = 24
+
     
     rates_ttl_seconds: int = field(default=300)  
 
+    def __post_init__(self) -> None:
+        overrides = {key.upper(): value for key, value in SettingsLoader().get('parser', {}).items()}
+        for key, value in overrides.items():
+            if hasattr(self, key) and key not in ENV_ONLY:
+                setattr(self, key, tuple(value) if isinstance(getattr(self, key), tuple) else value)
+        for key in ENV_OVERRIDES:
+            if os.getenv(key):
+                setattr(self, key, os.getenv(key))
+        for key in ENV_ONLY:
+            setattr(self, key, os.getenv(key, ""))
+        if self.CURRENCY_UNIVERSE == "registry":
+            self._load_registry_universe(overrides)
+
+    def _load_registry_universe(self, overrides: Dict) -> None:
+        from ..core.currencies import CURRENCY_REGISTRY, CryptoCurrency, FiatCurrency
+        currencies = sorted(CURRENCY_REGISTRY.values(), key=lambda c: c.code)
+        if "FIAT_CURRENCIES" not in overrides:
+            self.FIAT_CURRENCIES = tuple(c.code for c in currencies
+                                         if isinstance(c, FiatCurrency) and c.code != self.BASE_CURRENCY)
+        id_map = {c.code: c.coingecko_id for c in currencies if isinstance(c, CryptoCurrency) and c.coingecko_id}
+        id_map.update(self.CRYPTO_ID_MAP)
+        self.CRYPTO_ID_MAP = id_map
+        if "CRYPTO_CURRENCIES" not in overrides:
+            self.CRYPTO_CURRENCIES = tuple(sorted(id_map))
+
     def validate(self) -> None:
+        # CoinGecko работает и без ключа (публичный доступ, лимит 50/min), ExchangeRate-API — нет
         if not self.EXCHANGERATE_API_KEY:
-            raise ValueError("EXCHANGERATE_API_KEY не установлен. Зарегистрируйся и добавь в .env")
-        if not self.COINGECKO_API_KEY:
-            print("CoinGecko ключ не установлен — используем публичный доступ (лимит 50/min)")
+            raise ApiRequestError("переменная окружения EXCHANGERATE_API_KEY не задана (ключ: https://www.exchangerate-api.com)")
@@ -0,0 +1,223 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+from .config import ParserConfig
+from ..core.exceptions import ApiRequestError
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессная блокировка недоступна
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Dict[str, float] = {}
+        self.error: Exception = None
+
+class RequestGovernor:
+    def __init__(self, state_dir: Path, limits_per_min: Dict[str, int], cache_ttl: float, max_wait: float):
+        self.state_dir = Path(state_dir)
+        self.limits_per_min = limits_per_min
+        self.cache_ttl = cache_ttl
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._flights: Dict[Tuple[str, str], _Flight] = {}
+        self.stats = {'requests': 0, 'cache_hits': 0, 'coalesced': 0, 'throttled': 0}
+
+    @property
+    def requests_saved(self) -> int:
+        return self.stats['cache_hits'] + self.stats['coalesced']
+
+    def snapshot(self) -> Dict[str, int]:
+        # счётчики процесса накопительные; для одного прогона берётся разность снимков
+        with self._lock:
+            return dict(self.stats)
+
+    def call(self, provider: str, key: str, fetch: Callable[[], Dict[str, float]]) -> Dict[str, float]:
+        cached = self._cached(provider, key)
+        if cached is not None:
+            return cached
+        with self._lock:
+            flight = self._flights.get((provider, key))
+            leader = flight is None
+            if leader:
+                flight = self._flights[(provider, key)] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error:
+                raise flight.error
+            # сэкономленным считается только запрос, результат которого действительно получен
+            self._count_saved(provider)
+            return dict(flight.result)
+        try:
+            # другие процессы (планировщик, update-rates, фоновое обновление) ждут того же ответа
+            # на блокировке полёта и, дождавшись, берут опубликованный результат
+            started = time.time()
+            with self._flight_lock(provider, key) as waited:
+                landed = self._landed(provider, key, started) if waited else None
+                if landed is not None:
+                    flight.result = landed
+                    self._count_saved(provider)
+                    return dict(landed)
+                self._acquire_token(provider)
+                try:
+                    flight.result = fetch()
+                except Exception:
+                    # неудачный запрос тоже ушёл к провайдеру и израсходовал лимит
+                    self._record_request(provider, key, None)
+                    raise
+                self._record_request(provider, key, flight.result)
+            return dict(flight.result)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop((provider, key), None)
+            flight.done.set()
+
+    def totals(self, provider: str) -> Dict[str, int]:
+        with self._state(provider) as state:
+            return {'requests': state.get('requests_total', 0), 'saved': state.get('saved_total', 0)}
+
+    def drain(self, provider: str) -> None:
+        with self._state(provider) as state:
+            state['tokens'] = 0.0
+            state['updated'] = time.time()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+    def _count_saved(self, provider: str) -> None:
+        self._count('coalesced')
+        with self._state(provider) as state:
+            state['saved_total'] = state.get('saved_total', 0) + 1
+
+    @contextmanager
+    def _flight_lock(self, provider: str, key: str) -> Iterator[bool]:
+        # отдельный файл на (провайдер, ключ): блокировка состояния <provider>.lock держится только
+        # на время чтения/записи счётчиков, иначе запросы разных кусков CoinGecko шли бы по одному
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        name = key.replace(':', '-').replace('/', '-')
+        with open(self.state_dir / f"{provider}.{name}.flight", 'a') as lock_file:
+            waited = False
+            if fcntl:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    waited = True
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield waited
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _landed(self, provider: str, key: str, since: float) -> Optional[Dict[str, float]]:
+        # ответ, полученный другим процессом, пока этот ждал блокировку полёта
+        with self._state(provider) as state:
+            entry = state.get('landed', {}).get(key)
+        if entry and entry['at'] >= since:
+            return entry['rates']
+        return None
+
+    def _acquire_token(self, provider: str) -> None:
+        limit = self.limits_per_min.get(provider)
+        if not limit:
+            return
+        rate = limit / 60.0
+        deadline = time.monotonic() + self.max_wait
+        throttled = False
+        while True:
+            with self._state(provider) as state:
+                now = time.time()
+                tokens = min(float(limit), state.get('tokens', float(limit)) + (now - state.get('updated', now)) * rate)
+                state['updated'] = now
+                if tokens >= 1.0:
+                    state['tokens'] = tokens - 1.0
+                    return
+                state['tokens'] = tokens
+                wait = (1.0 - tokens) / rate
+            if not throttled:
+                throttled = True
+                self._count('throttled')
+            if time.monotonic() + wait > deadline:
+                raise ApiRequestError(f"{provider}: исчерпан лимит {limit} запросов в минуту")
+            logger.info(f"{provider}: rate limit reached, waiting {wait:.1f}s")
+            time.sleep(wait)
+
+    def _cached(self, provider: str, key: str) -> Any:
+        if self.cache_ttl <= 0:
+            return None
+        with self._state(provider) as state:
+            entry = state.get('cache', {}).get(key)
+            if entry and time.time() - entry['at'] < self.cache_ttl:
+                state['saved_total'] = state.get('saved_total', 0) + 1
+                self._count('cache_hits')
+                return entry['rates']
+        return None
+
+    def _record_request(self, provider: str, key: str, rates: Optional[Dict[str, float]]) -> None:
+        self._count('requests')
+        with self._state(provider) as state:
+            state['requests_total'] = state.get('requests_total', 0) + 1
+            if rates is None:
+                return
+            now = time.time()
+            # последний ответ по ключу — для процессов, ждавших этот же запрос (даже без кеша)
+            state.setdefault('landed', {})[key] = {'at': now, 'rates': rates}
+            if self.cache_ttl <= 0:
+                return
+            cache = {k: v for k, v in state.get('cache', {}).items() if now - v['at'] < self.cache_ttl}
+            cache[key] = {'at': now, 'rates': rates}
+            state['cache'] = cache
+
+    @contextmanager
+    def _state(self, provider: str) -> Iterator[Dict[str, Any]]:
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        path = self.state_dir / f"{provider}.json"
+        with open(self.state_dir / f"{provider}.lock", 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                state: Dict[str, Any] = {}
+                if path.exists():
+                    try:
+                        with open(path, 'r', encoding='utf-8') as f:
+                            state = json.load(f)
+                    except json.JSONDecodeError:
+                        state = {}
+                before = json.dumps(state, sort_keys=True)
+                yield state
+                if json.dumps(state, sort_keys=True) != before:
+                    temp_path = path.with_suffix('.tmp')
+                    with open(temp_path, 'w', encoding='utf-8') as f:
+                        json.dump(state, f)
+                    temp_path.replace(path)
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+_GOVERNORS: Dict[str, RequestGovernor] = {}
+_GOVERNORS_LOCK = threading.Lock()
+
+def get_governor(config: ParserConfig) -> RequestGovernor:
+    with _GOVERNORS_LOCK:
+        governor = _GOVERNORS.get(config.GOVERNOR_STATE_DIR)
+        if governor is None:
+            governor = RequestGovernor(
+                Path(config.GOVERNOR_STATE_DIR),
+                dict(config.RATE_LIMITS_PER_MIN),
+                config.RESPONSE_CACHE_TTL,
+                config.MAX_THROTTLE_WAIT,
+            )
+            _GOVERNORS[config.GOVERNOR_STATE_DIR] = governor
+        return governor
@@ -1,9 +1,13 @@
+import logging
 import schedule
 import time
 from typing import Callable
+from .compaction import compact_data
 from .config import ParserConfig
 from .updater import RatesUpdater
 
+logger = logging.getLogger(__name__)
+
 class RateScheduler:
     def __init__(self, config: ParserConfig, update_func: Callable):
         self.config = config
@@ -14,9 +18,18 @@ class RateScheduler:
     def start(self):
         schedule.every(self.interval_min).minutes.do(self.update_func)
         logger.info(f"Scheduler started: update every {self.interval_min} min")
+        if self.config.COMPACT_INTERVAL_HOURS:
+            schedule.every(self.config.COMPACT_INTERVAL_HOURS).hours.do(self.compact)
+            logger.info(f"Data compaction every {self.config.COMPACT_INTERVAL_HOURS} h")
         while True:
             schedule.run_pending()
             time.sleep(60)  
 
     def run_once(self):
         self.update_func()
+
+    def compact(self):
+        try:
+            compact_data(self.config)
+        except (OSError, ValueError) as e:
+            logger.error(f"Data compaction failed: {e}")
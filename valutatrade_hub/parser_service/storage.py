@@ -1,47 +1,109 @@
-import json
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Dict, List
+from typing import Callable, Dict, Iterator, List, Optional
 from pathlib import Path
 from .config import ParserConfig
+from ..core.utils import LEGACY_INVERTED_SOURCE, is_legacy_rates, normalize_rates_cache
+from ..infra.serializers import iter_data, read_data, write_data
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессная блокировка недоступна
+    fcntl = None
 
 class RatesStorage:
     def __init__(self, config: ParserConfig):
         self.config = config
         self.rates_path = Path(config.RATES_FILE_PATH)
         self.history_path = Path(config.HISTORY_FILE_PATH)
+        self._lock_depth = 0
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        # обновление курсов и компактизация переписывают одни и те же файлы. Все записи rates.json
+        # и истории идут только под этой блокировкой; повторный вход (save_rates внутри
+        # compact_data) не берёт flock второй раз — иначе процесс заблокировал бы сам себя
+        if self._lock_depth:
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+            return
+        self.rates_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.rates_path.parent / 'rates.lock', 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._lock_depth = 1
+            try:
+                yield
+            finally:
+                self._lock_depth = 0
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
 
     def save_history_entry(self, entry: Dict) -> None:
-        temp_path = self.history_path.with_suffix('.tmp')
-        history = self.load_history() 
-        history.append(entry)
-        with open(temp_path, 'w', encoding='utf-8') as f:
-            json.dump(history, f, indent=2, default=str)
-        temp_path.rename(self.history_path)
+        with self.locked():
+            history = self.load_history() 
+            history.append(entry)
+            write_data(self.history_path, history)
+
+    def append_history(self, entries: List[Dict]) -> None:
+        # все точки одного обновления — одно чтение и одна запись файла истории
+        if not entries:
+            return
+        with self.locked():
+            history = self.load_history()
+            history.extend(entries)
+            write_data(self.history_path, history)
+
+    def save_history(self, history: List[Dict]) -> None:
+        with self.locked():
+            write_data(self.history_path, history)
 
     def load_history(self) -> List[Dict]:
-        if self.history_path.exists():
-            with open(self.history_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if isinstance(data, list):
-                    return data
-                else:
-                    print("Warning: history file is dict, converting to list")
-                    return []
+        data = read_data(self.history_path, [])
+        if isinstance(data, list):
+            return data
+        print("Warning: history file is dict, converting to list")
         return []
 
+    def iter_history(self, predicate: Optional[Callable[[Dict], bool]] = None) -> Iterator[Dict]:
+        return iter_data(self.history_path, predicate)
+
     def save_rates_cache(self, rates: Dict[str, float], source: str) -> None:
         timestamp = datetime.utcnow().isoformat() + 'Z'
-        cache = self.load_rates_cache()
-        for pair, rate in rates.items():
-            cache[pair] = {'rate': rate, 'updated_at': timestamp, 'source': source}
-        cache['last_refresh'] = timestamp
-        temp_path = self.rates_path.with_suffix('.tmp')
-        with open(temp_path, 'w', encoding='utf-8') as f:
-            json.dump(cache, f, indent=2, default=str)
-        temp_path.rename(self.rates_path)
+        self.save_rate_entries({pair: {'rate': rate, 'updated_at': timestamp, 'source': source}
+                                for pair, rate in rates.items()})
+
+    def migrate_legacy(self) -> bool:
+        # файл курсов без маркера схемы: в истории точки ExchangeRate-API тоже перевёрнуты —
+        # исправляются вместе с кешем, под одной блокировкой, после чего появляется маркер
+        with self.locked():
+            raw = read_data(self.rates_path, None)
+            if raw is None or not is_legacy_rates(raw):
+                return False
+            history = self.load_history()
+            for entry in history:
+                if entry.get('source') == LEGACY_INVERTED_SOURCE and entry.get('rate'):
+                    entry['rate'] = 1 / entry['rate']
+            write_data(self.history_path, history)
+            write_data(self.rates_path, normalize_rates_cache(raw))
+            return True
+
+    def save_rate_entries(self, entries: Dict[str, Dict]) -> None:
+        with self.locked():
+            self.migrate_legacy()
+            cache = self.load_rates_cache()
+            cache['pairs'].update(entries)
+            stamps = [entry['updated_at'] for entry in entries.values()]
+            if stamps:
+                cache['last_refresh'] = max(stamps)
+            write_data(self.rates_path, cache)
+
+    def save_rates(self, cache: Dict[str, Dict]) -> None:
+        with self.locked():
+            write_data(self.rates_path, cache)
 
     def load_rates_cache(self) -> Dict[str, Dict]:
-        if self.rates_path.exists():
-            with open(self.rates_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return {}
+        return normalize_rates_cache(read_data(self.rates_path, {}))
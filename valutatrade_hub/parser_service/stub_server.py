@@ -0,0 +1,164 @@
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs, urlparse
+from ..core.currencies import CURRENCY_REGISTRY, FiatCurrency
+
+COINGECKO_PATH = '/api/v3/simple/price'
+EXCHANGERATE_PREFIX = '/v6/'
+
+@dataclass
+class StubConfig:
+    host: str = '127.0.0.1'
+    port: int = 8765
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    rate_429: float = 0.0
+    max_per_minute: int = 0
+    payload_currencies: int = 0
+    seed: int = 42
+
+@dataclass
+class StubStats:
+    requests: int = 0
+    by_status: Dict[int, int] = field(default_factory=dict)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, status: int) -> None:
+        with self.lock:
+            self.requests += 1
+            self.by_status[status] = self.by_status.get(status, 0) + 1
+
+def _price(key: str, low: float, high: float) -> float:
+    # цена детерминирована по коду, чтобы ответы были стабильны между запусками
+    fraction = (zlib.crc32(key.encode()) % 10_000) / 10_000
+    return round(low + (high - low) * fraction, 6)
+
+class StubRatesServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config: StubConfig):
+        super().__init__((config.host, config.port), _StubHandler)
+        self.config = config
+        self.stats = StubStats()
+        self.random = random.Random(config.seed)
+        self._random_lock = threading.Lock()
+        self._window: List[float] = []
+        self.fiat_codes = [c.code for c in CURRENCY_REGISTRY.values() if isinstance(c, FiatCurrency)]
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def roll(self) -> float:
+        with self._random_lock:
+            return self.random.random()
+
+    def over_limit(self) -> bool:
+        if not self.config.max_per_minute:
+            return False
+        with self._random_lock:
+            now = time.monotonic()
+            self._window = [t for t in self._window if now - t < 60]
+            if len(self._window) >= self.config.max_per_minute:
+                return True
+            self._window.append(now)
+            return False
+
+class _StubHandler(BaseHTTPRequestHandler):
+    server: StubRatesServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        config = self.server.config
+        delay = config.latency_ms + config.jitter_ms * self.server.roll()
+        if delay:
+            time.sleep(delay / 1000)
+        if self.server.over_limit() or self.server.roll() < config.rate_429:
+            return self._send(429, {'status': {'error_code': 429, 'error_message': 'rate limited'}})
+        if self.server.roll() < config.error_rate:
+            return self._send(500, {'error': 'stub failure'})
+        parsed = urlparse(self.path)
+        if parsed.path == COINGECKO_PATH:
+            return self._send(200, self._coingecko(parse_qs(parsed.query)))
+        if parsed.path.startswith(EXCHANGERATE_PREFIX):
+            return self._send(*self._exchangerate(parsed.path[len(EXCHANGERATE_PREFIX):].split('/')))
+        self._send(404, {'error': 'not found'})
+
+    def _coingecko(self, query: Dict[str, List[str]]) -> Dict:
+        ids = [i for i in ','.join(query.get('ids', [''])).split(',') if i]
+        vs = [v.lower() for v in ','.join(query.get('vs_currencies', ['usd'])).split(',') if v]
+        body = {}
+        for coin_id in ids:
+            body[coin_id] = {currency: _price(f"{coin_id}:{currency}", 0.01, 100_000) for currency in vs}
+        return body
+
+    def _exchangerate(self, parts: List[str]) -> Tuple[int, Dict]:
+        if len(parts) != 3 or parts[1] != 'latest':
+            return 404, {'result': 'error', 'error-type': 'unsupported-code'}
+        base = parts[2].upper()
+        codes = list(self.server.fiat_codes)
+        extra = max(0, self.server.config.payload_currencies - len(codes))
+        codes += [f"X{i:03d}" for i in range(extra)]
+        if self.server.config.payload_currencies:
+            codes = codes[:self.server.config.payload_currencies]
+        rates = {code: (1.0 if code == base else _price(f"{base}:{code}", 0.001, 5000)) for code in codes}
+        return 200, {
+            'result': 'success',
+            'base_code': base,
+            'time_last_update_unix': int(time.time()),
+            'conversion_rates': rates,
+        }
+
+    def _send(self, status: int, body: Dict) -> None:
+        payload = json.dumps(body).encode('utf-8')
+        self.server.stats.record(status)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+def start_stub_server(config: StubConfig) -> StubRatesServer:
+    server = StubRatesServer(config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Локальная заглушка CoinGecko и ExchangeRate-API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Базовая задержка ответа')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='Случайная добавка к задержке')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов 500')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='Доля случайных ответов 429')
+    parser.add_argument('--max-per-minute', type=int, default=0, help='Жёсткий лимит запросов (0 — без лимита)')
+    parser.add_argument('--payload-currencies', type=int, default=0, help='Число валют в conversion_rates')
+    args = parser.parse_args()
+    config = StubConfig(args.host, args.port, args.latency_ms, args.jitter_ms, args.error_rate,
+                        args.rate_429, args.max_per_minute, args.payload_currencies)
+    server = StubRatesServer(config)
+    print(f"Заглушка API запущена на {server.base_url}")
+    print(f"  COINGECKO_URL={server.base_url}{COINGECKO_PATH}")
+    print(f"  EXCHANGERATE_API_URL={server.base_url}/v6")
+    print("  EXCHANGERATE_API_KEY=stub (заглушка ключ не проверяет)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Обработано запросов: {server.stats.requests}, по статусам: {server.stats.by_status}")
+
+if __name__ == '__main__':
+    main()
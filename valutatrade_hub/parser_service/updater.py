@@ -5,6 +5,8 @@ from .config import ParserConfig
 from .api_clients import CoinGeckoClient, ExchangeRateApiClient
 from .storage import RatesStorage
 from ..core.exceptions import ApiRequestError
+from ..core.currencies import register_codes
+from ..core.orders import OrderBook, execute_triggered_orders
 
 logger = logging.getLogger(__name__)
 
@@ -14,16 +16,21 @@ class RatesUpdater:
         self.coingecko = CoinGeckoClient(config)
         self.exrate = ExchangeRateApiClient(config)
         self.storage = RatesStorage(config)
+        self.order_book = None
 
     def run_update(self) -> Dict[str, int]:
         logger.info("Starting rates update...")
+        governor = self.coingecko.governor
+        before = governor.snapshot()
         all_rates = {}
+        sources = {}
         errors = 0
 
         try:
             fiat_rates = self.exrate.fetch_rates(self.config.BASE_CURRENCY)
             all_rates.update(fiat_rates)
-            logger.info(f"Fetched from ExchangeRate-API (key: {self.config.EXCHANGERATE_API_KEY[:8]}...): {len(fiat_rates)} rates")
+            sources.update(dict.fromkeys(fiat_rates, 'ExchangeRate-API'))
+            logger.info(f"Fetched from ExchangeRate-API: {len(fiat_rates)} rates")
         except ApiRequestError as e:
             logger.error(f"Failed ExchangeRate-API: {e}")
             errors += 1
@@ -31,36 +38,60 @@ class RatesUpdater:
         try:
             crypto_rates = self.coingecko.fetch_rates(self.config.BASE_CURRENCY)
             all_rates.update(crypto_rates)
-            logger.info(f"Fetched from CoinGecko (key: {self.config.COINGECKO_API_KEY[:8]}...): {len(crypto_rates)} rates")
+            sources.update(dict.fromkeys(crypto_rates, 'CoinGecko'))
+            logger.info(f"Fetched from CoinGecko: {len(crypto_rates)} rates")
         except ApiRequestError as e:
             logger.error(f"Failed CoinGecko: {e}")
             errors += 1
 
-        
         if all_rates:
+            self._register_new_codes(all_rates)
             timestamp = datetime.utcnow().isoformat() + 'Z'
-            cache = self.storage.load_rates_cache()
+            entries = {}
+            history = []
             for pair, rate in all_rates.items():
                 from_curr, to_curr = pair.split('_')
-                source = 'ExchangeRate-API' if from_curr in self.config.FIAT_CURRENCIES else 'CoinGecko' 
-                cache[pair] = {'rate': rate, 'updated_at': timestamp, 'source': source}
-            cache['last_refresh'] = timestamp
-            self.storage.save_rates_cache(cache, 'ParserService') 
-            for pair, rate in all_rates.items():
-                from_curr, to_curr = pair.split('_')
-                source = 'ExchangeRate-API' if from_curr in self.config.FIAT_CURRENCIES else 'CoinGecko'
-                entry = {
+                entries[pair] = {'rate': rate, 'updated_at': timestamp, 'source': sources[pair]}
+                history.append({
                     'id': f"{pair}_{timestamp}",
                     'from_currency': from_curr,
                     'to_currency': to_curr,
                     'rate': rate,
                     'timestamp': timestamp,
-                    'source': source,
+                    'source': sources[pair],
                     'meta': {'request_ms': 0, 'status_code': 200}
-                }
-                self.storage.save_history_entry(entry)
+                })
+            # кеш и история пишутся одним пакетом, а не по файлу на пару
+            self.storage.save_rate_entries(entries)
+            self.storage.append_history(history)
             logger.info(f"Saved {len(all_rates)} rates to cache/history")
+            self.process_orders(all_rates)
         else:
             logger.warning("No rates fetched — nothing saved")
 
-        return {'updated': len(all_rates), 'errors': errors}
+        stats = {name: value - before[name] for name, value in governor.snapshot().items()}
+        logger.info(f"Request governor: requests={stats['requests']} cache_hits={stats['cache_hits']} "
+                    f"coalesced={stats['coalesced']} throttled={stats['throttled']}")
+
+        return {'updated': len(all_rates), 'errors': errors, 'saved': stats['cache_hits'] + stats['coalesced']}
+
+    def process_orders(self, rates: Dict[str, float]) -> int:
+        if self.order_book is None:
+            self.order_book = OrderBook.load()
+        results = execute_triggered_orders(rates, self.order_book)
+        for order, status in results:
+            logger.info(f"Order #{order.order_id} user_id={order.user_id} {order.side} {order.order_type} "
+                        f"{order.amount} {order.currency_code} at {order.fill_rate}: {status}")
+        return len(results)
+
+    def _register_new_codes(self, rates: Dict[str, float]) -> None:
+        fiat_codes, crypto_codes = set(), set()
+        for pair in rates:
+            from_curr, to_curr = pair.split('_')
+            target = crypto_codes if from_curr in self.config.CRYPTO_CURRENCIES else fiat_codes
+            target.add(from_curr)
+            fiat_codes.add(to_curr)
+        added = register_codes(fiat_codes, 'fiat', persist=True)
+        added += register_codes(crypto_codes, 'crypto', persist=True, coingecko_ids=self.config.CRYPTO_ID_MAP)
+        if added:
+            logger.info(f"Registered new currency codes from providers: {', '.join(sorted(added))}")
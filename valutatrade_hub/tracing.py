@@ -0,0 +1,199 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# Трассировка команд: вложенные спаны (команда → use case → DatabaseManager → файл → HTTP)
+# с временем и объёмом данных. Пока трассировка не включена, span() возвращает общий
+# пустой объект, а traced() сразу вызывает функцию — накладные расходы сводятся к одной проверке.
+
+class Span:
+    __slots__ = ('name', 'attrs', 'start', 'end', 'tid', 'parent', 'bytes')
+
+    def __init__(self, name: str, attrs: Dict[str, Any], tid: int, parent: Optional['Span']):
+        self.name = name
+        self.attrs = attrs
+        self.tid = tid
+        self.parent = parent
+        self.bytes = 0
+        self.start = time.perf_counter()
+        self.end = self.start
+
+    def add_bytes(self, count: int) -> None:
+        self.bytes += count
+
+    def add_file(self, path: Any) -> None:
+        self.bytes += file_size(path)
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+    def path(self) -> List[str]:
+        names = []
+        span = self
+        while span is not None:
+            names.append(span.name)
+            span = span.parent
+        return names[::-1]
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> '_NullSpan':
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        return None
+
+    def add_bytes(self, count: int) -> None:
+        pass
+
+    def add_file(self, path: Any) -> None:
+        # размер файла узнаётся только при включённой трассировке: без неё — ни одного stat()
+        pass
+
+    def set(self, **attrs: Any) -> None:
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class Tracer:
+    def __init__(self):
+        self.spans: List[Span] = []
+        self.origin = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self) -> List[Span]:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextmanager
+    def span(self, name: str, **attrs: Any) -> Iterator[Span]:
+        stack = self._stack()
+        current = Span(name, attrs, threading.get_ident(), stack[-1] if stack else None)
+        stack.append(current)
+        try:
+            yield current
+        except BaseException as e:
+            current.attrs['error'] = type(e).__name__
+            raise
+        finally:
+            current.end = time.perf_counter()
+            stack.pop()
+            with self._lock:
+                self.spans.append(current)
+
+    def collapsed(self) -> List[str]:
+        # формат flamegraph.pl / speedscope: "a;b;c <собственное время в мкс>"
+        self_time: Dict[str, float] = {}
+        children: Dict[int, float] = {}
+        for span in self.spans:
+            if span.parent is not None:
+                children[id(span.parent)] = children.get(id(span.parent), 0.0) + span.duration
+        for span in self.spans:
+            key = ';'.join(span.path())
+            self_time[key] = self_time.get(key, 0.0) + max(0.0, span.duration - children.get(id(span), 0.0))
+        return [f"{key} {int(round(value * 1e6))}" for key, value in sorted(self_time.items())]
+
+    def chrome_trace(self) -> Dict[str, Any]:
+        # формат chrome://tracing / Perfetto: полные события 'X', время в микросекундах
+        pid = os.getpid()
+        events = []
+        for span in sorted(self.spans, key=lambda s: s.start):
+            args = dict(span.attrs)
+            if span.bytes:
+                args['bytes'] = span.bytes
+            events.append({'name': span.name, 'cat': span.name.split('.', 1)[0], 'ph': 'X', 'pid': pid,
+                           'tid': span.tid, 'ts': round((span.start - self.origin) * 1e6, 3),
+                           'dur': round(span.duration * 1e6, 3), 'args': {k: str(v) for k, v in args.items()}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write(self, path: str, fmt: Optional[str] = None) -> str:
+        fmt = fmt or ('chrome' if path.endswith('.json') else 'collapsed')
+        with open(path, 'w', encoding='utf-8') as f:
+            if fmt == 'chrome':
+                json.dump(self.chrome_trace(), f)
+            else:
+                f.write('\n'.join(self.collapsed()) + '\n')
+        return fmt
+
+    def summary(self, top: int = 10) -> List[str]:
+        totals: Dict[str, List[float]] = {}
+        for span in self.spans:
+            item = totals.setdefault(span.name, [0, 0.0, 0])
+            item[0] += 1
+            item[1] += span.duration
+            item[2] += span.bytes
+        rows = sorted(totals.items(), key=lambda kv: kv[1][1], reverse=True)[:top]
+        return [f"{name:<32} {count:>6} {total * 1000:>10.2f} мс {size:>12} Б"
+                for name, (count, total, size) in rows]
+
+_tracer: Optional[Tracer] = None
+
+def enable() -> Tracer:
+    global _tracer
+    _tracer = Tracer()
+    _instrument_logging()
+    return _tracer
+
+def disable() -> Optional[Tracer]:
+    global _tracer
+    tracer, _tracer = _tracer, None
+    _restore_logging()
+    return tracer
+
+def active() -> bool:
+    return _tracer is not None
+
+def span(name: str, **attrs: Any):
+    if _tracer is None:
+        return _NULL_SPAN
+    return _tracer.span(name, **attrs)
+
+def traced(name: str) -> Callable[[Callable], Callable]:
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs) -> Any:
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with _tracer.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def file_size(path: Any) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+# время вывода логов — спаны log.<logger>; Logger.callHandlers подменяется только на время трассировки
+_original_call_handlers: Optional[Callable] = None
+
+def _instrument_logging() -> None:
+    global _original_call_handlers
+    if _original_call_handlers is not None:
+        return
+    original = _original_call_handlers = logging.Logger.callHandlers
+
+    def call_handlers(self: logging.Logger, record: logging.LogRecord) -> None:
+        with span(f"log.{self.name}"):
+            original(self, record)
+    logging.Logger.callHandlers = call_handlers
+
+def _restore_logging() -> None:
+    global _original_call_handlers
+    if _original_call_handlers is not None:
+        logging.Logger.callHandlers = _original_call_handlers
+        _original_call_handlers = None